@@ -1,4 +1,4 @@
-from database_standards import STANDARDS_TECHNIQUES
+from database_standards import standards_prompt_block
 
 def agent_standardiste(dimensions_estimees: str):
     """
@@ -7,7 +7,8 @@ def agent_standardiste(dimensions_estimees: str):
     """
     prompt = f"""Tu es un expert en métrologie et standards de construction.
     Dimensions analysées : {dimensions_estimees}
-    Référentiel : {STANDARDS_TECHNIQUES}
+    Référentiel (standards compatibles) :
+    {standards_prompt_block(dimensions_estimees)}
     
     Ta mission :
     1. **Identification du Standard** : Détermine le pas (ex: Gaz 1/2", Métrique M8, etc.).
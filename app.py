@@ -1,27 +1,98 @@
 import os
 import base64
-import httpx
 import asyncio
+import codecs
+import hashlib
+import html as html_lib
 import json
 import re
 import time
-import io
-from typing import List, Dict, Any, Optional
-from urllib.parse import urlparse
-from fastapi import FastAPI, UploadFile, Form, File
-from fastapi.responses import HTMLResponse
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import multiprocessing
+from typing import Awaitable, Callable, List, Dict, Any, Optional
+
+import httpx
+from fastapi import FastAPI, UploadFile, Form, File, Query
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from groq import Groq
 from dotenv import load_dotenv
-from PIL import Image, ImageStat
+
 import numpy as np
-from functools import wraps
 
-# Optional: sentence-transformers for CLIP embeddings
-from sentence_transformers import SentenceTransformer, util as st_util
+from groq_vision import VisionStage, VisionOverloaded, VisionTimeout, VisionUnavailable
+from http_pool import HttpPool, read_capped
+from clip_engine import ClipEngine
+from inference_server import RemoteClipEngine
+from shared_cache import SharedCache
+from sourcing_cache import SourcingCache
+from speculation import Speculation, SpeculativeSourcing
+from domain_stats import DomainStats
+from url_normalize import canonical_domain, canonical_url, product_key
+from embedding_store import EmbeddingStore, content_hash
+from async_cache import AsyncTTLCache
+from image_pipeline import prepare_upload
+from result_cache import ResultCache, normalize_text
+from parts_catalogue import PartsCatalogue
+from database_standards import relevant_standards
+from agent_expert_matiere import agent_expert_matiere
+from agent_standardiste import agent_standardiste
+from orchestrator import AgentGraph
+from page_analyzer import PageAnalyzer, PageInfo
+from deadline import Deadline, DeadlineExceeded, hedged, stage_budget
+from rate_limit import CircuitOpen, ProviderLimiter, RateLimited, SingleFlight, retry_after_seconds
+from metrics import enable_trace_log, metrics
+from batch_jobs import BatchJob, BatchStages, RetryLater, collect_inputs, load_records, read_job_file, to_csv, write_job_file
 
 load_dotenv()
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    vision.start(os.environ.get("GROQ_API_KEY"))
+    agent_stage.start(os.environ.get("GROQ_API_KEY"))
+    await http.open()
+    await clip.start()
+    if PREPARE_PROCESSES:
+        # spawn: workers must not inherit the event loop / open sockets of this process
+        _prepare_pool[0] = ProcessPoolExecutor(PREPARE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    if CLIP_WARMUP:
+        # `/` is served right away; /ready turns green once the encoder is loaded
+        task = asyncio.create_task(clip.warm_up())
+        _background.add(task)
+        task.add_done_callback(_background.discard)
+    metrics.start_loop_monitor()
+    try:
+        await asyncio.to_thread(domain_stats.load)
+    except Exception:
+        pass
+    task = asyncio.create_task(_domain_stats_loop())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    try:
+        yield
+    finally:
+        await metrics.stop_loop_monitor()
+        for task in _background:
+            task.cancel()
+        await flush_domain_stats()
+        await clip.close()
+        await http.close()
+        if _prepare_pool[0] is not None:
+            _prepare_pool[0].shutdown(wait=False, cancel_futures=True)
+            _prepare_pool[0] = None
+        if embeddings is not None:
+            embeddings.close()
+        await sourcing_cache.close()
+        if _sourcing_store is not None:
+            _sourcing_store.close()
+        if _domain_store is not None:
+            _domain_store.close()
+        await vision.close()
+        await agent_stage.close()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
@@ -30,13 +101,50 @@ app.add_middleware(
 # -------------------------
 # Configuration production
 # -------------------------
-PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+PERPLEXITY_API_URL = os.environ.get("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
 PERPLEXITY_TIMEOUT = 28.0
 PERPLEXITY_RETRIES = 2
-PERPLEXITY_BACKOFF = 1.2
+PERPLEXITY_HEDGE_AFTER = float(os.environ.get("PERPLEXITY_HEDGE_AFTER", "10"))  # 0 = no hedged request
+
+# End-to-end budget of one identification, shared by the stages below
+IDENTIFY_DEADLINE = float(os.environ.get("IDENTIFY_DEADLINE", "40"))
+SOURCING_RESERVE = float(os.environ.get("SOURCING_RESERVE", "12"))      # kept for Perplexity + validation after vision
+VALIDATION_RESERVE = float(os.environ.get("VALIDATION_RESERVE", "6"))   # kept for validation after Perplexity
+VALIDATION_TIMEOUT = float(os.environ.get("VALIDATION_TIMEOUT", "6"))
+VALIDATION_PER_DOMAIN = int(os.environ.get("VALIDATION_PER_DOMAIN", "3"))
+ENOUGH_VALID_LINKS = int(os.environ.get("ENOUGH_VALID_LINKS", "3"))     # 0 = validate every candidate
+PRERANK_TOP_K = int(os.environ.get("PRERANK_TOP_K", "4"))                # validations in flight, best ranked first; 0 = all at once
+PRERANK_DOMAIN_WEIGHT = float(os.environ.get("PRERANK_DOMAIN_WEIGHT", "0.1"))  # x the merchant's expected yield, added to the text similarity
+_DOMAIN_SEMS: Dict[str, asyncio.Semaphore] = {}
+
+# One JSON line per identification (stage spans) on the partfinder.trace logger
+if os.environ.get("TRACE_LOG") == "1":
+    enable_trace_log()
 
 GROQ_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
-GROQ_TIMEOUT = 30.0
+GROQ_TIMEOUT = float(os.environ.get("GROQ_TIMEOUT", "30"))
+GROQ_MAX_CONCURRENCY = int(os.environ.get("GROQ_MAX_CONCURRENCY", "16"))
+GROQ_MAX_QUEUE = int(os.environ.get("GROQ_MAX_QUEUE", "64"))
+
+# Client-side rate limits, per worker (0 = follow the providers' quota headers / Retry-After only)
+groq_limit = ProviderLimiter("groq", rpm=float(os.environ.get("GROQ_RPM", "0")),
+                             failure_threshold=int(os.environ.get("GROQ_BREAKER_FAILURES", "5")),
+                             cooldown=float(os.environ.get("GROQ_BREAKER_COOLDOWN", "30")))
+perplexity_limit = ProviderLimiter("perplexity", rpm=float(os.environ.get("PERPLEXITY_RPM", "0")),
+                                   failure_threshold=int(os.environ.get("PERPLEXITY_BREAKER_FAILURES", "5")),
+                                   cooldown=float(os.environ.get("PERPLEXITY_BREAKER_COOLDOWN", "30")))
+# Identical queries in flight share one Perplexity call
+_PERPLEXITY_FLIGHTS = SingleFlight(perplexity_limit)
+
+# Shared async vision client (opened in lifespan)
+vision = VisionStage(GROQ_MODEL, GROQ_TIMEOUT, max_concurrency=GROQ_MAX_CONCURRENCY, max_queue=GROQ_MAX_QUEUE,
+                     limiter=groq_limit)
+
+# Shared HTTP connection pool (opened in lifespan)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "40"))
+HTTP_PER_HOST = int(os.environ.get("HTTP_PER_HOST", "8"))
+http = HttpPool(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive=HTTP_MAX_KEEPALIVE, per_host=HTTP_PER_HOST)
 
 # Domains considered trustworthy for product pages (extend as needed)
 WHITELIST_DOMAINS = {
@@ -46,41 +154,131 @@ WHITELIST_DOMAINS = {
 }
 BLACKLIST_PATTERNS = ['/category', '/cat/', '/search', '/recherche', '/famille', '/resultats', 'filter=', '/collections/']
 
-# Simple in-memory TTL cache for URL validation to reduce load
-_URL_VALIDATION_CACHE: Dict[str, Dict[str, Any]] = {}
+# Bounded cache of photo-independent page analyses, keyed by URL
 _URL_CACHE_TTL = 60 * 60 * 24  # 24h
+_URL_CACHE_NEGATIVE_TTL = 60 * 10  # fetch errors are retried after 10 min
+_URL_CACHE_MAX = int(os.environ.get("URL_CACHE_MAX", "4096"))
+_PAGE_CACHE = AsyncTTLCache(
+    maxsize=_URL_CACHE_MAX, ttl=_URL_CACHE_TTL, negative_ttl=_URL_CACHE_NEGATIVE_TTL,
+    is_error=lambda page: page.get("reason") == "fetch_error",
+)
+
+# Byte budgets of the validation fetches (bodies are streamed and cut at the cap)
+PAGE_MAX_BYTES = int(os.environ.get("PAGE_MAX_BYTES", "200000"))
+IMAGE_MAX_BYTES = int(os.environ.get("IMAGE_MAX_BYTES", str(5 * 1024 * 1024)))
+_FETCH_STATS = {"pages": 0, "page_bytes": 0, "pages_stopped_early": 0, "pages_capped": 0,
+                "images": 0, "image_bytes": 0, "images_rejected": 0, "candidates": 0, "candidates_validated": 0,
+                "candidates_duplicates": 0}
 
-# CLIP model (sentence-transformers)
+# CLIP model (loaded in the background after startup, see lifespan)
 CLIP_MODEL_NAME = os.environ.get("CLIP_MODEL_NAME", "clip-ViT-B-32")
+CLIP_MAX_BATCH = int(os.environ.get("CLIP_MAX_BATCH", "16"))
+CLIP_MAX_WAIT_MS = float(os.environ.get("CLIP_MAX_WAIT_MS", "8"))
+CLIP_TORCH_THREADS = int(os.environ.get("CLIP_TORCH_THREADS", "0")) or None
+CLIP_BACKEND = os.environ.get("CLIP_BACKEND", "torch")  # torch | torch-int8 | onnx
+CLIP_ONNX_PATH = os.environ.get("CLIP_ONNX_PATH", ".cache/clip-image.onnx")
+CLIP_WARMUP = os.environ.get("CLIP_WARMUP", "1") == "1"  # 0 = load on the first embedding
+# Multi-worker mode: one inference sidecar (python -m inference_server) holds the model for every worker
+CLIP_SIDECAR = os.environ.get("CLIP_SIDECAR", "")
+if CLIP_SIDECAR:
+    clip = RemoteClipEngine(CLIP_SIDECAR, timeout=float(os.environ.get("CLIP_SIDECAR_TIMEOUT", "10")))
+else:
+    clip = ClipEngine(CLIP_MODEL_NAME, max_batch=CLIP_MAX_BATCH, max_wait_ms=CLIP_MAX_WAIT_MS, torch_threads=CLIP_TORCH_THREADS,
+                      backend=CLIP_BACKEND, onnx_path=CLIP_ONNX_PATH)
+_background: set = set()
+
+# Upload decoding / quality checks in a process pool (0 = thread of this worker)
+PREPARE_PROCESSES = int(os.environ.get("PREPARE_PROCESSES", "0"))
+_prepare_pool: List[Optional[ProcessPoolExecutor]] = [None]  # created in lifespan
+
+# Identification results keyed by perceptual hash of the photo + context
+RESULT_CACHE_MAX = int(os.environ.get("RESULT_CACHE_MAX", "1024"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(60 * 60 * 6)))  # prices move
+RESULT_CACHE_MAX_DISTANCE = int(os.environ.get("RESULT_CACHE_MAX_DISTANCE", "6"))  # bits out of 64
+_RESULT_CACHE = ResultCache(maxsize=RESULT_CACHE_MAX, ttl=RESULT_CACHE_TTL, max_distance=RESULT_CACHE_MAX_DISTANCE)
+
+# Local catalogue of already-sourced parts (served without remote calls above CATALOGUE_MIN_SIM)
+CATALOGUE_DIR = os.environ.get("CATALOGUE_DIR", ".cache/catalogue")
+CATALOGUE_MIN_SIM = float(os.environ.get("CATALOGUE_MIN_SIM", "0.88"))
+CATALOGUE_MAX_RESULTS = int(os.environ.get("CATALOGUE_MAX_RESULTS", "5"))
+
+# Persistent product-image embedding store (shared across workers)
+EMBED_STORE_DIR = os.environ.get("EMBED_STORE_DIR", ".cache/embeddings")
+EMBED_STORE_CAPACITY = int(os.environ.get("EMBED_STORE_CAPACITY", "20000"))
+EMBED_STORE_DIM = int(os.environ.get("EMBED_STORE_DIM", "512"))
+EMBED_STORE_TTL = int(os.environ.get("EMBED_STORE_TTL", str(60 * 60 * 24 * 30)))  # 30 days
+try:
+    embeddings = EmbeddingStore(EMBED_STORE_DIR, dim=EMBED_STORE_DIM, capacity=EMBED_STORE_CAPACITY, ttl_seconds=EMBED_STORE_TTL)
+except Exception:
+    embeddings = None  # run without the on-disk store (read-only FS, ...)
+try:
+    catalogue = PartsCatalogue(CATALOGUE_DIR, dim=EMBED_STORE_DIM)
+except Exception:
+    catalogue = None
+
+# Cross-worker tier of the page and result caches (SQLite file; empty = per-process caches only)
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH", "")
+try:
+    shared = SharedCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+except Exception:
+    shared = None
+
+# Perplexity answers by normalized query (persisted; in the shared cache file when there is one)
+SOURCING_CACHE_PATH = os.environ.get("SOURCING_CACHE_PATH", ".cache/sourcing.db")
+SOURCING_CACHE_TTL = int(os.environ.get("SOURCING_CACHE_TTL", str(60 * 60 * 6)))      # 0 = no cache
+SOURCING_CACHE_STALE = int(os.environ.get("SOURCING_CACHE_STALE", str(60 * 60 * 24)))  # served while refreshing
+SOURCING_CACHE_MAX = int(os.environ.get("SOURCING_CACHE_MAX", "2048"))
+try:
+    _sourcing_store = shared or (SharedCache(SOURCING_CACHE_PATH) if SOURCING_CACHE_PATH and SOURCING_CACHE_TTL else None)
+except Exception:
+    _sourcing_store = None
+sourcing_cache = SourcingCache(_sourcing_store, maxsize=SOURCING_CACHE_MAX, ttl=SOURCING_CACHE_TTL,
+                               stale_ttl=SOURCING_CACHE_STALE)
+
+# Perplexity queries guessed from similar photos / the context, sent while Groq vision runs (extra calls: opt-in)
+SPECULATIVE_SOURCING = os.environ.get("SPECULATIVE_SOURCING", "0") == "1"
+speculative = SpeculativeSourcing(max_queries=int(os.environ.get("SPECULATION_MAX_QUERIES", "2")),
+                                  min_overlap=float(os.environ.get("SPECULATION_MIN_OVERLAP", "0.75")),
+                                  max_distance=int(os.environ.get("SPECULATION_MAX_DISTANCE", "10")))
+
+# Per-merchant yield, latency and timeouts learned from the validations (persisted; shared file when there is one)
+DOMAIN_STATS_PATH = os.environ.get("DOMAIN_STATS_PATH", ".cache/domains.db")
+DOMAIN_SKIP_YIELD = float(os.environ.get("DOMAIN_SKIP_YIELD", "0.05"))     # below this expected yield a merchant is skipped; 0 = never
+DOMAIN_SKIP_MIN_CHECKS = int(os.environ.get("DOMAIN_SKIP_MIN_CHECKS", "20"))
+DOMAIN_EXPLORE = float(os.environ.get("DOMAIN_EXPLORE", "0.05"))            # share of skipped links still checked
+DOMAIN_MIN_TIMEOUT = float(os.environ.get("DOMAIN_MIN_TIMEOUT", "2"))
+DOMAIN_STATS_FLUSH = float(os.environ.get("DOMAIN_STATS_FLUSH", "60"))
 try:
-    _clip_model = SentenceTransformer(CLIP_MODEL_NAME)
+    _domain_store = shared or (SharedCache(DOMAIN_STATS_PATH) if DOMAIN_STATS_PATH else None)
 except Exception:
-    _clip_model = None  # degrade gracefully if not installed
+    _domain_store = None
+# the static whitelist only sets the starting point of merchants with few observations
+domain_stats = DomainStats(_domain_store, prior=lambda domain: 0.6 if domain in WHITELIST_DOMAINS else 0.3,
+                           skip_yield=DOMAIN_SKIP_YIELD, min_checks=DOMAIN_SKIP_MIN_CHECKS, explore=DOMAIN_EXPLORE,
+                           min_timeout=DOMAIN_MIN_TIMEOUT)
+
+async def flush_domain_stats() -> None:
+    delta = domain_stats.begin_flush()
+    if not delta:
+        return
+    try:
+        merged = await asyncio.to_thread(domain_stats.write, delta)
+    except Exception:
+        merged = None
+    domain_stats.end_flush(merged)
+
+async def _domain_stats_loop() -> None:
+    while True:
+        await asyncio.sleep(DOMAIN_STATS_FLUSH)
+        await flush_domain_stats()
 
 # -------------------------
 # Utilities
 # -------------------------
-def ttl_cache(ttl_seconds: int):
-    def decorator(func):
-        cache = {}
-
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            key = (func.__name__, args, tuple(sorted(kwargs.items())))
-            now = time.time()
-            if key in cache:
-                value, ts = cache[key]
-                if now - ts < ttl_seconds:
-                    return value
-            value = await func(*args, **kwargs)
-            cache[key] = (value, now)
-            return value
-        return wrapper
-    return decorator
-
 def domain_from_url(url: str) -> str:
+    # mobile / www / storefront variants of a merchant count as one domain (stats, per-domain limits)
     try:
-        return urlparse(url).netloc.lower().replace('www.', '')
+        return canonical_domain(url)
     except Exception:
         return ""
 
@@ -94,63 +292,9 @@ def is_valid_product_link(url: str) -> bool:
         return False
     return True
 
-def looks_like_product_page_text(html_text: str) -> bool:
-    checks = [
-        r'og:price:amount',
-        r'itemprop=["\']price',
-        r'itemprop=["\']sku',
-        r'\"price\" *: *\"?\d',
-        r'\b(réf|référence|sku|part ?no|partnumber)\b',
-        r'\b\d{1,4}\s?mm\b',
-    ]
-    for pattern in checks:
-        if re.search(pattern, html_text, flags=re.IGNORECASE):
-            return True
-    return False
-
 # -------------------------
 # Image quality checks
 # -------------------------
-def image_brightness(img: Image.Image) -> float:
-    stat = ImageStat.Stat(img.convert("L"))
-    return stat.mean[0]
-
-def variance_of_laplacian_numpy(img: Image.Image) -> float:
-    gray = np.asarray(img.convert("L"), dtype=np.float32)
-    gy, gx = np.gradient(gray)
-    grad_mag = np.sqrt(gx * gx + gy * gy)
-    return float(np.var(grad_mag))
-
-def image_blur_score(img_bytes: bytes) -> float:
-    """
-    Returns a blur score: higher = sharper.
-    Fallback uses numpy gradients if OpenCV not available.
-    """
-    try:
-        import cv2  # type: ignore
-        import numpy as _np  # type: ignore
-        arr = _np.frombuffer(img_bytes, _np.uint8)
-        img = cv2.imdecode(arr, cv2.IMREAD_GRAYSCALE)
-        if img is None:
-            return 0.0
-        lap = cv2.Laplacian(img, cv2.CV_64F)
-        var = float(lap.var())
-        return var
-    except Exception:
-        try:
-            img = Image.open(io.BytesIO(img_bytes))
-            return variance_of_laplacian_numpy(img)
-        except Exception:
-            return 0.0
-
-def image_too_small(img_bytes: bytes, min_pixels: int = 224*224) -> bool:
-    try:
-        img = Image.open(io.BytesIO(img_bytes))
-        w, h = img.size
-        return (w * h) < min_pixels
-    except Exception:
-        return True
-
 def image_quality_check(img_bytes: bytes) -> Dict[str, Any]:
     """
     Returns dict with keys:
@@ -160,51 +304,65 @@ def image_quality_check(img_bytes: bytes) -> Dict[str, Any]:
       - brightness: float
       - size_ok: bool
     """
-    reasons = []
-    blur = image_blur_score(img_bytes)
-    size_ok = not image_too_small(img_bytes)
-    brightness = 0.0
-    try:
-        img = Image.open(io.BytesIO(img_bytes))
-        brightness = image_brightness(img)
-    except Exception:
-        brightness = 0.0
-
-    if blur < 30:
-        reasons.append("image_blurry")
-    if not size_ok:
-        reasons.append("image_too_small")
-    if brightness is not None and brightness < 20:
-        reasons.append("image_too_dark")
-    ok = len(reasons) == 0
-    return {
-        "ok": ok,
-        "reasons": reasons,
-        "blur_score": blur,
-        "brightness": brightness,
-        "size_ok": size_ok
-    }
+    return prepare_upload(img_bytes).quality()
 
 # -------------------------
 # Network helpers
 # -------------------------
-async def _fetch_text(client: httpx.AsyncClient, url: str, timeout: float = 6.0) -> Optional[str]:
+def _charset(response) -> str:
+    charset = response.charset_encoding or "utf-8"
     try:
-        r = await client.get(url, timeout=timeout, follow_redirects=True)
-        ctype = r.headers.get("content-type", "")
-        if "text/html" in ctype or "application/xhtml+xml" in ctype:
-            return r.text[:200000]
-        return ""
+        codecs.lookup(charset)
+    except LookupError:
+        charset = "utf-8"
+    return charset
+
+async def _fetch_page(url: str, timeout: float = 6.0) -> Optional[PageInfo]:
+    """
+    Streams the page into the analyzer and stops reading as soon as every
+    score-relevant signal is known, or after PAGE_MAX_BYTES. Non-HTML answers
+    are analysed as empty pages without downloading their body.
+    """
+    analyzer = PageAnalyzer()
+    try:
+        async with http.stream("GET", url, timeout=timeout, follow_redirects=True) as r:
+            ctype = r.headers.get("content-type", "")
+            if "text/html" not in ctype and "application/xhtml+xml" not in ctype:
+                return analyzer.close()
+            decoder = codecs.getincrementaldecoder(_charset(r))(errors="replace")
+            read = 0
+            _FETCH_STATS["pages"] += 1
+            async for chunk in r.aiter_bytes():
+                chunk = chunk[:PAGE_MAX_BYTES - read]
+                read += len(chunk)
+                if analyzer.feed(decoder.decode(chunk)).complete:
+                    _FETCH_STATS["pages_stopped_early"] += 1
+                    break
+                if read >= PAGE_MAX_BYTES:
+                    _FETCH_STATS["pages_capped"] += 1
+                    break
+            _FETCH_STATS["page_bytes"] += read
+            return analyzer.feed(decoder.decode(b"", final=True), final=True)
     except Exception:
         return None
 
 # -------------------------
 # Perplexity / Sonar call (production)
 # -------------------------
-async def call_perplexity_api(query: str, max_candidates: int = 8) -> Any:
-    api_key = os.environ.get("PERPLEXITY_API_KEY")
-    if not api_key:
+async def call_perplexity_api(query: str, max_candidates: int = 8, deadline: Optional[Deadline] = None) -> Any:
+    if not os.environ.get("PERPLEXITY_API_KEY"):
         return {"error": "PERPLEXITY_API_KEY_MISSING"}
+    # concurrent identifications of the same part wait for the first one's answer
+    # recurring queries are answered from the sourcing cache; a stale entry is refreshed in the background
+    return await sourcing_cache.get_or_fetch(
+        query, max_candidates,
+        fetch=lambda: _PERPLEXITY_FLIGHTS.run((query, max_candidates),
+                                              lambda: _call_perplexity(query, max_candidates, deadline)),
+        refresh=lambda: _call_perplexity(query, max_candidates, None),
+    )
+
+async def _call_perplexity(query: str, max_candidates: int, deadline: Optional[Deadline]) -> Dict[str, Any]:
+    api_key = os.environ.get("PERPLEXITY_API_KEY")
 
     system_content = """
     <system_instructions>
@@ -229,208 +387,451 @@ async def call_perplexity_api(query: str, max_candidates: int = 8) -> Any:
 
     headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
 
-    attempt = 0
-    while attempt <= PERPLEXITY_RETRIES:
+    error = "perplexity_failed"
+    for attempt in range(PERPLEXITY_RETRIES + 1):
+        budget = stage_budget(deadline, PERPLEXITY_TIMEOUT, reserve=VALIDATION_RESERVE)
+        if budget < 1.0:
+            return {"error": "deadline_exceeded"}
+        retry_after = None
         try:
-            async with httpx.AsyncClient() as client:
-                res = await client.post(PERPLEXITY_API_URL, json=data, headers=headers, timeout=PERPLEXITY_TIMEOUT)
-            if res.status_code != 200:
-                attempt += 1
-                await asyncio.sleep(PERPLEXITY_BACKOFF ** attempt)
-                continue
-            payload = res.json()
-            raw = payload.get("choices", [{}])[0].get("message", {}).get("content")
-            if not raw:
-                return {"error": "empty_response"}
-            parsed = json.loads(raw)
-            if isinstance(parsed, dict) and "produits" in parsed:
-                candidates = parsed["produits"]
-            elif isinstance(parsed, list):
-                candidates = parsed
-            else:
-                candidates = parsed if isinstance(parsed, list) else []
-            return {"candidates": candidates}
+            # waits for the provider's quota (shared by every request), fails fast while its circuit is open
+            probe = await perplexity_limit.acquire(max_wait=budget - 1.0)
+            budget = stage_budget(deadline, PERPLEXITY_TIMEOUT, reserve=VALIDATION_RESERVE)
+            # a second identical request is sent if the first is slower than usual (not while throttled),
+            # only when the limiter has a token for it right away
+            hedge_after = 0 if perplexity_limit.throttling else PERPLEXITY_HEDGE_AFTER
+            try:
+                return await hedged(lambda: _perplexity_once(data, headers, budget), hedge_after, budget,
+                                    allow_hedge=perplexity_limit.try_acquire)
+            finally:
+                if probe:
+                    perplexity_limit.release_probe()  # no-op once the call recorded an outcome
+        except CircuitOpen:
+            return {"error": "perplexity_unavailable"}
+        except RateLimited:
+            return {"error": "perplexity_rate_limited"}
+        except DeadlineExceeded:
+            error = "perplexity_timeout"
+        except httpx.HTTPStatusError as e:
+            error = "perplexity_rate_limited" if e.response.status_code == 429 else "perplexity_failed"
+            if e.response.status_code < 500 and e.response.status_code != 429:
+                return {"error": error}  # our request is wrong (auth, payload): retrying cannot help
+            retry_after = retry_after_seconds(e.response.headers)
         except Exception as e:
-            attempt += 1
-            if attempt > PERPLEXITY_RETRIES:
-                return {"error": f"perplexity_error:{str(e)[:200]}"}
-            await asyncio.sleep(PERPLEXITY_BACKOFF ** attempt)
-    return {"error": "perplexity_failed"}
+            error = f"perplexity_error:{str(e)[:200]}"
+        if attempt < PERPLEXITY_RETRIES:
+            delay = perplexity_limit.backoff(attempt, retry_after)
+            if deadline is not None and delay > deadline.remaining() - VALIDATION_RESERVE:
+                break  # the retry could not complete in time anyway
+            perplexity_limit.stats["retries"] += 1
+            await (deadline.sleep if deadline is not None else asyncio.sleep)(delay)
+    return {"error": error}
+
+async def _perplexity_once(data: Dict[str, Any], headers: Dict[str, str], timeout: float) -> Dict[str, Any]:
+    try:
+        with metrics.timed("perplexity"):
+            res = await http.post(PERPLEXITY_API_URL, json=data, headers=headers, timeout=timeout)
+    except httpx.TransportError:
+        perplexity_limit.record(None)
+        raise
+    perplexity_limit.record(res.status_code, res.headers)
+    res.raise_for_status()
+    payload = res.json()
+    raw = payload.get("choices", [{}])[0].get("message", {}).get("content")
+    if not raw:
+        return {"error": "empty_response"}
+    parsed = json.loads(raw)
+    if isinstance(parsed, dict) and "produits" in parsed:
+        candidates = parsed["produits"]
+    elif isinstance(parsed, list):
+        candidates = parsed
+    else:
+        candidates = parsed if isinstance(parsed, list) else []
+    return {"candidates": candidates}
 
 # -------------------------
 # Image / visual helpers (CLIP)
 # -------------------------
-def extract_product_image_url(html_text: str) -> str:
-    if not html_text:
-        return ""
-    m = re.search(r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', html_text, flags=re.IGNORECASE)
-    if m:
-        return m.group(1)
-    m = re.search(r'<meta[^>]+name=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', html_text, flags=re.IGNORECASE)
-    if m:
-        return m.group(1)
-    m = re.search(r'<meta[^>]+itemprop=["\']image["\'][^>]+content=["\']([^"\']+)["\']', html_text, flags=re.IGNORECASE)
-    if m:
-        return m.group(1)
-    m = re.search(r'<img[^>]+class=["\'][^"\']*(product|produit)[^"\']*["\'][^>]+src=["\']([^"\']+)["\']', html_text, flags=re.IGNORECASE)
-    if m:
-        return m.group(2)
-    m = re.search(r'<img[^>]+src=["\']([^"\']+)["\']', html_text, flags=re.IGNORECASE)
-    if m:
-        return m.group(1)
-    return ""
-
 async def fetch_image_bytes(url: str, timeout: float = 6.0) -> Optional[bytes]:
+    """Product image body, or None if it is not an image or exceeds IMAGE_MAX_BYTES (checked on headers first)."""
     try:
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, timeout=timeout, follow_redirects=True)
+        async with http.stream("GET", url, timeout=timeout, follow_redirects=True) as r:
             ctype = r.headers.get("content-type", "")
-            if r.status_code == 200 and ("image/" in ctype or url.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))):
-                return r.content
+            if r.status_code != 200 or not ("image/" in ctype or url.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))):
+                return None
+            body = await read_capped(r, IMAGE_MAX_BYTES)
+            if body is None:
+                _FETCH_STATS["images_rejected"] += 1
+                return None
+            _FETCH_STATS["images"] += 1
+            _FETCH_STATS["image_bytes"] += len(body)
+            return body
     except Exception:
         return None
-    return None
 
-def image_embedding_from_bytes(img_bytes: bytes):
-    if _clip_model is None:
-        return None
+async def image_embedding_from_bytes(img_bytes):
+    """Accepts raw image bytes or an already decoded PIL image."""
     try:
-        pil_img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        emb = _clip_model.encode(pil_img, convert_to_tensor=True, normalize_embeddings=True)
-        return emb
+        with metrics.timed("clip_embed"):
+            return await clip.embed(img_bytes)
     except Exception:
         return None
 
+async def product_image_embedding(img_url: str, timeout: float = 6.0):
+    """
+    Embedding of a merchant product image, from the on-disk store when already known.
+    The URL is fetched as the page gave it: CDN and signed image URLs depend on their query.
+    """
+    if embeddings is not None:
+        emb = await asyncio.to_thread(embeddings.get_by_url, img_url)
+        if emb is not None:
+            return emb
+    with metrics.timed("image_fetch"):
+        img_bytes = await fetch_image_bytes(img_url, timeout=timeout)
+    if not img_bytes:
+        return None
+    h = content_hash(img_bytes)
+    if embeddings is not None:
+        # Same picture served under another URL (CDN variants, other merchant).
+        emb = await asyncio.to_thread(embeddings.get_by_hash, h)
+        if emb is not None:
+            await asyncio.to_thread(embeddings.put, img_url, h, emb)
+            return emb
+    emb = await image_embedding_from_bytes(img_bytes)
+    if emb is not None and embeddings is not None:
+        try:
+            await asyncio.to_thread(embeddings.put, img_url, h, emb)
+        except Exception:
+            pass
+    return emb
+
+async def prepare(raw_bytes: bytes):
+    """prepare_upload off the event loop: in the process pool when configured, else in a thread."""
+    pool = _prepare_pool[0]
+    if pool is None:
+        return await asyncio.to_thread(prepare_upload, raw_bytes)
+    return await asyncio.get_running_loop().run_in_executor(pool, prepare_upload, raw_bytes)
+
 def cosine_similarity_score(a, b) -> float:
     try:
-        return float(st_util.cos_sim(a, b).item())
+        a, b = (np.asarray(v.detach().cpu().numpy() if hasattr(v, "detach") else v, dtype=np.float32).reshape(-1) for v in (a, b))
+        return float(a @ b / ((np.linalg.norm(a) * np.linalg.norm(b)) or 1.0))
     except Exception:
         return 0.0
 
 # -------------------------
 # URL validation (production) with visual similarity
 # -------------------------
-@ttl_cache(_URL_CACHE_TTL)
-async def validate_product_url(url: str, photo_emb=None, timeout: float = 6.0) -> Dict[str, Any]:
+async def analyze_product_page(url: str, timeout: float = 6.0) -> Dict[str, Any]:
+    """Photo-independent part of the validation (page fetch, HTML score, product embedding)."""
+    domain = domain_from_url(url)
+    base_html_score = 35 if domain in WHITELIST_DOMAINS else 10
+
+    started = time.perf_counter()
+    with metrics.timed("page_fetch"):
+        info = await _fetch_page(url, timeout=timeout)
+    elapsed = time.perf_counter() - started
+    # `timeout` is the domain's own (never cut by a request deadline): hitting it says something about the merchant
+    domain_stats.record_fetch(domain, elapsed, ok=info is not None, timed_out=info is None and elapsed >= 0.95 * timeout,
+                              has_image=info is not None and bool(info.image))
+    if info is None:
+        return {"url": url, "ok": False, "score": 0, "reason": "fetch_error"}
+
+    html_score = info.html_score(base_html_score)
+
+    prod_img_url = info.image
+    prod_emb = await product_image_embedding(prod_img_url, timeout=timeout) if prod_img_url else None
+    return {
+        "url": url,
+        "html_score": html_score,
+        "domain": domain,
+        "product_image": prod_img_url,
+        "product_emb": prod_emb,
+        "page_price": info.price,
+        "currency": info.currency,
+        "sku": info.sku,
+        "availability": info.availability,
+    }
+
+async def load_product_page(url: str, timeout: float = 6.0,
+                            on_analysed: Optional[Callable[[Dict[str, Any]], Any]] = None) -> Dict[str, Any]:
+    """
+    analyze_product_page behind the shared tier: a page analysed by another worker is not fetched again.
+    `on_analysed(page)` is called when the page was analysed here (not found in the shared tier).
+    """
+    if shared is not None:
+        try:
+            page = await asyncio.to_thread(shared.get, "pages", product_key(url))
+        except Exception:
+            page = None
+        if page is not None:
+            if "html_score" in page:
+                # embeddings stay in the embedding store, only the image URL is shared
+                img = page.get("product_image")
+                page["product_emb"] = await product_image_embedding(img, timeout=timeout) if img else None
+            return page
+    page = await analyze_product_page(url, timeout=timeout)
+    if on_analysed is not None:
+        on_analysed(page)
+    if shared is not None:
+        ttl = _URL_CACHE_NEGATIVE_TTL if page.get("reason") == "fetch_error" else _URL_CACHE_TTL
+        try:
+            await asyncio.to_thread(shared.set, "pages", product_key(url),
+                                    {k: v for k, v in page.items() if k != "product_emb"}, ttl)
+        except Exception:
+            pass
+    return page
+
+async def validate_product_url(url: str, photo_emb=None, timeout: float = 6.0,
+                               budget: Optional[float] = None) -> Dict[str, Any]:
+    """
+    `timeout` bounds the page load itself and must not be shortened by the
+    request deadline: the load is shared and cached, a fetch cut short would
+    be cached as a fetch error. `budget` only bounds how long this caller
+    waits; past it the load runs on behind the cache's shield.
+    """
     if not is_valid_product_link(url):
         return {"url": url, "ok": False, "score": 0, "reason": "invalid_format_or_blacklisted"}
-
     domain = domain_from_url(url)
-    base_html_score = 35 if domain in WHITELIST_DOMAINS else 10
+    if domain_stats.should_skip(domain):
+        return {"url": url, "ok": False, "score": 0, "reason": "low_domain_yield"}
 
-    async with httpx.AsyncClient() as client:
-        text = await _fetch_text(client, url, timeout=timeout)
-        if text is None:
-            return {"url": url, "ok": False, "score": 0, "reason": "fetch_error"}
-
-        html_score = base_html_score
-        if looks_like_product_page_text(text):
-            html_score += 50
-        if re.search(r'(\d[\d\s,.]{1,6})\s?(€|eur|€)', text, flags=re.IGNORECASE):
-            html_score += 10
-        if re.search(r'\b(réf|référence|sku|part ?no|partnumber)\b', text, flags=re.IGNORECASE):
-            html_score += 10
-
-        prod_img_url = extract_product_image_url(text)
-        visual_similarity = None
-        visual_score = 0
-        if prod_img_url:
-            img_bytes = await fetch_image_bytes(prod_img_url, timeout=timeout)
-            if img_bytes:
-                prod_emb = image_embedding_from_bytes(img_bytes)
-                if prod_emb is not None and photo_emb is not None:
-                    sim = cosine_similarity_score(photo_emb, prod_emb)
-                    visual_similarity = sim
-                    if sim >= 0.45:
-                        visual_score = 50
-                    elif sim >= 0.30:
-                        visual_score = int(25 + (sim - 0.30) / 0.15 * 25)
-                    elif sim >= 0.20:
-                        visual_score = 10
-                    else:
-                        visual_score = 0
-                else:
-                    visual_similarity = None
-                    visual_score = 0
-            else:
-                visual_similarity = None
-                visual_score = 0
+    # keyed by product: another URL of an already analysed product reuses its analysis
+    # the domain's stats only learn from pages analysed for this call: a cached or joined page (above all a
+    # cached fetch error) was already counted when it was analysed
+    analysed: List[Dict[str, Any]] = []
+    load = _PAGE_CACHE.get_or_load(product_key(url),
+                                   lambda: load_product_page(url, timeout=timeout, on_analysed=analysed.append))
+    try:
+        page = await (asyncio.wait_for(load, budget) if budget is not None else load)
+    except asyncio.TimeoutError:
+        return {"url": url, "ok": False, "score": 0, "reason": "deadline_exceeded"}
+    if page.get("reason") == "fetch_error":
+        if analysed and photo_emb is not None:
+            domain_stats.record_check(domain, False)
+        return page
+
+    html_score = page["html_score"]
+    prod_emb = page["product_emb"]
+    visual_similarity = None
+    visual_score = 0
+    if prod_emb is not None and photo_emb is not None:
+        sim = cosine_similarity_score(photo_emb, prod_emb)
+        visual_similarity = sim
+        if sim >= 0.45:
+            visual_score = 50
+        elif sim >= 0.30:
+            visual_score = int(25 + (sim - 0.30) / 0.15 * 25)
+        elif sim >= 0.20:
+            visual_score = 10
         else:
-            visual_similarity = None
             visual_score = 0
 
-        total_score = html_score + visual_score
-        ok = (total_score >= 70) and (visual_score >= 10)
-        reason = "ok" if ok else ("low_similarity" if visual_score < 10 else "low_score")
-
-        return {
-            "url": url,
-            "ok": ok,
-            "score": total_score,
-            "reason": reason,
-            "visual_similarity": visual_similarity,
-            "visual_score": visual_score,
-            "html_score": html_score,
-            "domain": domain,
-            "product_image": prod_img_url
-        }
+    total_score = html_score + visual_score
+    ok = (total_score >= 70) and (visual_score >= 10)
+    reason = "ok" if ok else ("low_similarity" if visual_score < 10 else "low_score")
+    if analysed and photo_emb is not None:
+        # without a photo embedding nothing can pass: that says nothing about the merchant
+        domain_stats.record_check(domain, ok)
+
+    return {
+        "url": url,
+        "ok": ok,
+        "score": total_score,
+        "reason": reason,
+        "visual_similarity": visual_similarity,
+        "visual_score": visual_score,
+        "html_score": html_score,
+        "domain": page["domain"],
+        "product_image": page["product_image"],
+        "product_emb": page["product_emb"],
+        "page_price": page.get("page_price", ""),
+        "currency": page.get("currency", ""),
+        "sku": page.get("sku", ""),
+        "availability": page.get("availability", ""),
+    }
 
 # -------------------------
 # High-level pipeline
 # -------------------------
-async def search_perplexity_async(photo_bytes: bytes, query: str, max_candidates: int = 8) -> List[Dict[str, Any]]:
-    if not query:
-        return []
+def _domain_sem(domain: str) -> asyncio.Semaphore:
+    # shared by every request of the worker: one slow merchant cannot take all the slots
+    sem = _DOMAIN_SEMS.get(domain)
+    if sem is None:
+        sem = _DOMAIN_SEMS[domain] = asyncio.Semaphore(VALIDATION_PER_DOMAIN)
+    return sem
+
+def _metric_domain(url: str) -> str:
+    # bounded label set: merchants outside the whitelist are aggregated
+    domain = domain_from_url(url)
+    return domain if domain in WHITELIST_DOMAINS else "other"
+
+def _candidate_row(item: Dict[str, Any], v: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "nom": item.get("nom"),
+        "prix": item.get("prix"),
+        "url": item.get("url"),
+        "source": item.get("source"),
+        "valid": v.get("ok", False),
+        "score": v.get("score", 0),
+        "reason": v.get("reason"),
+        "visual_similarity": v.get("visual_similarity"),
+        "visual_score": v.get("visual_score"),
+        "html_score": v.get("html_score"),
+        "product_image": v.get("product_image"),
+        "product_emb": v.get("product_emb"),
+        "raw": item.get("raw")
+    }
 
-    resp = await call_perplexity_api(query, max_candidates=max_candidates)
+async def iter_validated_candidates(photo, query: str, max_candidates: int = 8, photo_emb=None,
+                                    deadline: Optional[Deadline] = None, enough: int = ENOUGH_VALID_LINKS,
+                                    prefetched: Optional[Awaitable[Dict[str, Any]]] = None):
+    """
+    Yields each candidate as soon as its own validation completes (or a single {"error": ...}).
+    Stops validating once `enough` links are valid; at the deadline the links
+    still being checked are yielded unvalidated (reason "deadline_exceeded").
+    `prefetched` is a speculative Perplexity answer standing in for `query`.
+    """
+    # The photo embedding is batched off-loop; let it run while Perplexity answers.
+    photo_emb_task = None
+    if photo_emb is None:
+        photo_emb_task = asyncio.create_task(image_embedding_from_bytes(photo))
+    resp = await prefetched if prefetched is not None else None
+    if resp is None or "error" in resp:
+        resp = await call_perplexity_api(query, max_candidates=max_candidates, deadline=deadline)
     if "error" in resp:
-        return [{"error": resp["error"]}]
+        if photo_emb_task is not None:
+            photo_emb_task.cancel()
+        yield {"error": resp["error"]}
+        return
 
-    candidates = resp.get("candidates", [])[:max_candidates]
-    normalized = []
-    for c in candidates:
+    # The same product often comes back under several URLs (tracking parameters,
+    # mobile host, Amazon URL shapes): it is validated once, under its canonical URL.
+    normalized, by_key = [], {}
+    for c in resp.get("candidates", []):
         if isinstance(c, dict) and c.get("url"):
-            normalized.append({
+            url = canonical_url(str(c["url"]))
+            key = product_key(url)
+            first = by_key.get(key)
+            if first is not None:
+                first["nom"] = first["nom"] or c.get("nom") or ""
+                first["prix"] = first["prix"] or c.get("prix") or ""
+                _FETCH_STATS["candidates_duplicates"] += 1
+                continue
+            by_key[key] = {
                 "nom": c.get("nom") or "",
                 "prix": c.get("prix") or "",
-                "url": c.get("url"),
-                "source": c.get("source") or domain_from_url(c.get("url", "")),
+                "url": url,
+                "source": c.get("source") or domain_from_url(url),
                 "raw": c
-            })
+            }
+            normalized.append(by_key[key])
+    normalized = normalized[:max_candidates]
 
-    photo_emb = None
-    try:
-        photo_emb = image_embedding_from_bytes(photo_bytes)
-    except Exception:
-        photo_emb = None
+    if photo_emb_task is not None:
+        try:
+            photo_emb = await asyncio.wait_for(photo_emb_task, timeout=stage_budget(deadline, VALIDATION_TIMEOUT))
+        except asyncio.TimeoutError:
+            photo_emb = None
+
+    # Most promising first, at most PRERANK_TOP_K pages being checked: a slot
+    # freed by a rejected link goes to the next one, so unlikely candidates are
+    # only fetched when the likely ones fail. Without a photo embedding no link
+    # can pass the visual check, so every one is checked at once.
+    if PRERANK_TOP_K:
+        normalized = await prerank_candidates(normalized, photo_emb)
+    window = PRERANK_TOP_K if PRERANK_TOP_K and photo_emb is not None else len(normalized)
+    waiting = list(reversed(normalized))
+    _FETCH_STATS["candidates"] += len(normalized)
 
-    sem = asyncio.Semaphore(8)
     async def _validate_item(item):
-        async with sem:
-            v = await validate_product_url(item["url"], photo_emb=photo_emb)
-            merged = {
-                "nom": item.get("nom"),
-                "prix": item.get("prix"),
-                "url": item.get("url"),
-                "source": item.get("source"),
-                "valid": v.get("ok", False),
-                "score": v.get("score", 0),
-                "reason": v.get("reason"),
-                "visual_similarity": v.get("visual_similarity"),
-                "visual_score": v.get("visual_score"),
-                "html_score": v.get("html_score"),
-                "product_image": v.get("product_image"),
-                "raw": item.get("raw")
-            }
-            return merged
+        domain = domain_from_url(item["url"])
+        async with _domain_sem(domain):
+            timeout = domain_stats.timeout(domain, VALIDATION_TIMEOUT)
+            with metrics.timed("validate"):
+                v = await validate_product_url(item["url"], photo_emb=photo_emb, timeout=timeout,
+                                               budget=stage_budget(deadline, timeout))
+            return _candidate_row(item, v)
+
+    def _refill():
+        while waiting and len(pending) < window:
+            item = waiting.pop()
+            _FETCH_STATS["candidates_validated"] += 1
+            pending[asyncio.create_task(_validate_item(item))] = item
 
-    tasks = [_validate_item(it) for it in normalized]
-    validated = await asyncio.gather(*tasks, return_exceptions=False) if tasks else []
+    # Stragglers are cancelled below; a page load they started keeps running
+    # behind the page cache's shield and is cached for the next request.
+    pending: Dict[asyncio.Task, Dict[str, Any]] = {}
+    _refill()
+    valid_count = 0
+    try:
+        while pending:
+            timeout = deadline.remaining() if deadline is not None else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            for task in done:
+                item = pending.pop(task)
+                if task.exception() is not None:
+                    yield _candidate_row(item, {"reason": "validation_error"})
+                    continue
+                row = task.result()
+                valid_count += bool(row["valid"])
+                metrics.inc("candidates_total", domain=_metric_domain(row["url"]), valid=str(bool(row["valid"])).lower())
+                yield row
+            if enough and valid_count >= enough:
+                return
+            _refill()
+        for item in list(pending.values()) + waiting[::-1]:
+            yield _candidate_row(item, {"reason": "deadline_exceeded"})
+    finally:
+        # consumer went away (client disconnected), enough links or deadline: drop the stragglers
+        for t in pending:
+            t.cancel()
 
+async def prerank_candidates(items: List[Dict[str, Any]], photo_emb=None) -> List[Dict[str, Any]]:
+    """
+    Orders candidates before any page is fetched: CLIP similarity between the
+    photo and the listing text (name + merchant), the merchant's expected
+    yield, then Perplexity's own order. Links that cannot be product pages go last.
+    """
+    sims = [0.0] * len(items)
+    if photo_emb is not None and len(items) > 1:
+        texts = [" ".join(filter(None, [it["nom"], it["source"]]))[:200] for it in items]
+        try:
+            with metrics.timed("prerank"):
+                text_embs = await clip.embed_texts(texts)
+        except Exception:
+            text_embs = None
+        if text_embs is not None:
+            photo = np.asarray(photo_emb.detach().cpu().numpy() if hasattr(photo_emb, "detach") else photo_emb,
+                               dtype=np.float32).reshape(-1)
+            sims = (np.asarray(text_embs, dtype=np.float32) @ photo / max(float(np.linalg.norm(photo)), 1e-12)).tolist()
+
+    def _score(i: int) -> float:
+        url = items[i]["url"]
+        if not is_valid_product_link(url):
+            return -1.0
+        return sims[i] + PRERANK_DOMAIN_WEIGHT * domain_stats.expected_yield(domain_from_url(url)) - 0.001 * i
+
+    return [items[i] for i in sorted(range(len(items)), key=_score, reverse=True)]
+
+def rank_candidates(validated: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     validated_sorted = sorted(validated, key=lambda x: (1 if x["valid"] else 0, x["score"]), reverse=True)
     valid = [v for v in validated_sorted if v["valid"]]
     return valid if valid else validated_sorted
 
+async def search_perplexity_async(photo, query: str, max_candidates: int = 8, photo_emb=None,
+                                  deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
+    if not query:
+        return []
+
+    validated = [v async for v in iter_validated_candidates(photo, query, max_candidates=max_candidates,
+                                                            photo_emb=photo_emb, deadline=deadline)]
+    if validated and "error" in validated[0]:
+        return validated
+    return rank_candidates(validated)
+
 # -------------------------
 # HTML rendering helper
 # -------------------------
@@ -455,91 +856,620 @@ def format_links_html(products: List[Dict[str, Any]]) -> str:
         html += f'<a href="{url}" target="_blank" class="buy-link">🛒 {name} - {price}{extra}</a>'
     return html
 
+def render_quality_error(quality: Dict[str, Any]) -> str:
+    reasons_map = {
+        "image_blurry": "Image floue ou manque de netteté",
+        "image_too_small": "Image trop petite / faible résolution",
+        "image_too_dark": "Image trop sombre"
+    }
+    reasons_text = ", ".join(reasons_map.get(r, r) for r in quality["reasons"])
+    return f"""
+    <div class="results animate-in">
+        <div class="res-card" style="color:#b91c1c"><strong>⚠️ Qualité image insuffisante</strong>
+        <p>La photo fournie semble inadaptée pour un sourcing fiable : {reasons_text}.</p>
+        <p>Score netteté: {quality['blur_score']:.1f} • Luminosité: {quality['brightness']:.1f}</p>
+        </div>
+        <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list">Aucun résultat — améliore la photo et réessaie.</div></div>
+        <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
+    </div>
+    """
+
+def render_report(text: Optional[str]) -> str:
+    """Agent answer (light Markdown) as HTML."""
+    if not text:
+        return "<p style='opacity:.6'>Analyse indisponible.</p>"
+    body = re.sub(r"\*\*(.+?)\*\*", r"<strong>\1</strong>", html_lib.escape(text.strip()))
+    return "<p>" + body.replace("\n", "<br>") + "</p>"
+
+def render_results(data: Dict[str, Any], links_html: str, pending: bool = False,
+                   reports: Optional[Dict[str, Optional[str]]] = None) -> str:
+    """`reports`: agent name -> answer (None while the agent is still running: the card is filled by a `report` event)."""
+    links_attrs = ' id="links" data-pending="1"' if pending else ' id="links"'
+    report_cards = "".join(
+        f"<div class=\"res-card\"><strong>{title}</strong><div id=\"report-{name}\">"
+        f"{render_report(reports[name]) if reports[name] is not None else '<p>⏳ Analyse en cours...</p>'}</div></div>"
+        for name, title in AGENT_CARDS if name in reports
+    ) if reports else ""
+    return f"""
+    <div class="results animate-in">
+        <div class="res-card mat"><strong>🧪 Matière</strong><p>{data.get('mat')}</p></div>
+        <div class="res-card std"><strong>📏 Technique</strong><p>{data.get('std')}</p></div>
+        {report_cards}
+        <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list"{links_attrs}>{links_html}</div></div>
+        <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
+    </div>
+    """
+
+class IdentifyAbort(Exception):
+    """Stops the pipeline early; `html` is the message to show to the technician."""
+    def __init__(self, html: str, retryable: bool = False):
+        super().__init__(html)
+        self.html = html
+        self.retryable = retryable  # saturation, worth retrying later (batch jobs)
+
+    @property
+    def text(self) -> str:
+        return " ".join(re.sub(r"<[^>]+>", " ", self.html).split())
+
+async def run_vision(prepared, context: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """Groq call on the prepared photo. Returns the parsed JSON (mat / std / search ...)."""
+    img_b64 = base64.b64encode(prepared.vision_jpeg).decode('utf-8')
+    prompt = "ID TECHNIQUE. Format JSON: {\"mat\": \"\", \"std\": \"\", \"search\": \"\"}"
+    # Only the standards matching the technician's context, not the whole referential
+    known = relevant_standards(context)
+    if known:
+        prompt += " Standards compatibles: " + "; ".join(s.describe().lstrip("- ") for s in known)
+
+    timeout = stage_budget(deadline, GROQ_TIMEOUT, reserve=SOURCING_RESERVE)
+    try:
+        with metrics.timed("vision"):
+            content = await vision.complete(
+                [{"role": "user", "content": [{"type": "text", "text": f"{prompt} Context: {context}"}, {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}]}],
+                timeout=timeout,
+                response_format={"type": "json_object"}
+            )
+    except VisionOverloaded:
+        raise IdentifyAbort(f"<div class='res-card' style='color:red'>Serveur saturé : trop d'identifications en cours, réessaie dans un instant.</div>", retryable=True)
+    except VisionTimeout:
+        raise IdentifyAbort(f"<div class='res-card' style='color:red'>Erreur Vision : délai dépassé ({timeout:.0f}s).</div>", retryable=True)
+    except VisionUnavailable:
+        raise IdentifyAbort(f"<div class='res-card' style='color:red'>Service d'identification momentanément indisponible (limite de débit atteinte), réessaie dans un instant.</div>", retryable=True)
+
+    try:
+        data = json.loads(content)
+    except Exception:
+        raise IdentifyAbort(f"<div class='res-card' style='color:red'>Erreur: réponse du modèle illisible.</div>")
+
+    model_note = data.get("note") or ""
+    model_confidence = data.get("confidence")
+    if isinstance(model_confidence, (int, float)) and model_confidence < 0.4:
+        raise IdentifyAbort(f"""
+        <div class="results animate-in">
+            <div class="res-card" style="color:#b91c1c"><strong>⚠️ Confiance modèle faible</strong>
+            <p>Le modèle indique une faible confiance ({model_confidence:.2f}) pour l'identification. {model_note}</p>
+            </div>
+            <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list">Aucun résultat — fournis une photo plus nette ou plus d'angles.</div></div>
+            <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
+        </div>
+        """)
+    return data
+
+def catalogue_lookup(photo_emb) -> Optional[Dict[str, Any]]:
+    """High-confidence matches from the local catalogue, shaped like a cached result."""
+    if catalogue is None or photo_emb is None:
+        return None
+    hits = catalogue.search(photo_emb, k=CATALOGUE_MAX_RESULTS, min_similarity=CATALOGUE_MIN_SIM)
+    if not hits:
+        return None
+    best = hits[0][1]
+    candidates = [{
+        "nom": item["name"],
+        "prix": item["price"],
+        "url": item["url"],
+        "source": item["domain"],
+        "valid": True,
+        "score": item["score"],
+        "reason": "catalogue",
+        "visual_similarity": sim,
+        "product_image": item["product_image"],
+    } for sim, item in hits]
+    return {"data": {"mat": best["mat"], "std": best["std"]}, "candidates": candidates}
+
+async def lookup_known_part(prepared, context: str):
+    """Result cache, then local catalogue. Returns (result or None, photo embedding or None)."""
+    cached = _RESULT_CACHE.lookup(prepared.phash, context)
+    if cached is None and shared is not None:
+        try:
+            cached = await asyncio.to_thread(_shared_result_lookup, prepared.phash, context)
+        except Exception:
+            cached = None
+        if cached is not None:
+            _RESULT_CACHE.store(prepared.phash, context, cached)
+    if cached is not None:
+        return cached, None
+    photo_emb = await image_embedding_from_bytes(prepared.clip_image)
+    if catalogue is None or photo_emb is None:
+        return None, photo_emb
+    # the search stats the directory, tails the journal and may reload it: kept off the event loop
+    return await asyncio.to_thread(catalogue_lookup, photo_emb), photo_emb
+
+def _shared_result_lookup(phash: int, context: str) -> Optional[Dict[str, Any]]:
+    """Nearest stored photo (same context, within RESULT_CACHE_MAX_DISTANCE bits) in the shared tier."""
+    prefix = normalize_text(context) + "\x1f"
+    best_key, best_dist = None, RESULT_CACHE_MAX_DISTANCE + 1
+    for key in shared.keys("results", prefix):
+        dist = (int(key[len(prefix):], 16) ^ phash).bit_count()
+        if dist < best_dist:
+            best_key, best_dist = key, dist
+    return shared.get("results", best_key) if best_key is not None else None
+
+def _catalogue_insert(data: Dict[str, Any], candidates: List[Dict[str, Any]]) -> None:
+    for c in candidates:
+        if c.get("valid") and c.get("product_emb") is not None:
+            catalogue.add(c["product_emb"], name=c.get("nom") or "", url=c["url"], price=c.get("prix") or "",
+                          mat=data.get("mat") or "", std=data.get("std") or "", domain=c.get("source") or "",
+                          product_image=c.get("product_image") or "", score=c.get("score", 0))
+
+async def remember_result(prepared, context: str, data: Dict[str, Any], candidates: List[Dict[str, Any]]) -> None:
+    """Feeds the result cache and the local catalogue with a run that produced valid links."""
+    if not any(c.get("valid") for c in candidates):
+        return
+    _RESULT_CACHE.store(prepared.phash, context, {"data": data, "candidates": candidates})
+    if shared is not None:
+        key = f"{normalize_text(context)}\x1f{prepared.phash:016x}"
+        result = {"data": data, "candidates": [{k: v for k, v in c.items() if k != "product_emb"} for c in candidates]}
+        try:
+            await asyncio.to_thread(shared.set, "results", key, result, RESULT_CACHE_TTL)
+        except Exception:
+            pass
+    if catalogue is not None:
+        try:
+            await asyncio.to_thread(_catalogue_insert, data, candidates)
+        except Exception:
+            pass
+
+def search_query_from(data: Dict[str, Any]) -> str:
+    search_query = data.get("search") or ""
+    if not search_query:
+        parts = []
+        if data.get("mat"):
+            parts.append(data.get("mat"))
+        if data.get("std"):
+            parts.append(data.get("std"))
+        search_query = " ".join(parts).strip()
+    if not search_query:
+        raise IdentifyAbort(f"<div class='res-card' style='color:red'>Erreur: aucun terme de recherche généré par le modèle.</div>")
+    return search_query
+
+# -------------------------
+# Multi-agent analysis: vision, then material / standards agents and sourcing concurrently
+# -------------------------
+AGENT_REPORTS = os.environ.get("AGENT_REPORTS", "0") == "1"  # two extra Groq calls per identification
+AGENT_TIMEOUT = float(os.environ.get("AGENT_TIMEOUT", "10"))
+AGENT_CARDS = (("matiere", "🔬 Expertise matière"), ("standardiste", "📐 Standard & équivalences"))
+# The text agents have their own Groq slots and queue (same provider limiter): optional reports never
+# take a vision call's slot or fill its queue
+AGENT_MAX_CONCURRENCY = int(os.environ.get("AGENT_MAX_CONCURRENCY", "4"))
+AGENT_MAX_QUEUE = int(os.environ.get("AGENT_MAX_QUEUE", "16"))
+agent_stage = VisionStage(GROQ_MODEL, AGENT_TIMEOUT, max_concurrency=AGENT_MAX_CONCURRENCY,
+                          max_queue=AGENT_MAX_QUEUE, limiter=groq_limit)
+# Agent answers by prompt: the same part seen again (or by another agent run) is not asked twice
+_AGENT_CACHE = AsyncTTLCache(maxsize=int(os.environ.get("AGENT_CACHE_MAX", "512")),
+                             ttl=float(os.environ.get("AGENT_CACHE_TTL", str(60 * 60 * 24))),
+                             negative_ttl=0, is_error=lambda answer: not answer)
+AGENT_SYSTEM = ("Tu es un agent spécialisé de PartFinder AI (plomberie et quincaillerie). "
+                "Réponds en français, en 150 mots maximum, en Markdown simple.\n")
+
+def vision_description(data: Dict[str, Any], context: str) -> str:
+    return (f"Matière : {data.get('mat') or '?'}. Technique : {data.get('std') or '?'}. "
+            f"Recherche : {data.get('search') or '?'}. Contexte du technicien : {context or '-'}.")
+
+async def run_agent(prompt: str, description: str) -> str:
+    """One text agent on Groq. Every agent of an identification sends the same system prefix (part description)
+    first, so the provider can reuse it; identical prompts are answered from the agent cache."""
+    messages = [{"role": "system", "content": AGENT_SYSTEM + "Pièce observée : " + description},
+                {"role": "user", "content": prompt}]
+    key = hashlib.sha1(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    async def _ask() -> str:
+        if groq_limit.throttling:
+            # the Groq quota is short: it goes to vision calls, the reports are optional
+            raise VisionUnavailable("agents_deferred")
+        return await agent_stage.complete(messages, timeout=AGENT_TIMEOUT)
+
+    return await _AGENT_CACHE.get_or_load(key, _ask)
+
+async def _vision_node(prepared, context: str, deadline: Optional[Deadline], speculation: Speculation):
+    """Groq vision, with the speculative sourcing queries running meanwhile (dropped if vision fails)."""
+    speculation.launch()
+    try:
+        return await run_vision(prepared, context, deadline=deadline)
+    except BaseException:
+        speculation.cancel()
+        raise
+
+async def _standard_node(prepared, data: Dict[str, Any], context: str, speculation: Speculation) -> Dict[str, Any]:
+    """Local standards matching (instant): gives the sourcing query without waiting for the agents."""
+    try:
+        query = search_query_from(data)
+    except IdentifyAbort:
+        speculation.cancel()
+        raise
+    speculative.observe(prepared.phash, context, query)
+    dimensions = " ".join(filter(None, [data.get("std"), data.get("search"), context]))
+    return {"query": query, "dimensions": dimensions, "prefetched": speculation.claim(query)}
+
+async def _sourcing_node(prepared, standard: Dict[str, Any], photo_emb, deadline: Optional[Deadline], on_product=None):
+    valid, others = [], []
+    async for item in iter_validated_candidates(prepared.clip_image, standard["query"], photo_emb=photo_emb,
+                                                deadline=deadline, prefetched=standard["prefetched"]):
+        if item.get("valid"):
+            valid.append(item)
+            if on_product is not None:
+                on_product(item)
+        else:
+            others.append(item)
+    return valid, others
+
+def identify_graph(prepared, context: str, photo_emb=None, deadline: Optional[Deadline] = None,
+                   on_product=None) -> AgentGraph:
+    """
+    vision -> standard -> sourcing (required path), with the material and
+    standards agents (optional, AGENT_TIMEOUT each) running next to sourcing.
+    With SPECULATIVE_SOURCING, guessed Perplexity queries run during vision
+    and the one matching the real query replaces the sourcing call.
+    """
+    # no guessing while Perplexity throttles us: the extra calls would eat the quota of real ones
+    allowed = SPECULATIVE_SOURCING and not perplexity_limit.throttling and perplexity_limit.state == "closed"
+    speculation = speculative.start(prepared.phash, context, lambda q: call_perplexity_api(q, deadline=deadline),
+                                    allowed=allowed)
+    graph = AgentGraph()
+    graph.add("vision", lambda r: _vision_node(prepared, context, deadline, speculation))
+    graph.add("standard", lambda r: _standard_node(prepared, r["vision"], context, speculation), deps=("vision",))
+    if AGENT_REPORTS:
+        graph.add("matiere", lambda r: run_agent(agent_expert_matiere(vision_description(r["vision"], context)),
+                                                 vision_description(r["vision"], context)),
+                  deps=("vision",), timeout=AGENT_TIMEOUT, required=False)
+        graph.add("standardiste", lambda r: run_agent(agent_standardiste(r["standard"]["dimensions"]),
+                                                      vision_description(r["vision"], context)),
+                  deps=("standard",), timeout=AGENT_TIMEOUT, required=False)
+    graph.add("sourcing", lambda r: _sourcing_node(prepared, r["standard"], photo_emb, deadline, on_product),
+              deps=("standard",))
+    return graph
+
+def sourced_candidates(valid: List[Dict[str, Any]], others: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Same shape as search_perplexity_async: the single error row, else the ranked candidates."""
+    if others and "error" in others[0]:
+        return others
+    return rank_candidates(valid + others)
+
 # -------------------------
 # Endpoint: identify (keeps HTML intact)
 # -------------------------
+def _identify_started(endpoint: str, context: str) -> float:
+    metrics.start_trace(endpoint, context=context[:120])
+    return time.perf_counter()
+
+def _identify_finished(endpoint: str, t0: float, outcome: str) -> None:
+    metrics.observe("identify", time.perf_counter() - t0, endpoint=endpoint, outcome=outcome)
+    metrics.inc("identifications_total", endpoint=endpoint, outcome=outcome)
+    metrics.end_trace(outcome=outcome)
+
 @app.post("/identify", response_class=HTMLResponse)
 async def identify(image: UploadFile = File(...), context: str = Form("")):
-    client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
+    t0 = _identify_started("identify", context)
+    outcome = "error"
     try:
+        deadline = Deadline(IDENTIFY_DEADLINE)
         raw_bytes = await image.read()
 
-        # 1) Quality checks: blur, size, brightness
-        quality = image_quality_check(raw_bytes)
-        if not quality["ok"]:
-            reasons_map = {
-                "image_blurry": "Image floue ou manque de netteté",
-                "image_too_small": "Image trop petite / faible résolution",
-                "image_too_dark": "Image trop sombre"
-            }
-            reasons_text = ", ".join(reasons_map.get(r, r) for r in quality["reasons"])
-            return f"""
-            <div class="results animate-in">
-                <div class="res-card" style="color:#b91c1c"><strong>⚠️ Qualité image insuffisante</strong>
-                <p>La photo fournie semble inadaptée pour un sourcing fiable : {reasons_text}.</p>
-                <p>Score netteté: {quality['blur_score']:.1f} • Luminosité: {quality['brightness']:.1f}</p>
-                </div>
-                <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list">Aucun résultat — améliore la photo et réessaie.</div></div>
-                <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
-            </div>
-            """
+        # 1) Decode once (off-loop): quality checks + vision JPEG + CLIP image
+        with metrics.timed("prepare"):
+            prepared = await prepare(raw_bytes)
+        if not prepared.ok:
+            outcome = "rejected"
+            return render_quality_error(prepared.quality())
 
-        # 2) Call Groq model to extract structured technical info
-        img_b64 = base64.b64encode(raw_bytes).decode('utf-8')
-        prompt = "ID TECHNIQUE. Format JSON: {\"mat\": \"\", \"std\": \"\", \"search\": \"\"}"
+        # Near-duplicate of a recent photo, or a part already in the local catalogue
+        with metrics.timed("lookup"):
+            known, photo_emb = await lookup_known_part(prepared, context)
+        if known is not None:
+            outcome = "cached"
+            return render_results(known["data"], format_links_html(known["candidates"]))
 
-        completion = client.chat.completions.create(
-            model=GROQ_MODEL,
-            messages=[{"role": "user", "content": [{"type": "text", "text": f"{prompt} Context: {context}"}, {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}]}],
-            response_format={"type": "json_object"}
-        )
+        # 2) Groq vision, then sourcing (Perplexity + validation) next to the material / standards agents
+        # the agent cards are optional: the page does not wait for them once vision and sourcing are done
+        graph = identify_graph(prepared, context, photo_emb, deadline)
+        results = {name: value async for name, value in graph.run(deadline, wait_optional=False)}
+        data = results["vision"]
+        candidates = sourced_candidates(*results["sourcing"])
+        await remember_result(prepared, context, data, candidates)
+        outcome = "ok" if any(c.get("valid") for c in candidates) else "no_valid_link"
 
-        try:
-            data = json.loads(completion.choices[0].message.content)
-        except Exception:
-            return f"<div class='res-card' style='color:red'>Erreur: réponse du modèle illisible.</div>"
-
-        model_note = data.get("note") or ""
-        model_confidence = data.get("confidence")
-        if isinstance(model_confidence, (int, float)) and model_confidence < 0.4:
-            return f"""
-            <div class="results animate-in">
-                <div class="res-card" style="color:#b91c1c"><strong>⚠️ Confiance modèle faible</strong>
-                <p>Le modèle indique une faible confiance ({model_confidence:.2f}) pour l'identification. {model_note}</p>
-                </div>
-                <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list">Aucun résultat — fournis une photo plus nette ou plus d'angles.</div></div>
-                <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
-            </div>
-            """
-
-        search_query = data.get("search") or ""
-        if not search_query:
-            parts = []
-            if data.get("mat"):
-                parts.append(data.get("mat"))
-            if data.get("std"):
-                parts.append(data.get("std"))
-            search_query = " ".join(parts).strip()
-        if not search_query:
-            return f"<div class='res-card' style='color:red'>Erreur: aucun terme de recherche généré par le modèle.</div>"
-
-        # 4) Call Perplexity/Sonar to get candidate product URLs and validate them (with visual check)
-        candidates = await search_perplexity_async(raw_bytes, search_query)
-
-        # 5) Format links for HTML
-        links_html = format_links_html(candidates)
-
-        # 6) Return the same HTML structure as before, injecting results
-        return f"""
-        <div class="results animate-in">
-            <div class="res-card mat"><strong>🧪 Matière</strong><p>{data.get('mat')}</p></div>
-            <div class="res-card std"><strong>📏 Technique</strong><p>{data.get('std')}</p></div>
-            <div class="res-card shop"><strong>🔗 Fiches Produits Directes</strong><div class="links-list">{links_html}</div></div>
-            <button class="btn btn-run" onclick="location.reload()">🔄 Nouveau Diagnostic</button>
-        </div>
-        """
+        # 3) Return the same HTML structure as before, injecting results
+        reports = {name: results[name] for name, _ in AGENT_CARDS if name in results}
+        return render_results(data, format_links_html(candidates), reports=reports)
+    except IdentifyAbort as e:
+        outcome = "aborted"
+        return e.html
     except Exception as e:
         return f"<div class='res-card' style='color:red'>Erreur Vision : {str(e)}</div>"
+    finally:
+        _identify_finished("identify", t0, outcome)
+
+# -------------------------
+# Endpoint: identify/stream (Server-Sent Events)
+# -------------------------
+def sse_event(event: str, payload: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+async def identify_events(prepared, context: str, deadline: Optional[Deadline] = None):
+    """
+    Event order: `quality` -> `result` (material / standard cards, links and
+    agent reports pending) -> one `product` per valid link as it is validated
+    and one `report` per agent, interleaved as they complete -> `links`
+    (fallback list when nothing validated) -> `done`. Early stops and result-cache hits send a
+    single complete `result`.
+    """
+    t0 = _identify_started("identify_stream", context)
+    outcome = "disconnected"
+    try:
+        try:
+            quality = prepared.quality()
+            if not prepared.ok:
+                outcome = "rejected"
+                raise IdentifyAbort(render_quality_error(quality))
+            yield sse_event("quality", {"ok": True, "blur_score": quality["blur_score"], "brightness": quality["brightness"]})
+
+            with metrics.timed("lookup"):
+                known, photo_emb = await lookup_known_part(prepared, context)
+            if known is not None:
+                outcome = "cached"
+                yield sse_event("result", {"html": render_results(known["data"], format_links_html(known["candidates"]))})
+                yield sse_event("done", {"cached": True})
+                return
+
+            # graph nodes and validated links arrive on one queue, in completion order
+            events: asyncio.Queue = asyncio.Queue()
+            graph = identify_graph(prepared, context, photo_emb, deadline,
+                                   on_product=lambda item: events.put_nowait(("product", item)))
+            driver = asyncio.create_task(_drive_graph(graph, deadline, events))
+            try:
+                while True:
+                    kind, value = await events.get()
+                    if kind == "error":
+                        raise value
+                    if kind == "end":
+                        break
+                    if kind == "vision":
+                        data = value
+                        reports = {name: None for name, _ in AGENT_CARDS if name in graph.nodes}
+                        yield sse_event("result", {"html": render_results(data, "⏳ Validation des fiches produits...",
+                                                                          pending=True, reports=reports)})
+                    elif kind == "product":
+                        yield sse_event("product", {"html": format_links_html([value])})
+                    elif kind in dict(AGENT_CARDS):
+                        yield sse_event("report", {"agent": kind, "html": render_report(value)})
+                    elif kind == "sourcing":
+                        valid, others = value
+            finally:
+                driver.cancel()
+            if valid:
+                await remember_result(prepared, context, data, rank_candidates(valid))
+            else:
+                yield sse_event("links", {"html": format_links_html(sourced_candidates(valid, others))})
+            outcome = "ok" if valid else "no_valid_link"
+        except IdentifyAbort as e:
+            if outcome != "rejected":
+                outcome = "aborted"
+            yield sse_event("result", {"html": e.html})
+        except Exception as e:
+            outcome = "error"
+            yield sse_event("result", {"html": f"<div class='res-card' style='color:red'>Erreur Vision : {str(e)}</div>"})
+        yield sse_event("done", {})
+    finally:
+        _identify_finished("identify_stream", t0, outcome)
+
+async def _drive_graph(graph: AgentGraph, deadline: Optional[Deadline], events: asyncio.Queue) -> None:
+    try:
+        async for name, value in graph.run(deadline):
+            events.put_nowait((name, value))
+        events.put_nowait(("end", None))
+    except Exception as e:
+        events.put_nowait(("error", e))
+
+@app.post("/identify/stream")
+async def identify_stream(image: UploadFile = File(...), context: str = Form("")):
+    deadline = Deadline(IDENTIFY_DEADLINE)
+    raw_bytes = await image.read()
+    with metrics.timed("prepare"):
+        prepared = await prepare(raw_bytes)
+    return StreamingResponse(
+        identify_events(prepared, context, deadline=deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -------------------------
+# Batch identification (see batch_jobs.py)
+# -------------------------
+BATCH_DIR = os.environ.get("BATCH_DIR", ".cache/batch")
+# Leaves part of the Groq slots to interactive identifications running meanwhile
+BATCH_VISION_CONCURRENCY = int(os.environ.get("BATCH_VISION_CONCURRENCY", str(max(1, GROQ_MAX_CONCURRENCY // 2))))
+BATCH_SOURCING_CONCURRENCY = int(os.environ.get("BATCH_SOURCING_CONCURRENCY", "4"))
+BATCH_PREPARE_CONCURRENCY = int(os.environ.get("BATCH_PREPARE_CONCURRENCY", str(max(2, PREPARE_PROCESSES))))
+BATCH_RETRIES = int(os.environ.get("BATCH_RETRIES", "3"))
+BATCH_BACKOFF = float(os.environ.get("BATCH_BACKOFF", "5"))
+_PERPLEXITY_RETRYABLE = ("perplexity_failed", "perplexity_timeout", "perplexity_rate_limited", "perplexity_unavailable",
+                         "deadline_exceeded")
+_BATCH_JOBS: Dict[str, BatchJob] = {}
+
+async def batch_identify(prepared, context: str) -> Dict[str, Any]:
+    """Batch stage 1: known part (cache / catalogue), else Groq vision."""
+    known, photo_emb = await lookup_known_part(prepared, context)
+    if known is not None:
+        return known
+    try:
+        data = await run_vision(prepared, context, deadline=Deadline(IDENTIFY_DEADLINE))
+    except IdentifyAbort as e:
+        if e.retryable:
+            raise RetryLater(e.text)
+        raise RuntimeError(e.text)
+    except Exception as e:
+        if getattr(e, "status_code", None) == 429:
+            raise RetryLater("groq_rate_limited")
+        raise
+    return {"data": data, "photo_emb": photo_emb}
+
+async def batch_source(prepared, context: str, found: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Batch stage 2: Perplexity sourcing and page validation, then result cache / catalogue."""
+    data = found["data"]
+    try:
+        query = search_query_from(data)
+    except IdentifyAbort as e:
+        raise RuntimeError(e.text)
+    candidates = await search_perplexity_async(prepared.clip_image, query, photo_emb=found.get("photo_emb"),
+                                               deadline=Deadline(IDENTIFY_DEADLINE))
+    if candidates and "error" in candidates[0]:
+        error = candidates[0]["error"]
+        if error in _PERPLEXITY_RETRYABLE:
+            raise RetryLater(error)
+        raise RuntimeError(error)
+    await remember_result(prepared, context, data, candidates)
+    return candidates
+
+batch_stages = BatchStages(prepare=prepare, identify=batch_identify, source=batch_source)
+
+def new_batch_job(directory: str, inputs, context: str) -> BatchJob:
+    return BatchJob(directory, inputs, batch_stages, context=context,
+                    vision_concurrency=BATCH_VISION_CONCURRENCY, sourcing_concurrency=BATCH_SOURCING_CONCURRENCY,
+                    prepare_concurrency=BATCH_PREPARE_CONCURRENCY, max_distance=RESULT_CACHE_MAX_DISTANCE,
+                    retries=BATCH_RETRIES, backoff=BATCH_BACKOFF)
+
+@app.post("/identify/batch")
+async def identify_batch(images: List[UploadFile] = File(...), context: str = Form("")):
+    """Starts a batch job on the uploaded photos / zip archives; poll GET /identify/batch/{job}."""
+    job_id = uuid.uuid4().hex[:12]
+    directory = os.path.join(BATCH_DIR, job_id)
+    write_job_file(directory, context)
+    for i, upload in enumerate(images):
+        name = os.path.basename(upload.filename or "") or f"photo-{i}.jpg"
+        with open(os.path.join(directory, f"{i:04d}-{name}"), "wb") as f:
+            while chunk := await upload.read(1 << 20):
+                f.write(chunk)
+    job = new_batch_job(directory, collect_inputs([directory]), context)
+    _BATCH_JOBS[job_id] = job
+    task = asyncio.create_task(job.run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return JSONResponse({"job": job_id, **job.progress()}, status_code=202)
+
+@app.get("/identify/batch/{job_id}")
+def batch_status(job_id: str, format: str = Query("json", pattern="^(json|csv)$")):
+    job = _BATCH_JOBS.get(job_id)
+    directory = os.path.join(BATCH_DIR, os.path.basename(job_id))
+    if job is None:
+        # finished or interrupted by a restart: served from its checkpoint (resume with python -m batch_jobs)
+        if not os.path.isdir(directory):
+            return JSONResponse({"error": "unknown_job"}, status_code=404)
+        records = load_records(directory)
+        inputs = collect_inputs([directory])
+        results = [records[i.name] for i in inputs if i.name in records]
+        progress = {"state": "stopped" if len(results) < len(inputs) else "done", "total": len(inputs),
+                    "done": len(results), "context": read_job_file(directory).get("context", "")}
+    else:
+        results = job.results()
+        progress = job.progress()
+    if format == "csv":
+        return PlainTextResponse(to_csv(results), media_type="text/csv",
+                                 headers={"Content-Disposition": f"attachment; filename=batch-{job_id}.csv"})
+    return {"job": job_id, **progress, "results": results}
+
+# -------------------------
+# Metrics (Prometheus text format) and stage stats
+# -------------------------
+@metrics.collector
+def _component_metrics() -> Dict[str, Any]:
+    v = vision.snapshot()
+    a = agent_stage.snapshot()
+    out: Dict[str, Any] = {
+        "vision_waiting": v["waiting"],
+        "vision_in_flight": v["in_flight"],
+        "vision_timeouts": v["timeouts"],
+        "vision_rejected": v["rejected"],
+        "agents_waiting": a["waiting"],
+        "agents_in_flight": a["in_flight"],
+        "agents_rejected": a["rejected"],
+        "clip_images": clip.stats["images"],
+        "clip_texts": clip.stats["texts"],
+        "clip_batches": clip.stats["batches"],
+        "clip_encode_seconds": clip.stats["encode_time_total"],
+    }
+    for name, cache in (("pages", _PAGE_CACHE), ("results", _RESULT_CACHE), ("sourcing", sourcing_cache)):
+        snap = cache.snapshot()
+        out.setdefault("cache_hit_ratio", {})[(("cache", name),)] = snap["hit_ratio"]
+        out.setdefault("cache_size", {})[(("cache", name),)] = snap["size"]
+    if embeddings is not None:
+        lookups = embeddings.hits + embeddings.misses
+        out.setdefault("cache_hit_ratio", {})[(("cache", "embeddings"),)] = embeddings.hits / lookups if lookups else 0.0
+    if shared is not None:
+        lookups = shared.hits + shared.misses
+        out.setdefault("cache_hit_ratio", {})[(("cache", "shared"),)] = shared.hits / lookups if lookups else 0.0
+    for key, value in _FETCH_STATS.items():
+        out[f"fetch_{key}"] = value
+    for limiter in (groq_limit, perplexity_limit):
+        snap = limiter.snapshot()
+        for key in ("requests", "throttled", "wait_seconds", "rate_limited", "rejected", "failures", "circuit_opens",
+                    "retries", "coalesced"):
+            out.setdefault(f"ratelimit_{key}", {})[(("provider", limiter.name),)] = snap[key]
+        out.setdefault("ratelimit_circuit_open", {})[(("provider", limiter.name),)] = int(snap["state"] != "closed")
+    domains = domain_stats.snapshot(limit=0)
+    for key in ("domains", "skipped", "probes", "flush_errors"):
+        out[f"domain_stats_{key}"] = domains[key]
+    spec = speculative.snapshot()
+    for key in ("launched", "hits", "misses", "unused", "unused_answered", "cancelled", "hit_rate"):
+        out[f"speculation_{key}"] = spec[key]
+    return out
+
+@app.get("/ready")
+def readiness():
+    """503 while the CLIP encoder is still loading (route traffic elsewhere); `/` is served meanwhile."""
+    ready = clip.state in ("ready", "unavailable") or not CLIP_WARMUP
+    body = {"ready": ready, "clip": clip.state, "clip_backend": clip.stats["backend"],
+            "clip_load_seconds": clip.stats["load_seconds"]}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/vision")
+def vision_stats():
+    return dict(vision.snapshot(), agents=agent_stage.snapshot())
+
+@app.get("/stats/limits")
+def limit_stats():
+    return {"groq": groq_limit.snapshot(), "perplexity": perplexity_limit.snapshot()}
+
+@app.get("/stats/domains")
+def domain_stats_view(limit: int = Query(50, ge=0, le=1000)):
+    return domain_stats.snapshot(limit=limit)
+
+@app.get("/stats/cache")
+def cache_stats():
+    out = {"pages": _PAGE_CACHE.snapshot(), "results": _RESULT_CACHE.snapshot(), "sourcing": sourcing_cache.snapshot(),
+           "speculation": speculative.snapshot(), "fetch": dict(_FETCH_STATS)}
+    if shared is not None:
+        out["shared"] = {"path": shared.path, "hits": shared.hits, "misses": shared.misses}
+    return out
+
+@app.get("/stats/clip")
+def clip_stats():
+    stats = dict(clip.stats)
+    if embeddings is not None:
+        stats["store_hits"] = embeddings.hits
+        stats["store_misses"] = embeddings.misses
+    return stats
 
 # -------------------------
 # Home route (HTML intact)
@@ -598,16 +1528,48 @@ def home():
                 sr.onresult = (e) => { document.getElementById('ctx').value = e.results[0][0].transcript; };
                 sr.start();
             }
+            function onEvent(ev, d) {
+                const loader = document.getElementById('loader');
+                if (ev === 'quality') { loader.textContent = "⚙️ Photo OK — Analyse Vision..."; }
+                else if (ev === 'result') { document.getElementById('res').innerHTML = d.html; loader.textContent = "⚙️ Sourcing Sonar..."; }
+                else if (ev === 'report') { const c = document.getElementById('report-' + d.agent); if (c) c.innerHTML = d.html; }
+                else if (ev === 'product' || ev === 'links') {
+                    const l = document.getElementById('links');
+                    if (!l) return;
+                    if (l.dataset.pending) { l.innerHTML = ""; delete l.dataset.pending; }
+                    l.insertAdjacentHTML('beforeend', d.html);
+                }
+            }
             async function run() {
                 if(!img) return alert("Photo requise");
-                document.getElementById('loader').style.display="block";
+                const loader = document.getElementById('loader');
+                loader.textContent = "⚙️ Analyse & Sourcing Sonar...";
+                loader.style.display="block";
                 document.getElementById('go').style.display="none";
+                document.getElementById('res').innerHTML = "";
                 const fd = new FormData(); fd.append('image', img); fd.append('context', document.getElementById('ctx').value);
                 try {
-                    const r = await fetch('/identify', { method: 'POST', body: fd });
-                    document.getElementById('res').innerHTML = await r.text();
+                    const r = await fetch('/identify/stream', { method: 'POST', body: fd });
+                    const reader = r.body.getReader();
+                    const dec = new TextDecoder();
+                    let buf = "";
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buf += dec.decode(value, { stream: true });
+                        let i;
+                        while ((i = buf.indexOf("\\n\\n")) >= 0) {
+                            const frame = buf.slice(0, i); buf = buf.slice(i + 2);
+                            let ev = "message", data = "";
+                            frame.split("\\n").forEach(line => {
+                                if (line.startsWith("event: ")) ev = line.slice(7);
+                                else if (line.startsWith("data: ")) data += line.slice(6);
+                            });
+                            onEvent(ev, data ? JSON.parse(data) : {});
+                        }
+                    }
                 } catch (e) { alert("Erreur connexion"); } 
-                finally { document.getElementById('loader').style.display="none"; document.getElementById('go').style.display="block"; }
+                finally { loader.style.display="none"; document.getElementById('go').style.display="block"; }
             }
         </script>
     </body>
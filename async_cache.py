@@ -0,0 +1,81 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class AsyncTTLCache:
+    """
+    Bounded in-memory cache for coroutine results.
+    - LRU eviction once `maxsize` entries are stored
+    - entries expire after `ttl` seconds (`negative_ttl` for error results)
+    - single-flight: concurrent misses on the same key share one loader task
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, negative_ttl: float = 300.0,
+                 is_error: Optional[Callable[[Any], bool]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.is_error = is_error or (lambda value: False)
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"hits": 0, "misses": 0, "joined": 0, "evictions": 0, "negative_stored": 0}
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return False, None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return False, None
+        self._data.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        negative = self.is_error(value)
+        if negative:
+            self.stats["negative_stored"] += 1
+        self._data[key] = (time.monotonic() + (self.negative_ttl if negative else self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        found, value = self.get(key)
+        if found:
+            self.stats["hits"] += 1
+            return value
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["joined"] += 1
+        else:
+            self.stats["misses"] += 1
+            task = asyncio.create_task(self._load(key, loader))
+            self._inflight[key] = task
+        # shield: one waiter being cancelled must not abort the shared load
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await loader()
+            self.set(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        lookups = s["hits"] + s["misses"] + s["joined"]
+        s["size"] = len(self._data)
+        s["inflight"] = len(self._inflight)
+        s["hit_ratio"] = (s["hits"] + s["joined"]) / lookups if lookups else 0.0
+        return s
@@ -0,0 +1,358 @@
+"""
+Batch identification of many photos (boxes of legacy parts, bulk catalogue jobs).
+
+A job is a directory holding the photos (or zip archives of photos), `job.json`
+(context) and `results.jsonl`, the checkpoint appended as each photo
+completes. Running a job again skips the photos already in the checkpoint
+(failed ones are retried).
+
+    python -m batch_jobs photos/ box2.zip [--context "visserie inox"] [--out results.csv]
+    POST /identify/batch (multipart `images`)  ->  GET /identify/batch/{job}[?format=csv]
+
+Photos flow through bounded stages (decode, lookup + Groq vision, Perplexity
+sourcing + page validation), so the vision call of one photo overlaps the
+sourcing of the previous ones. Near-identical shots (dHash within
+`max_distance` bits) are identified once. A stage hitting a rate limit raises
+RetryLater: the photo keeps its slot and is retried after a backoff, which
+slows that stage down instead of hammering the API.
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import metrics
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+CHECKPOINT = "results.jsonl"
+JOB_FILE = "job.json"
+CSV_FIELDS = ["name", "status", "duplicate_of", "mat", "std", "search", "best_url", "best_name", "best_price",
+              "best_source", "best_score", "links", "error", "seconds"]
+LINK_FIELDS = ("url", "nom", "prix", "source", "score", "valid", "visual_similarity", "reason")
+
+
+class RetryLater(Exception):
+    """Remote API saturated or rate limited: the photo is retried after a backoff."""
+
+
+# -------------------------
+# Inputs
+# -------------------------
+@dataclass
+class BatchInput:
+    name: str
+    path: str
+    member: Optional[str] = None  # entry of a zip archive
+
+    def read(self) -> bytes:
+        if self.member is None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        with zipfile.ZipFile(self.path) as z:
+            return z.read(self.member)
+
+
+def _is_image(name: str) -> bool:
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _zip_inputs(path: str, prefix: str) -> List[BatchInput]:
+    with zipfile.ZipFile(path) as z:
+        members = sorted(n for n in z.namelist() if _is_image(n) and not n.startswith("__MACOSX/"))
+    return [BatchInput(f"{prefix}/{m}", path, m) for m in members]
+
+
+def collect_inputs(paths: Iterable[str]) -> List[BatchInput]:
+    """Photos of the given files, directories (recursively) and zip archives, in a stable order."""
+    out: List[BatchInput] = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for f in sorted(files):
+                    full = os.path.join(root, f)
+                    rel = os.path.relpath(full, path).replace(os.sep, "/")
+                    if f.lower().endswith(".zip") and zipfile.is_zipfile(full):
+                        out.extend(_zip_inputs(full, rel))
+                    elif _is_image(f):
+                        out.append(BatchInput(rel, full))
+        elif zipfile.is_zipfile(path):
+            out.extend(_zip_inputs(path, os.path.basename(path)))
+        elif _is_image(path):
+            out.append(BatchInput(os.path.basename(path), path))
+    return out
+
+
+# -------------------------
+# Job
+# -------------------------
+@dataclass
+class BatchStages:
+    """
+    The service functions a job drives (see app.py):
+      prepare(raw bytes)              -> PreparedImage
+      identify(prepared, context)     -> {"data", "candidates"} when already known, else {"data", ...}
+      source(prepared, context, found) -> validated candidates
+    """
+    prepare: Callable[[bytes], Awaitable[Any]]
+    identify: Callable[[Any, str], Awaitable[Dict[str, Any]]]
+    source: Callable[[Any, str, Dict[str, Any]], Awaitable[List[Dict[str, Any]]]]
+
+
+def load_records(directory: str) -> Dict[str, Dict[str, Any]]:
+    """Checkpointed records of a job, by photo name (the last line wins after a retry)."""
+    records: Dict[str, Dict[str, Any]] = {}
+    path = os.path.join(directory, CHECKPOINT)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn write
+                records[rec["name"]] = rec
+    return records
+
+
+def _links(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [{k: c.get(k) for k in LINK_FIELDS} for c in candidates if c.get("valid")]
+
+
+class BatchJob:
+
+    def __init__(self, directory: str, inputs: List[BatchInput], stages: BatchStages, context: str = "",
+                 vision_concurrency: int = 4, sourcing_concurrency: int = 4, prepare_concurrency: int = 2,
+                 max_distance: int = 6, retries: int = 3, backoff: float = 5.0):
+        self.directory = directory
+        self.inputs = inputs
+        self.stages = stages
+        self.context = context
+        self.max_distance = max_distance
+        self.retries = retries
+        self.backoff = backoff
+        self._sems = {"prepare": asyncio.Semaphore(prepare_concurrency),
+                      "vision": asyncio.Semaphore(vision_concurrency),
+                      "sourcing": asyncio.Semaphore(sourcing_concurrency)}
+        # photos admitted past decoding: bounds the prepared images held in memory
+        self._window = asyncio.Semaphore(prepare_concurrency + 2 * (vision_concurrency + sourcing_concurrency))
+        self._reps: List[Tuple[int, str, str, asyncio.Future]] = []  # (phash, sha1, name, record future)
+        self.records = load_records(directory)
+        self.state = "pending"
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.retried = 0
+
+    # -------------------------
+    # Checkpoint
+    # -------------------------
+    def _checkpoint(self, record: Dict[str, Any]) -> None:
+        self.records[record["name"]] = record
+        with open(os.path.join(self.directory, CHECKPOINT), "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        metrics.inc("batch_items_total", status=record["status"])
+
+    def _pending_inputs(self) -> List[BatchInput]:
+        return [i for i in self.inputs if self.records.get(i.name, {}).get("status", "error") == "error"]
+
+    # -------------------------
+    # Pipeline
+    # -------------------------
+    async def run(self) -> None:
+        self.state = "running"
+        self.started = time.time()
+        loop = asyncio.get_running_loop()
+        for rec in self.records.values():
+            # as in a live run, only identified photos answer for their near-duplicates (not rejected ones)
+            identified = rec.get("status") in ("ok", "cached", "no_valid_link")
+            if identified and rec.get("phash") and not rec.get("duplicate_of"):
+                fut = loop.create_future()
+                fut.set_result(rec)
+                self._reps.append((int(rec["phash"], 16), rec.get("sha1", ""), rec["name"], fut))
+        try:
+            await asyncio.gather(*(self._process(item) for item in self._pending_inputs()))
+            self.state = "done"
+        except asyncio.CancelledError:
+            self.state = "cancelled"
+            raise
+        finally:
+            self.finished = time.time()
+
+    async def _stage(self, stage: str, fn, *args):
+        async with self._sems[stage]:
+            for attempt in range(self.retries + 1):
+                try:
+                    return await fn(*args)
+                except RetryLater:
+                    if attempt == self.retries:
+                        raise
+                    self.retried += 1
+                    # the slot is kept while backing off: the stage slows down as a whole
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def _representative(self, phash: int, sha1: str) -> Optional[Tuple[str, asyncio.Future]]:
+        best, best_dist = None, self.max_distance + 1
+        for rep_hash, rep_sha1, name, fut in self._reps:
+            dist = 0 if rep_sha1 == sha1 else (rep_hash ^ phash).bit_count()
+            if dist < best_dist:
+                best, best_dist = (name, fut), dist
+        return best
+
+    async def _process(self, item: BatchInput) -> None:
+        t0 = time.perf_counter()
+        record: Dict[str, Any] = {"name": item.name, "status": "error"}
+        fut: Optional[asyncio.Future] = None
+        rep = None
+        try:
+            async with self._window:
+                async with self._sems["prepare"]:
+                    raw = await asyncio.to_thread(item.read)
+                    prepared = await self.stages.prepare(raw)
+                record["sha1"] = hashlib.sha1(raw).hexdigest()
+                record["phash"] = f"{prepared.phash:016x}"
+                del raw
+                if not prepared.ok:
+                    record.update(status="rejected", error=", ".join(prepared.reasons))
+                else:
+                    rep = self._representative(prepared.phash, record["sha1"])
+                    if rep is None:
+                        fut = asyncio.get_running_loop().create_future()
+                        self._reps.append((prepared.phash, record["sha1"], item.name, fut))
+                        await self._identify(prepared, record)
+            if rep is not None:
+                # near-identical shot: same answer as the first photo of the group
+                first = await asyncio.shield(rep[1])
+                record.update({k: first.get(k) for k in ("status", "mat", "std", "search", "links", "error")},
+                              duplicate_of=rep[0])
+        except asyncio.CancelledError:
+            raise
+        except RetryLater as e:
+            record.update(status="error", error=f"rate_limited:{e}")
+        except Exception as e:
+            record.update(status="error", error=str(e)[:300] or type(e).__name__)
+        finally:
+            if fut is not None and not fut.done():
+                fut.set_result(record)
+        record["seconds"] = round(time.perf_counter() - t0, 3)
+        self._checkpoint(record)
+
+    async def _identify(self, prepared, record: Dict[str, Any]) -> None:
+        found = await self._stage("vision", self.stages.identify, prepared, self.context)
+        data = found.get("data") or {}
+        record.update(mat=data.get("mat") or "", std=data.get("std") or "", search=data.get("search") or "")
+        candidates = found.get("candidates")
+        status = "cached"
+        if candidates is None:
+            candidates = await self._stage("sourcing", self.stages.source, prepared, self.context, found)
+            status = "ok"
+        record["links"] = _links(candidates)
+        record["status"] = status if record["links"] else "no_valid_link"
+
+    # -------------------------
+    # Reporting
+    # -------------------------
+    def progress(self) -> Dict[str, Any]:
+        names = {i.name for i in self.inputs}
+        done = [r for n, r in self.records.items() if n in names]
+        end = self.finished or time.time()
+        elapsed = end - self.started if self.started else 0.0
+        return {
+            "state": self.state,
+            "total": len(self.inputs),
+            "done": len(done),
+            "by_status": dict(Counter(r["status"] for r in done)),
+            "retries": self.retried,
+            "elapsed": round(elapsed, 1),
+            "per_minute": round(len(done) / elapsed * 60, 1) if elapsed else 0.0,
+        }
+
+    def results(self) -> List[Dict[str, Any]]:
+        """Records in input order."""
+        return [self.records[i.name] for i in self.inputs if i.name in self.records]
+
+
+def to_csv(records: List[Dict[str, Any]]) -> str:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for rec in records:
+        links = rec.get("links") or []
+        best = links[0] if links else {}
+        writer.writerow(dict(rec, best_url=best.get("url") or "", best_name=best.get("nom") or "",
+                             best_price=best.get("prix") or "", best_source=best.get("source") or "",
+                             best_score=best.get("score") if best else "", links=len(links)))
+    return out.getvalue()
+
+
+def write_job_file(directory: str, context: str) -> None:
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, JOB_FILE), "w", encoding="utf-8") as f:
+        json.dump({"context": context, "created": time.time()}, f, ensure_ascii=False)
+
+
+def read_job_file(directory: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, JOB_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# -------------------------
+# CLI
+# -------------------------
+async def _run_cli(args) -> List[Dict[str, Any]]:
+    import app as service  # the whole service (clients, caches, models) only for the CLI
+
+    inputs = collect_inputs(args.paths)
+    if args.job_dir:
+        directory = args.job_dir
+    else:
+        # kept out of the photo folders (which may be read-only or shared); the same paths resume the same job
+        key = "\n".join(sorted(os.path.abspath(p) for p in args.paths))
+        directory = os.path.join(service.BATCH_DIR, hashlib.sha1(key.encode()).hexdigest()[:12])
+    context = args.context if args.context is not None else read_job_file(directory).get("context", "")
+    write_job_file(directory, context)
+
+    async with service.lifespan(service.app):
+        job = service.new_batch_job(directory, inputs, context)
+        print(f"{len(inputs)} photos, {len(job._pending_inputs())} to process, checkpoint {directory}/{CHECKPOINT}",
+              file=sys.stderr)
+        task = asyncio.create_task(job.run())
+        while not task.done():
+            await asyncio.wait({task}, timeout=args.progress)
+            p = job.progress()
+            print(f"[{p['done']}/{p['total']}] {p['by_status']} retries={p['retries']} {p['per_minute']}/min",
+                  file=sys.stderr)
+        await task
+    return job.results()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Batch identification of part photos")
+    parser.add_argument("paths", nargs="+", help="photos, directories or zip archives")
+    parser.add_argument("--context", default=None, help="context sent with every photo (default: the job's)")
+    parser.add_argument("--job-dir", default=None, help="checkpoint directory (default: BATCH_DIR/<hash of the paths>)")
+    parser.add_argument("--out", default="-", help="output file, .csv or .json (default: JSON on stdout)")
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    records = asyncio.run(_run_cli(args))
+    text = to_csv(records) if args.out.endswith(".csv") else json.dumps(records, ensure_ascii=False, indent=2)
+    if args.out == "-":
+        sys.stdout.write(text + "\n")
+    else:
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
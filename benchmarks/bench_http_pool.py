@@ -0,0 +1,108 @@
+"""
+Handshake savings of the shared HttpPool vs. one httpx.AsyncClient per call.
+
+Starts a local keep-alive HTTP/1.1 stub server that counts accepted TCP
+connections, then replays the same request mix as one /identify (1 Perplexity
+POST + 8 page fetches + 8 image fetches) in both modes.
+
+    python -m benchmarks.bench_http_pool --rounds 20
+
+The stub is plain HTTP, so the measured savings are TCP connects only; against
+real merchants each avoided connection also saves a TLS handshake.
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from http_pool import HttpPool
+
+BODY = b"<html><head><meta property='og:image' content='/img.jpg'></head><body>ok</body></html>"
+
+
+class StubServer:
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self._server = None
+        self.port = 0
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nConnection: keep-alive\r\n"
+                    + f"Content-Length: {len(BODY)}\r\n\r\n".encode() + BODY
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def identify_mix(base: str):
+    yield "POST", f"{base}/chat/completions"
+    for i in range(8):
+        yield "GET", f"{base}/product/{i}"
+    for i in range(8):
+        yield "GET", f"{base}/img/{i}.jpg"
+
+
+async def run_fresh(base: str, rounds: int):
+    for _ in range(rounds):
+        for method, url in identify_mix(base):
+            async with httpx.AsyncClient() as client:
+                await client.request(method, url, json={} if method == "POST" else None)
+
+
+async def run_pooled(base: str, rounds: int):
+    pool = HttpPool()
+    await pool.open()
+    try:
+        for _ in range(rounds):
+            for method, url in identify_mix(base):
+                if method == "POST":
+                    await pool.post(url, json={})
+                else:
+                    await pool.get(url)
+    finally:
+        await pool.close()
+
+
+async def main(rounds: int):
+    for name, runner in (("fresh client per call", run_fresh), ("shared HttpPool", run_pooled)):
+        server = StubServer()
+        await server.start()
+        base = f"http://127.0.0.1:{server.port}"
+        t0 = time.perf_counter()
+        await runner(base, rounds)
+        elapsed = time.perf_counter() - t0
+        await server.stop()
+        print(f"{name:24s} requests={server.requests:5d} connections={server.connections:5d} "
+              f"total={elapsed * 1000:8.1f} ms per_identify={elapsed / rounds * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rounds))
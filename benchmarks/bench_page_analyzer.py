@@ -0,0 +1,142 @@
+"""
+Micro-benchmark: page_analyzer (one pass) vs. the previous per-pattern regexes.
+
+    python -m benchmarks.bench_page_analyzer --corpus path/to/saved_pages --repeat 50
+
+--corpus points at a directory of saved merchant pages (*.html). Without it a
+synthetic corpus shaped like the merchants we validate is generated (large
+Amazon-style bodies, JSON-LD product pages, category pages). Also reports
+pages where the two implementations disagree on score or image.
+"""
+import argparse
+import glob
+import json
+import random
+import re
+import time
+
+from page_analyzer import PageAnalyzer, analyze_html
+
+
+# -------------------------
+# Previous implementation (kept here as the baseline)
+# -------------------------
+def legacy_score(text: str, base: int = 35):
+    checks = [r'og:price:amount', r'itemprop=["\']price', r'itemprop=["\']sku', r'\"price\" *: *\"?\d',
+              r'\b(réf|référence|sku|part ?no|partnumber)\b', r'\b\d{1,4}\s?mm\b']
+    score = base
+    if any(re.search(p, text, flags=re.IGNORECASE) for p in checks):
+        score += 50
+    if re.search(r'(\d[\d\s,.]{1,6})\s?(€|eur|€)', text, flags=re.IGNORECASE):
+        score += 10
+    if re.search(r'\b(réf|référence|sku|part ?no|partnumber)\b', text, flags=re.IGNORECASE):
+        score += 10
+    image = ""
+    for pattern, group in (
+        (r'<meta[^>]+property=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', 1),
+        (r'<meta[^>]+name=["\']og:image["\'][^>]+content=["\']([^"\']+)["\']', 1),
+        (r'<meta[^>]+itemprop=["\']image["\'][^>]+content=["\']([^"\']+)["\']', 1),
+        (r'<img[^>]+class=["\'][^"\']*(product|produit)[^"\']*["\'][^>]+src=["\']([^"\']+)["\']', 2),
+        (r'<img[^>]+src=["\']([^"\']+)["\']', 1),
+    ):
+        m = re.search(pattern, text, flags=re.IGNORECASE)
+        if m:
+            image = m.group(group)
+            break
+    return score, image
+
+
+# -------------------------
+# Synthetic corpus
+# -------------------------
+FILLER = "<div class='nav'><a href='/c/{i}'>Catégorie {i}</a><span>Livraison offerte dès 25</span></div>\n"
+
+
+def _page(kind: str, rng: random.Random) -> str:
+    body_len = rng.randint(800, 3000)
+    body = "".join(FILLER.format(i=i) for i in range(body_len))
+    if kind == "amazon":
+        head = ("<head><title>Tête céramique 15/21</title>"
+                "<meta property='og:image' content='https://m.media-amazon.com/images/I/71abc.jpg'>"
+                "<meta name='description' content='Tête de robinet'></head>")
+        return f"<html>{head}<body>{body}<span class='a-price'>12,90 €</span><td>Réf. fabricant</td></body></html>"
+    if kind == "jsonld":
+        ld = {"@context": "https://schema.org", "@type": "Product", "name": "Charnière 35mm", "sku": "84512",
+              "image": ["https://cdn.manomano.com/images/84512.jpg"],
+              "offers": {"@type": "Offer", "price": "4.90", "priceCurrency": "EUR",
+                         "availability": "https://schema.org/InStock"}}
+        head = (f"<head><title>Charnière</title><script type='application/ld+json'>{json.dumps(ld)}</script>"
+                "<meta content='https://cdn.manomano.com/og/84512.jpg' property='og:image'></head>")
+        return f"<html>{head}<body>{body}<p>Prix : 4,90 €</p></body></html>"
+    if kind == "links":
+        # near misses of the reference keywords: tracking parameters, "sef", English "Reference"
+        head = "<head><title>Accueil</title></head>"
+        links = ("<a href='https://x.fr/?ref=home'>Accueil</a><a href='/sef/plomberie?pku=3'>Plomberie</a>"
+                 "<p>Reference guide</p>")
+        return f"<html>{head}<body>{links}{body}</body></html>"
+    head = "<head><title>Robinetterie</title></head>"
+    imgs = "".join(f"<img src='/thumbs/{i}.jpg' class='thumb'>" for i in range(40))
+    return f"<html>{head}<body>{imgs}{body}</body></html>"
+
+
+def synthetic_corpus(n: int = 30):
+    rng = random.Random(0)
+    return [_page(("amazon", "jsonld", "category", "links")[i % 4], rng)[:200000] for i in range(n)]
+
+
+def bench(fn, pages, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for p in pages:
+            fn(p)
+    return (time.perf_counter() - t0) / (repeat * len(pages))
+
+
+def streamed_bytes(page: str, chunk: int = 16384) -> int:
+    """Bytes a streaming fetch would read before the analyzer has every signal it needs."""
+    analyzer = PageAnalyzer()
+    for start in range(0, len(page), chunk):
+        if analyzer.feed(page[start:start + chunk]).complete:
+            return min(start + chunk, len(page))
+    return len(page)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.corpus:
+        pages = []
+        for path in sorted(glob.glob(f"{args.corpus}/*.htm*")):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages.append(f.read()[:200000])
+    else:
+        pages = synthetic_corpus()
+
+    legacy = bench(legacy_score, pages, args.repeat)
+    single = bench(lambda p: (lambda i: (i.html_score(35), i.image))(analyze_html(p)), pages, args.repeat)
+    score_diff = structured_diff = image_diff = 0
+    for p in pages:
+        info = analyze_html(p)
+        score, image = legacy_score(p)
+        if score != info.html_score(35):
+            score_diff += 1
+            # a structured price / SKU now counts as the price / reference text
+            structured = (info.price and not info.price_text) or (info.sku and not info.reference_text)
+            structured_diff += bool(structured) and 0 < info.html_score(35) - score <= 20
+        image_diff += image != info.image
+    total = sum(len(p) for p in pages)
+    early = sum(streamed_bytes(p) for p in pages)
+    print(f"pages={len(pages)} avg_size={total / len(pages) / 1024:.0f} KiB")
+    print(f"legacy regexes   {legacy * 1e3:8.3f} ms/page")
+    print(f"page_analyzer    {single * 1e3:8.3f} ms/page  (x{legacy / single:.1f})")
+    print(f"streamed bytes   {early / total * 100:5.1f} % of the document read before all signals are known")
+    print(f"score differs    {score_diff} pages ({structured_diff} raised by a structured price / SKU)")
+    # the legacy og:image regex only matched property="..." before content="..."
+    print(f"image differs    {image_diff} pages")
+
+
+if __name__ == "__main__":
+    main()
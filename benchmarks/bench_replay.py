@@ -0,0 +1,359 @@
+"""
+Offline replay of the full /identify pipeline.
+
+A recorded corpus (photos, Groq answers, Perplexity answers, merchant pages
+and images) is served by a local stub server running in its own process;
+the app runs in this process with the real HttpPool, VisionStage, page
+analyzer, CLIP engine and scoring, and `/identify` is driven in-process at
+the requested concurrency. No request leaves the machine.
+
+    python -m benchmarks.bench_replay [--corpus DIR] [--requests 200] [--concurrency 16]
+                                      [--save out.json] [--baseline old.json --tolerance 0.15]
+
+Corpus layout (DIR/manifest.json, paths relative to DIR):
+
+    {"cases": [{"photo": "photos/a.jpg", "context": "",
+                "vision": {"mat": "...", "std": "...", "search": "..."},
+                "candidates": [{"nom": "", "prix": "", "url": "https://..."}]}],
+     "resources": {"https://merchant/p/1": {"file": "pages/1.html", "content_type": "text/html"}}}
+
+Without --corpus a synthetic corpus is generated. Latencies of the remote
+services are injected by the stub (--groq-ms, --perplexity-ms, --merchant-ms).
+Caches are cold by default (result / page / sourcing caches disabled, fresh catalogue
+and embedding store); --warm keeps them.
+
+Reports throughput, end-to-end and per-stage p50/p95/p99 (from the
+per-request traces), CPU seconds per request and peak RSS of the app
+process. With --baseline, exits with status 1 when throughput drops or a
+p95 grows by more than --tolerance.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from PIL import Image
+
+from benchmarks.bench_page_analyzer import synthetic_corpus
+from image_pipeline import prepare_upload
+
+# -------------------------
+# Corpus
+# -------------------------
+MERCHANTS = ["amazon.fr", "manomano.fr", "leroymerlin.fr", "rs-online.com"]
+PAGE_IMAGES = ["https://m.media-amazon.com/images/I/71abc.jpg", "https://cdn.manomano.com/images/84512.jpg",
+               "https://cdn.manomano.com/og/84512.jpg"]
+
+
+def _jpeg(rng: random.Random, size=(800, 600)) -> bytes:
+    img = Image.effect_noise(size, rng.randint(40, 90)).convert("RGB")
+    img = Image.blend(img, Image.new("RGB", size, (rng.randint(60, 200), rng.randint(60, 200), 90)), 0.5)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def make_synthetic_corpus(directory: str, n_cases: int = 24, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, "photos"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "pages"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "images"), exist_ok=True)
+    pages = synthetic_corpus(12)
+    resources: Dict[str, Dict[str, str]] = {}
+    for i, url in enumerate(PAGE_IMAGES):
+        with open(os.path.join(directory, "images", f"{i}.jpg"), "wb") as f:
+            f.write(_jpeg(rng, (500, 500)))
+        resources[url] = {"file": f"images/{i}.jpg", "content_type": "image/jpeg"}
+    cases = []
+    for c in range(n_cases):
+        with open(os.path.join(directory, "photos", f"{c}.jpg"), "wb") as f:
+            f.write(_jpeg(rng))
+        candidates = []
+        for k in range(8):
+            url = f"https://www.{MERCHANTS[k % len(MERCHANTS)]}/p/{c}-{k}"
+            page = f"pages/{c}-{k}.html"
+            with open(os.path.join(directory, page), "w", encoding="utf-8") as f:
+                f.write(pages[(c + k) % len(pages)])
+            resources[url] = {"file": page, "content_type": "text/html; charset=utf-8"}
+            candidates.append({"nom": f"Pièce {c}-{k}", "prix": f"{rng.randint(3, 40)},90 €", "url": url})
+        cases.append({"photo": f"photos/{c}.jpg", "context": "",
+                      "vision": {"mat": "laiton", "std": "15/21", "search": f"tete ceramique 15/21 ref {c}"},
+                      "candidates": candidates})
+    with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"cases": cases, "resources": resources}, f, ensure_ascii=False)
+    return directory
+
+
+def load_corpus(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+        corpus = json.load(f)
+    corpus["dir"] = directory
+    return corpus
+
+
+# -------------------------
+# Stub server (separate process, so its CPU is not billed to the app)
+# -------------------------
+class StubServer:
+    """Answers Groq (by hash of the vision JPEG), Perplexity (by query) and merchant URLs (X-Replay-Url)."""
+
+    def __init__(self, corpus: Dict[str, Any], latency: Dict[str, float]):
+        self.latency = latency
+        self.vision: Dict[str, str] = {}
+        self.sourcing: Dict[str, List[Dict[str, Any]]] = {}
+        self.resources: Dict[str, tuple] = {}
+        for case in corpus["cases"]:
+            with open(os.path.join(corpus["dir"], case["photo"]), "rb") as f:
+                jpeg = prepare_upload(f.read()).vision_jpeg
+            self.vision[hashlib.sha1(jpeg).hexdigest()] = json.dumps(case["vision"], ensure_ascii=False)
+            self.sourcing[case["vision"].get("search", "")] = case["candidates"]
+        for url, res in corpus["resources"].items():
+            with open(os.path.join(corpus["dir"], res["file"]), "rb") as f:
+                self.resources[url] = (res["content_type"], f.read())
+
+    async def _route(self, method: str, headers: Dict[str, str], body: bytes):
+        target = headers.get("x-replay-url", "")
+        if target.startswith("https://api.perplexity.ai"):
+            await asyncio.sleep(self.latency["perplexity"])
+            user = json.loads(body)["messages"][-1]["content"]
+            query = user.split("Trouve produits pour : ", 1)[-1].split(" Donne max", 1)[0]
+            candidates = self.sourcing.get(query) or next(iter(self.sourcing.values()), [])
+            return 200, "application/json", json.dumps(_chat(json.dumps(candidates, ensure_ascii=False))).encode()
+        if target:
+            await asyncio.sleep(self.latency["merchant"])
+            res = self.resources.get(target)
+            if res is None:
+                return 404, "text/plain", b"not found"
+            return 200, res[0], res[1]
+        # Groq (GROQ_BASE_URL points here)
+        await asyncio.sleep(self.latency["groq"])
+        payload = json.loads(body)
+        content = ""
+        parts = payload["messages"][-1]["content"]
+        if isinstance(parts, str):  # text agents (material / standards reports)
+            return 200, "application/json", json.dumps(_chat("**Rapport** (replay)")).encode()
+        for part in parts:
+            if part.get("type") == "image_url":
+                jpeg = base64.b64decode(part["image_url"]["url"].split(",", 1)[1])
+                content = self.vision.get(hashlib.sha1(jpeg).hexdigest(), "")
+        content = content or json.dumps({"mat": "", "std": "", "search": ""})
+        return 200, "application/json", json.dumps(_chat(content)).encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method = lines[0].split(" ", 1)[0]
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+                status, ctype, payload = await self._route(method, headers, body)
+                writer.write(f"HTTP/1.1 {status} X\r\nContent-Type: {ctype}\r\nContent-Length: {len(payload)}\r\n"
+                             "Connection: keep-alive\r\n\r\n".encode() + payload)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port_pipe) -> None:
+        server = await asyncio.start_server(self._handle, "127.0.0.1", 0, backlog=1024)
+        port_pipe.send(server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+
+def _chat(content: str) -> Dict[str, Any]:
+    return {"id": "replay", "object": "chat.completion", "created": 0, "model": "replay",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+
+def _stub_main(corpus_dir: str, latency: Dict[str, float], port_pipe) -> None:
+    asyncio.run(StubServer(load_corpus(corpus_dir), latency).serve(port_pipe))
+
+
+# -------------------------
+# Replay
+# -------------------------
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {"n": len(ordered), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+async def replay(app_module, corpus: Dict[str, Any], n_requests: int, concurrency: int) -> Dict[str, Any]:
+    import httpx
+    import logging
+
+    from metrics import trace_logger
+
+    traces: List[Dict[str, Any]] = []
+
+    class _Collect(logging.Handler):
+        def emit(self, record):
+            traces.append(json.loads(record.getMessage()))
+
+    trace_logger.addHandler(_Collect())
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+    photos = []
+    for case in corpus["cases"]:
+        with open(os.path.join(corpus["dir"], case["photo"]), "rb") as f:
+            photos.append((f.read(), case.get("context", "")))
+
+    latencies: List[float] = []
+    queue: asyncio.Queue = asyncio.Queue()
+    for i in range(n_requests):
+        queue.put_nowait(photos[i % len(photos)])
+
+    fastapi_app = app_module.app
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        while not (app_module.clip.state in ("ready", "unavailable") or not app_module.CLIP_WARMUP):
+            await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+
+            async def worker():
+                while not queue.empty():
+                    raw, context = queue.get_nowait()
+                    t0 = time.perf_counter()
+                    await client.post("/identify", files={"image": ("photo.jpg", raw, "image/jpeg")},
+                                      data={"context": context})
+                    latencies.append(time.perf_counter() - t0)
+
+            usage0 = resource.getrusage(resource.RUSAGE_SELF)
+            t0 = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - t0
+            usage1 = resource.getrusage(resource.RUSAGE_SELF)
+
+    stages: Dict[str, List[float]] = {}
+    outcomes: Dict[str, int] = {}
+    for trace in traces:
+        outcomes[trace.get("outcome", "?")] = outcomes.get(trace.get("outcome", "?"), 0) + 1
+        for span in trace["spans"]:
+            stages.setdefault(span["stage"], []).append(span["seconds"])
+    cpu = (usage1.ru_utime - usage0.ru_utime) + (usage1.ru_stime - usage0.ru_stime)
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "elapsed": elapsed,
+        "throughput": n_requests / elapsed if elapsed else 0.0,
+        "latency": _percentiles(latencies),
+        "stages": {name: _percentiles(values) for name, values in sorted(stages.items())},
+        "outcomes": outcomes,
+        "cpu_per_request": cpu / n_requests if n_requests else 0.0,
+        "peak_rss_mb": usage1.ru_maxrss / 1024.0,  # ru_maxrss is in KiB on Linux
+        "clip": app_module.clip.state,
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    regressions = []
+    if report["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"throughput {baseline['throughput']:.2f} -> {report['throughput']:.2f} req/s")
+    pairs = [("end-to-end", report["latency"], baseline["latency"])]
+    pairs += [(name, report["stages"][name], old) for name, old in baseline["stages"].items() if name in report["stages"]]
+    for name, new, old in pairs:
+        # ignore sub-millisecond stages: noise, not regressions
+        if old["p95"] > 0.001 and new["p95"] > old["p95"] * (1 + tolerance):
+            regressions.append(f"{name} p95 {old['p95'] * 1e3:.1f} -> {new['p95'] * 1e3:.1f} ms")
+    return regressions
+
+
+def print_report(r: Dict[str, Any]) -> None:
+    print(f"requests={r['requests']} concurrency={r['concurrency']} clip={r['clip']} outcomes={r['outcomes']}")
+    print(f"throughput {r['throughput']:8.2f} req/s   cpu/request {r['cpu_per_request'] * 1e3:7.1f} ms   "
+          f"peak RSS {r['peak_rss_mb']:7.1f} MiB")
+    rows = [("end-to-end", r["latency"])] + list(r["stages"].items())
+    print(f"{'stage':14s} {'n':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+    for name, p in rows:
+        print(f"{name:14s} {p['n']:6d} {p['p50'] * 1e3:9.1f} {p['p95'] * 1e3:9.1f} {p['p99'] * 1e3:9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=None)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--groq-ms", type=float, default=1500)
+    parser.add_argument("--perplexity-ms", type=float, default=3000)
+    parser.add_argument("--merchant-ms", type=float, default=150)
+    parser.add_argument("--warm", action="store_true", help="keep result / page caches enabled")
+    parser.add_argument("--save", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    corpus_dir = args.corpus or make_synthetic_corpus(os.path.join(workdir, "corpus"))
+    latency = {"groq": args.groq_ms / 1e3, "perplexity": args.perplexity_ms / 1e3, "merchant": args.merchant_ms / 1e3}
+
+    ctx = multiprocessing.get_context("spawn")
+    parent, child = ctx.Pipe()
+    stub = ctx.Process(target=_stub_main, args=(corpus_dir, latency, child), daemon=True)
+    stub.start()
+    port = parent.recv()
+    try:
+        os.environ.update({
+            "GROQ_API_KEY": "replay", "GROQ_BASE_URL": f"http://127.0.0.1:{port}",
+            "PERPLEXITY_API_KEY": "replay",
+            "CATALOGUE_DIR": os.path.join(workdir, "catalogue"),
+            "EMBED_STORE_DIR": os.path.join(workdir, "embeddings"),
+            "SOURCING_CACHE_PATH": os.path.join(workdir, "sourcing.db"),
+            "DOMAIN_STATS_PATH": os.path.join(workdir, "domains.db"),
+        })
+        if not args.warm:
+            os.environ.update({"RESULT_CACHE_TTL": "0", "URL_CACHE_MAX": "0", "SOURCING_CACHE_TTL": "0",
+                               "CATALOGUE_MIN_SIM": "1.01"})
+        import httpx
+        import app as app_module
+
+        class _ToStub(httpx.AsyncHTTPTransport):
+            # every outbound URL is answered by the stub; the original URL travels in a header
+            async def handle_async_request(self, request):
+                request.headers["X-Replay-Url"] = str(request.url)
+                request.url = request.url.copy_with(scheme="http", host="127.0.0.1", port=port)
+                request.headers["Host"] = f"127.0.0.1:{port}"
+                return await super().handle_async_request(request)
+
+        app_module.http.transport = _ToStub(limits=app_module.http.limits)
+        report = asyncio.run(replay(app_module, load_corpus(corpus_dir), args.requests, args.concurrency))
+    finally:
+        stub.terminate()
+
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Cold-start timings of a worker, each measured in a fresh interpreter:
+
+  import        `import app`
+  first /       process start -> first `GET /` answered (lifespan included)
+  ready         process start -> `GET /ready` == 200 (CLIP loaded and warmed)
+  first embed   one CLIP embedding right after readiness (or, with
+                CLIP_WARMUP=0, the lazy load paid by the first request)
+
+    python -m benchmarks.bench_startup [--runs 3] [--backend torch|torch-int8|onnx]
+
+Run it before and after touching imports or model loading; `first /` is what
+the container platform waits for before routing traffic.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app
+t_import = time.perf_counter() - t0
+from fastapi.testclient import TestClient
+from PIL import Image
+out = {"import": t_import}
+with TestClient(app.app) as client:
+    client.get("/")
+    out["first /"] = time.perf_counter() - t0
+    while client.get("/ready").status_code != 200:
+        time.sleep(0.05)
+    out["ready"] = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    client.portal.call(app.clip.embed, Image.new("RGB", (640, 480), (120, 80, 40)))
+    out["first embed"] = time.perf_counter() - t1
+    out["clip"] = app.clip.state + "/" + (app.clip.stats["backend"] or "-")
+print("RESULT " + json.dumps(out))
+"""
+
+
+def run_once(env):
+    proc = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, timeout=900)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(proc.stderr[-2000:])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--backend", default=os.environ.get("CLIP_BACKEND", "torch"))
+    parser.add_argument("--no-warmup", action="store_true", help="CLIP_WARMUP=0: load on the first embedding")
+    args = parser.parse_args()
+
+    env = dict(os.environ, CLIP_BACKEND=args.backend, CLIP_WARMUP="0" if args.no_warmup else "1")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    runs = [run_once(env) for _ in range(args.runs)]
+    print(f"backend={args.backend} warmup={not args.no_warmup} runs={len(runs)} clip={runs[-1]['clip']}")
+    for key in ("import", "first /", "ready", "first embed"):
+        values = [r[key] for r in runs]
+        print(f"{key:12s} median {statistics.median(values):7.3f} s   max {max(values):7.3f} s")
+
+
+if __name__ == "__main__":
+    main()
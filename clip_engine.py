@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# CLIP ViT preprocessing, for the ONNX backend (sentence-transformers does its own)
+CLIP_SIDE = 224
+CLIP_MEAN = np.array([0.48145466, 0.4578275, 0.40821073], dtype=np.float32)
+CLIP_STD = np.array([0.26862954, 0.26130258, 0.27577711], dtype=np.float32)
+BACKENDS = ("torch", "torch-int8", "onnx")
+
+
+class ClipEngine:
+    """
+    Micro-batching CLIP image encoder.
+    Concurrent `embed()` calls are queued; a collector task groups them into
+    batches of at most `max_batch` images (waiting at most `max_wait_ms` after
+    the first one) and runs decode + `SentenceTransformer.encode` on a
+    dedicated worker thread, so the event loop never blocks on torch.
+
+    Nothing heavy happens at construction: torch / sentence-transformers are
+    imported and the model is loaded by `warm_up()` (or the first `embed()`),
+    on the worker thread. `backend` selects the encoder:
+      torch       SentenceTransformer, fp32
+      torch-int8  same with dynamically quantized Linear layers
+      onnx        onnxruntime session on an exported image tower
+                  (`python -m clip_engine export-onnx`); falls back to torch
+    """
+
+    def __init__(self, model_name: str, max_batch: int = 16, max_wait_ms: float = 8.0,
+                 torch_threads: Optional[int] = None, backend: str = "torch", onnx_path: Optional[str] = None):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.torch_threads = torch_threads or os.cpu_count() or 1
+        self.backend = backend if backend in BACKENDS else "torch"
+        self.onnx_path = onnx_path
+        self.model = None
+        self.state = "cold"  # cold -> loading -> ready | unavailable
+        self._loading: Optional[asyncio.Future] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._collector: Optional[asyncio.Task] = None
+        self.stats = {"images": 0, "batches": 0, "encode_time_total": 0.0, "max_batch_seen": 0,
+                      "backend": "", "load_seconds": 0.0, "texts": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self) -> None:
+        """Blocking load + one warm-up encode. Runs on the worker thread (or in scripts)."""
+        t0 = time.perf_counter()
+        self.state = "loading"
+        self.model = None
+        if self.backend == "onnx":
+            self.model = self._load_onnx()
+        if self.model is None:
+            self.model = self._load_torch(quantize=self.backend == "torch-int8")
+        if self.model is not None:
+            try:
+                self._encode([Image.new("RGB", (CLIP_SIDE, CLIP_SIDE))])
+            except Exception:
+                self.model = None
+        self.stats["load_seconds"] = time.perf_counter() - t0
+        self.state = "ready" if self.model is not None else "unavailable"
+
+    def _load_torch(self, quantize: bool = False):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+            torch.set_num_threads(self.torch_threads)
+            model = SentenceTransformer(self.model_name, device="cpu")
+            if quantize:
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.stats["backend"] = "torch-int8" if quantize else "torch"
+            return model
+        except Exception:
+            return None  # degrade gracefully if not installed
+
+    def _load_onnx(self):
+        if not self.onnx_path or not os.path.exists(self.onnx_path):
+            return None
+        try:
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.torch_threads
+            session = ort.InferenceSession(self.onnx_path, options, providers=["CPUExecutionProvider"])
+            self.stats["backend"] = "onnx"
+            return session
+        except Exception:
+            return None
+
+    async def warm_up(self) -> None:
+        """Loads the model on the worker thread, once; concurrent callers share the same load."""
+        await self.start()
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().run_in_executor(self._executor, self.load)
+        await asyncio.shield(self._loading)
+
+    async def start(self) -> None:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="clip")
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.create_task(self._collect())
+
+    async def close(self) -> None:
+        if self._collector is not None:
+            self._collector.cancel()
+            try:
+                await self._collector
+            except asyncio.CancelledError:
+                pass
+            self._collector = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def embed(self, img):
+        """
+        `img` is raw image bytes or a PIL image. Returns a normalized embedding
+        tensor, or None if the model/image is unusable.
+        """
+        if img is None or (isinstance(img, bytes) and not img):
+            return None
+        if self.state != "ready":
+            if self.state != "unavailable":
+                await self.warm_up()
+            if self.model is None:
+                return None
+        await self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((img, fut))
+        return await fut
+
+    async def embed_texts(self, texts: List[str]):
+        """
+        Normalized CLIP text embeddings (one row per text, same space as the
+        image embeddings), or None when the model is unusable or has no text
+        tower (ONNX image export). One call is one batch: no micro-batching.
+        """
+        if not texts:
+            return None
+        if self.state != "ready":
+            if self.state != "unavailable":
+                await self.warm_up()
+            if self.model is None:
+                return None
+        if self.stats["backend"] == "onnx":
+            return None
+        await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._encode_texts, list(texts))
+
+    def _encode_texts(self, texts: List[str]) -> Any:
+        t0 = time.perf_counter()
+        embs = self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True)
+        self.stats["encode_time_total"] += time.perf_counter() - t0
+        self.stats["texts"] += len(texts)
+        return embs
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[Any, asyncio.Future]] = [await self._queue.get()]
+            window_end = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = window_end - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await loop.run_in_executor(self._executor, self._encode_batch, [b for b, _ in batch])
+            except Exception:
+                results = [None] * len(batch)
+            for (_, fut), emb in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(emb)
+
+    def _encode_batch(self, blobs: List[Any]) -> List[Any]:
+        images, slots = [], []
+        for i, blob in enumerate(blobs):
+            try:
+                if isinstance(blob, Image.Image):
+                    images.append(blob)
+                else:
+                    images.append(Image.open(io.BytesIO(blob)).convert("RGB"))
+                slots.append(i)
+            except Exception:
+                continue
+        out: List[Any] = [None] * len(blobs)
+        if not images:
+            return out
+        t0 = time.perf_counter()
+        embs = self._encode(images)
+        self.stats["encode_time_total"] += time.perf_counter() - t0
+        self.stats["images"] += len(images)
+        self.stats["batches"] += 1
+        self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(images))
+        for slot, emb in zip(slots, embs):
+            out[slot] = emb
+        return out
+
+    def _encode(self, images: List[Image.Image]) -> Any:
+        if self.stats["backend"] != "onnx":
+            return self.model.encode(images, batch_size=len(images), convert_to_tensor=True, normalize_embeddings=True)
+        pixels = np.stack([_clip_pixels(img) for img in images])
+        embs = self.model.run(None, {"pixel_values": pixels})[0]
+        return embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+
+
+def _clip_pixels(img: Image.Image) -> np.ndarray:
+    """Resize (short side) + centre crop + normalize, as CLIPProcessor does. Returns CHW float32."""
+    img = img.convert("RGB")
+    scale = CLIP_SIDE / min(img.size)
+    img = img.resize((max(CLIP_SIDE, round(img.width * scale)), max(CLIP_SIDE, round(img.height * scale))), Image.BICUBIC)
+    left, top = (img.width - CLIP_SIDE) // 2, (img.height - CLIP_SIDE) // 2
+    arr = np.asarray(img.crop((left, top, left + CLIP_SIDE, top + CLIP_SIDE)), dtype=np.float32) / 255.0
+    return ((arr - CLIP_MEAN) / CLIP_STD).transpose(2, 0, 1)
+
+
+def export_onnx(model_name: str, out_path: str, int8: bool = False) -> str:
+    """Exports the image tower (pixels -> projected embedding) of a sentence-transformers CLIP model."""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    clip_model = SentenceTransformer(model_name, device="cpu")[0].model
+
+    class _ImageTower(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return self.model.get_image_features(pixel_values=pixel_values)
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    torch.onnx.export(
+        _ImageTower(clip_model).eval(), torch.zeros(1, 3, CLIP_SIDE, CLIP_SIDE), out_path,
+        input_names=["pixel_values"], output_names=["image_embeds"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}}, opset_version=17,
+    )
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        fp32_path, out_path = out_path, out_path.replace(".onnx", "") + ".int8.onnx"
+        quantize_dynamic(fp32_path, out_path, weight_type=QuantType.QInt8)
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLIP encoder tools")
+    parser.add_argument("command", choices=["export-onnx"])
+    parser.add_argument("--model", default=os.environ.get("CLIP_MODEL_NAME", "clip-ViT-B-32"))
+    parser.add_argument("--out", default=os.environ.get("CLIP_ONNX_PATH", ".cache/clip-image.onnx"))
+    parser.add_argument("--int8", action="store_true", help="also write a dynamically quantized copy")
+    args = parser.parse_args()
+    print(export_onnx(args.model, args.out, int8=args.int8))
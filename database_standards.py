@@ -1,4 +1,8 @@
 """Base de données des standards Plomberie & Quincaillerie"""
+import re
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
 
 STANDARDS_TECHNIQUES = {
     "filetages_plomberie": {
@@ -19,5 +23,209 @@ STANDARDS_TECHNIQUES = {
     ]
 }
 
+# -------------------------
+# Référentiel typé
+# -------------------------
+@dataclass(frozen=True)
+class Standard:
+    key: str                    # nom d'usage ("15/21", "M8", "cartouche 40")
+    family: str                 # filetage_gaz | filetage_metrique | cartouche | charniere
+    diameter_mm: float          # diamètre mesurable (ext. du filetage, cartouche, boîtier)
+    label: str
+    pitch_mm: Optional[float] = None
+    tpi: Optional[float] = None  # filets par pouce
+    aliases: Tuple[str, ...] = ()
+    tol_mm: float = 0.0         # 0 = tolérance par défaut (max 0,6 mm / 4 %)
+
+    @property
+    def tolerance(self) -> float:
+        return self.tol_mm or max(0.6, 0.04 * self.diameter_mm)
+
+    def describe(self) -> str:
+        parts = [f"Ø {self.diameter_mm:g} mm"]
+        if self.tpi:
+            parts.append(f"{self.tpi:g} filets/pouce (pas {25.4 / self.tpi:.3f} mm)")
+        elif self.pitch_mm:
+            parts.append(f"pas {self.pitch_mm:g} mm")
+        return f"- {self.key} [{self.family}] : {', '.join(parts)} — {self.label}"
+
+
+def _gas(key: str, inch: str, diameter: float, tpi: float, label: str = "") -> Standard:
+    label = label or STANDARDS_TECHNIQUES["filetages_plomberie"].get(key, f"{inch} Pouce")
+    return Standard(key, "filetage_gaz", diameter, label, pitch_mm=round(25.4 / tpi, 3), tpi=tpi,
+                    aliases=(f"{inch} pouce", f"g{inch}", key.replace("/", "x")))
+
+
+def _metric(size: int, pitch: float) -> Standard:
+    return Standard(f"M{size}", "filetage_metrique", float(size), f"Filetage métrique ISO M{size} pas gros",
+                    pitch_mm=pitch, aliases=(f"m{size}", f"m{size}x{pitch:g}"), tol_mm=0.3)
+
+
+STANDARDS: List[Standard] = [
+    # Filetages gaz cylindriques (BSP / ISO 228), diamètre extérieur mâle
+    _gas("8/13", "1/4", 13.16, 19, "1/4 Pouce - Petits raccords, purgeurs"),
+    _gas("12/17", "3/8", 16.66, 19),
+    _gas("15/21", "1/2", 20.96, 14),
+    _gas("20/27", "3/4", 26.44, 14),
+    _gas("26/34", "1", 33.25, 11),
+    _gas("33/42", "1 1/4", 41.91, 11, "1 1/4 Pouce - Colonnes, évacuations"),
+    _gas("40/49", "1 1/2", 47.80, 11, "1 1/2 Pouce - Colonnes, évacuations"),
+    # Filetages métriques ISO pas gros
+    _metric(3, 0.5), _metric(4, 0.7), _metric(5, 0.8), _metric(6, 1.0), _metric(8, 1.25),
+    _metric(10, 1.5), _metric(12, 1.75), _metric(14, 2.0), _metric(16, 2.0), _metric(20, 2.5),
+    # Cartouches céramiques de mitigeur (diamètre du corps)
+    Standard("cartouche 25", "cartouche", 25.0, "Cartouche céramique Ø25 (lavabo compact)", aliases=("cartouche 25mm",), tol_mm=1.0),
+    Standard("cartouche 35", "cartouche", 35.0, "Cartouche céramique Ø35 (lavabo / évier)", aliases=("cartouche 35mm",), tol_mm=1.0),
+    Standard("cartouche 40", "cartouche", 40.0, "Cartouche céramique Ø40 (évier, douche)", aliases=("cartouche 40mm",), tol_mm=1.0),
+    Standard("cartouche 46", "cartouche", 46.0, "Cartouche céramique Ø46 (anciens mitigeurs)", aliases=("cartouche 46mm",), tol_mm=1.0),
+    # Charnières invisibles à boîtier (diamètre du boîtier)
+    Standard("charniere 26", "charniere", 26.0, "Charnière invisible boîtier Ø26 (petites portes)", aliases=("boitier 26",), tol_mm=1.0),
+    Standard("charniere 35", "charniere", 35.0, "Charnière invisible boîtier Ø35 (standard cuisine)", aliases=("boitier 35",), tol_mm=1.0),
+    Standard("charniere 40", "charniere", 40.0, "Charnière invisible boîtier Ø40 (portes épaisses)", aliases=("boitier 40",), tol_mm=1.0),
+]
+
+# -------------------------
+# Index précalculés
+# -------------------------
+_BY_ALIAS: Dict[str, Standard] = {}
+for _std in STANDARDS:
+    for _alias in (_std.key.lower(),) + _std.aliases:
+        _BY_ALIAS.setdefault(_alias.lower(), _std)
+
+_BY_DIAMETER: List[Tuple[float, Standard]] = sorted(((s.diameter_mm, s) for s in STANDARDS), key=lambda t: t[0])
+_DIAMETERS: List[float] = [d for d, _ in _BY_DIAMETER]
+_MAX_TOL = max(s.tolerance for s in STANDARDS)
+
+_NAME_RE = re.compile(
+    r"\b\d{1,2}\s*[/x]\s*\d{2}\b"                                                 # 15/21, 15x21
+    r"|\bm\d{1,2}(?:\s*x\s*\d(?:[.,]\d+)?)?\b"                                     # M8, M8x1.25
+    r"|\b(?:g|bsp)?\s*\d(?:\s\d)?/\d\s*(?:\"|''|pouces?|po\b)"                     # 1/2", G 1/2 pouce
+    r"|\b(?:g|bsp)\s*\d(?:\s\d)?/\d(?!\d)"                                         # G1/2, BSP 3/4 (pouces implicites)
+    r"|\b(?:cartouche|boitier|boîtier)\s*(?:ø|de\s*)?\d{2}(?!\d)",
+    re.IGNORECASE,
+)
+_MM_RE = re.compile(r"(?:ø|diam(?:[eè]tre)?\.?\s*)?(\d{1,3}(?:[.,]\d{1,2})?)\s*mm\b", re.IGNORECASE)
+_PITCH_RE = re.compile(r"\bpas\s*(?:de\s*)?(\d(?:[.,]\d{1,3})?)\s*(?:mm)?", re.IGNORECASE)
+_TPI_RE = re.compile(r"\b(\d{1,2})\s*(?:tpi|filets?\s*(?:/|par)\s*pouce)", re.IGNORECASE)
+
+
+_FAMILY_HINTS = (
+    (re.compile(r"charni[eè]re|boitier|boîtier", re.IGNORECASE), "charniere"),
+    (re.compile(r"cartouche|mitigeur", re.IGNORECASE), "cartouche"),
+    (re.compile(r"\b(?:vis|boulon|[eé]crou|tige filet[eé]e|m[eé]trique)\b", re.IGNORECASE), "filetage_metrique"),
+    (re.compile(r"robinet|raccord|flexible|t[eê]te|gaz|bsp|plomberie", re.IGNORECASE), "filetage_gaz"),
+)
+
+
+def _alias_key(token: str) -> str:
+    token = token.lower().replace("boîtier", "boitier").replace(",", ".")  # "M8 x 1,25"
+    token = token.replace("''", " pouce").replace('"', " pouce").replace("pouces", "pouce")
+    token = re.sub(r"\bpo\b", "pouce", token)
+    token = re.sub(r"\s*([/x])\s*", r"\1", token)
+    token = re.sub(r"\s+", " ", token).strip()
+    gas = re.match(r"(?:g|bsp) ?(?=\d)", token)
+    if gas:
+        # G / BSP : la taille est toujours en pouces, même sans " ni "pouce"
+        token = token[gas.end():]
+        if not token.endswith(" pouce"):
+            token += " pouce"
+    token = re.sub(r"^(cartouche|boitier) (?:ø|de )?", r"\1 ", token)
+    return token
+
+
+def _standard_for(key: str) -> Optional[Standard]:
+    """Standard d'une clé d'alias ; un pas fin ("m10x1") renvoie au standard de même diamètre nominal."""
+    std = _BY_ALIAS.get(key)
+    if std is None:
+        m = re.fullmatch(r"(m\d{1,2})x\d(?:\.\d+)?", key)
+        if m:
+            std = _BY_ALIAS.get(m.group(1))
+    return std
+
+
+def canonical_query(text: str) -> str:
+    """`text` où chaque standard cité est ramené à sa clé ("1/2 pouce", "G 1/2\"", "15x21" -> "15/21")."""
+    def _sub(m: "re.Match[str]") -> str:
+        key = _alias_key(m.group(0))
+        std = _standard_for(key)
+        if std is None:
+            return m.group(0)
+        if key not in _BY_ALIAS:
+            return f" {std.key}{key[len(std.key):]} "  # pas fin conservé : "M10 x 1" -> "M10x1"
+        return f" {std.key} "
+    return _NAME_RE.sub(_sub, text or "")
+
+
+def match_dimension(value_mm: float, family: Optional[str] = None, tolerance_scale: float = 1.0) -> List[Standard]:
+    """Standards dont le diamètre est compatible avec une mesure (tolérance propre à chaque standard)."""
+    lo = bisect_left(_DIAMETERS, value_mm - _MAX_TOL * tolerance_scale)
+    hi = bisect_right(_DIAMETERS, value_mm + _MAX_TOL * tolerance_scale)
+    hits = [
+        s for d, s in _BY_DIAMETER[lo:hi]
+        if abs(d - value_mm) <= s.tolerance * tolerance_scale and (family is None or s.family == family)
+    ]
+    hits.sort(key=lambda s: abs(s.diameter_mm - value_mm))
+    return hits
+
+
+def match_pitch(pitch_mm: float, tolerance_mm: float = 0.06) -> List[Standard]:
+    return [s for s in STANDARDS if s.pitch_mm and abs(s.pitch_mm - pitch_mm) <= tolerance_mm]
+
+
+def relevant_standards(text: str, limit: int = 6) -> List[Standard]:
+    """Standards cités ou compatibles avec les dimensions présentes dans `text` (mesurées ou estimées)."""
+    if not text:
+        return []
+    found: List[Standard] = []
+
+    def _add(std: Standard):
+        if std not in found:
+            found.append(std)
+
+    for token in _NAME_RE.findall(text):
+        std = _standard_for(_alias_key(token))
+        if std:
+            _add(std)
+    hinted = {family for pattern, family in _FAMILY_HINTS if pattern.search(text)}
+    pitches = [float(p.replace(",", ".")) for p in _PITCH_RE.findall(text)]
+    pitches += [25.4 / float(t) for t in _TPI_RE.findall(text) if float(t) > 0]
+    for value in _MM_RE.findall(text):
+        candidates = match_dimension(float(value.replace(",", ".")))
+        if pitches:
+            # un pas mesuré départage gaz / métrique de diamètres voisins
+            by_pitch = [s for s in candidates if s.pitch_mm and any(abs(s.pitch_mm - p) <= 0.06 for p in pitches)]
+            candidates = by_pitch or candidates
+        # le vocabulaire (charnière, cartouche, vis...) départage les familles de même diamètre
+        candidates = [s for s in candidates if s.family in hinted] or candidates
+        for std in candidates:
+            _add(std)
+    if not found:
+        for p in pitches:
+            for std in match_pitch(p):
+                _add(std)
+    return found[:limit]
+
+
+def find_standard(text: str) -> str:
+    """Premier filetage plomberie identifié dans `text` (ex: "15/21"), sinon ""."""
+    for std in relevant_standards(text):
+        if std.family == "filetage_gaz":
+            return std.key
+    return ""
+
+
+def standards_prompt_block(text: str) -> str:
+    """Lignes du référentiel utiles pour `text`, à injecter dans un prompt (résumé court si rien ne correspond)."""
+    rows = relevant_standards(text)
+    if not rows:
+        return get_standards_summary()
+    return "\n".join(s.describe() for s in rows)
+
+
 def get_standards_summary():
-    return str(STANDARDS_TECHNIQUES)
\ No newline at end of file
+    families: Dict[str, List[str]] = {}
+    for s in STANDARDS:
+        families.setdefault(s.family, []).append(s.key)
+    lines = [f"- {family} : {', '.join(keys)}" for family, keys in families.items()]
+    lines.append(f"- types_tetes : {'; '.join(STANDARDS_TECHNIQUES['types_tetes'])}")
+    return "\n".join(lines)
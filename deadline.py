@@ -0,0 +1,75 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Deadline:
+    """
+    Request-scoped time budget. Created once per identification and passed
+    down the pipeline; every stage asks for `budget(cap)` instead of using its
+    own fixed timeout, so the stages together never outlive the request.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def budget(self, cap: float, reserve: float = 0.0) -> float:
+        """Time a stage may spend: at most `cap`, leaving `reserve` seconds for the stages after it."""
+        return max(0.0, min(cap, self.remaining() - reserve))
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(min(seconds, self.remaining()))
+
+
+def stage_budget(deadline: Optional[Deadline], cap: float, reserve: float = 0.0) -> float:
+    return deadline.budget(cap, reserve) if deadline is not None else cap
+
+
+async def hedged(factory: Callable[[], Awaitable[T]], hedge_after: float, timeout: float,
+                 allow_hedge: Optional[Callable[[], bool]] = None) -> T:
+    """
+    Runs `factory()` and, if it has not answered after `hedge_after` seconds,
+    a second identical attempt; the first to finish wins and the other is
+    cancelled. Once both run, a failure of one falls back to the other; a
+    fast failure is raised as is (retrying it is the caller's business).
+    `hedge_after <= 0` disables hedging; `allow_hedge()`, asked when the second
+    attempt is due, can veto it (e.g. no rate-limit token free right now).
+    Raises DeadlineExceeded after `timeout`.
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    tasks = [asyncio.ensure_future(factory())]
+    try:
+        if 0 < hedge_after < timeout:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done and (allow_hedge is None or allow_hedge()):
+                tasks.append(asyncio.ensure_future(factory()))
+        error: Optional[BaseException] = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0.0, end - loop.time()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded()
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
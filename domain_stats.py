@@ -0,0 +1,184 @@
+"""
+Per-merchant validation statistics, learned from the validations themselves.
+
+For every domain: how often a checked link passes validation (yield), how
+its pages load (latency samples, fetch errors, timeouts) and how often they
+expose a product image. The app uses them to
+- order the candidates (expected yield, smoothed towards a prior for domains
+  seldom seen: trusted merchants start higher)
+- give each domain a fetch timeout fitted to its usual latency
+- skip domains that almost never yield, while still probing them now and
+  then (`explore`) so a fixed merchant can come back
+
+Counters are kept in memory and periodically merged into a SharedCache
+namespace (begin_flush / write / end_flush; other workers' counts come back
+with the merge), so they survive restarts. Old observations fade: counts are
+rescaled once a domain has more than `window` of them.
+"""
+import random
+import statistics
+from typing import Any, Callable, Dict, List, Optional
+
+from shared_cache import SharedCache
+
+COUNTS = ("checks", "ok", "fetches", "errors", "timeouts", "images")
+
+
+def _empty() -> Dict[str, Any]:
+    row: Dict[str, Any] = {k: 0.0 for k in COUNTS}
+    row["latency"] = []
+    return row
+
+
+class DomainStats:
+
+    NS = "domains"
+    TTL = 90 * 24 * 3600  # a merchant not seen for 3 months starts over
+
+    def __init__(self, store: Optional[SharedCache], prior: Callable[[str], float] = lambda domain: 0.3,
+                 prior_weight: float = 4.0, skip_yield: float = 0.05, min_checks: int = 20, explore: float = 0.05,
+                 latency_factor: float = 4.0, min_timeout: float = 2.0, window: int = 200, samples: int = 32):
+        self.store = store
+        self.prior = prior
+        self.prior_weight = prior_weight
+        self.skip_yield = skip_yield
+        self.min_checks = min_checks
+        self.explore = explore
+        self.latency_factor = latency_factor
+        self.min_timeout = min_timeout
+        self.window = window
+        self.samples = samples
+        self._totals: Dict[str, Dict[str, Any]] = {}    # as of the last flush (every worker)
+        self._flushing: Dict[str, Dict[str, Any]] = {}  # being merged into the store
+        self._delta: Dict[str, Dict[str, Any]] = {}     # this worker, since the last flush
+        self.stats = {"skipped": 0, "probes": 0, "flushes": 0, "flush_errors": 0}
+
+    # -------------------------
+    # Recording
+    # -------------------------
+    def _pending(self, domain: str) -> Dict[str, Any]:
+        row = self._delta.get(domain)
+        if row is None:
+            row = self._delta[domain] = _empty()
+        return row
+
+    def record_fetch(self, domain: str, seconds: float, ok: bool, timed_out: bool = False,
+                     has_image: bool = False) -> None:
+        row = self._pending(domain)
+        row["fetches"] += 1
+        row["errors"] += not ok
+        row["timeouts"] += timed_out
+        row["images"] += has_image
+        if ok:
+            row["latency"].append(round(seconds, 3))
+
+    def record_check(self, domain: str, ok: bool) -> None:
+        """Outcome of a validation that could pass (the photo had an embedding)."""
+        row = self._pending(domain)
+        row["checks"] += 1
+        row["ok"] += ok
+
+    # -------------------------
+    # Decisions
+    # -------------------------
+    def get(self, domain: str) -> Dict[str, Any]:
+        """Current counters of `domain` (persisted + not yet flushed)."""
+        row = _empty()
+        for part in (self._totals, self._flushing, self._delta):
+            other = part.get(domain)
+            if other is not None:
+                row = self._merge(row, other, rescale=False)
+        return row
+
+    def expected_yield(self, domain: str) -> float:
+        row = self.get(domain)
+        return (row["ok"] + self.prior(domain) * self.prior_weight) / (row["checks"] + self.prior_weight)
+
+    def should_skip(self, domain: str) -> bool:
+        row = self.get(domain)
+        if row["checks"] < self.min_checks or self.expected_yield(domain) >= self.skip_yield:
+            return False
+        if random.random() < self.explore:
+            self.stats["probes"] += 1
+            return False
+        self.stats["skipped"] += 1
+        return True
+
+    def timeout(self, domain: str, default: float) -> float:
+        """Fetch timeout for `domain`: `latency_factor` x its median load time, within [min_timeout, default]."""
+        latency = self.get(domain)["latency"]
+        if len(latency) < 5:
+            return default
+        return min(default, max(self.min_timeout, self.latency_factor * statistics.median(latency)))
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def _merge(self, a: Dict[str, Any], b: Dict[str, Any], rescale: bool = True) -> Dict[str, Any]:
+        row: Dict[str, Any] = {k: a.get(k, 0.0) + b.get(k, 0.0) for k in COUNTS}
+        row["latency"] = (list(a.get("latency", [])) + list(b.get("latency", [])))[-self.samples:]
+        biggest = max(row["checks"], row["fetches"])
+        if rescale and biggest > self.window:
+            factor = self.window / biggest
+            for k in COUNTS:
+                row[k] *= factor
+        return row
+
+    def load(self) -> None:
+        """Reads every stored domain (blocking: startup or a worker thread)."""
+        if self.store is None:
+            return
+        for domain in self.store.keys(self.NS):
+            row = self.store.get(self.NS, domain)
+            if row is not None:
+                self._totals[domain] = row
+
+    def begin_flush(self) -> Dict[str, Dict[str, Any]]:
+        """Takes the counters recorded since the last flush (on the event loop)."""
+        self._flushing, self._delta = self._delta, {}
+        return self._flushing
+
+    def write(self, delta: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Adds `delta` to the stored rows and returns the merged rows (blocking: worker thread)."""
+        merged = {}
+        for domain, row in delta.items():
+            stored = self._totals.get(domain) or _empty()
+            if self.store is not None:
+                stored = self.store.get(self.NS, domain) or stored
+            merged[domain] = self._merge(stored, row)
+            if self.store is not None:
+                self.store.set(self.NS, domain, merged[domain], self.TTL)
+        return merged
+
+    def end_flush(self, merged: Optional[Dict[str, Dict[str, Any]]]) -> None:
+        """Installs the merged rows; on failure (None) the counters go back to the next flush."""
+        if merged is None:
+            self.stats["flush_errors"] += 1
+            for domain, row in self._flushing.items():
+                self._delta[domain] = self._merge(row, self._delta.get(domain) or _empty(), rescale=False)
+        else:
+            self.stats["flushes"] += 1
+            self._totals.update(merged)
+        self._flushing = {}
+
+    def snapshot(self, limit: int = 50) -> Dict[str, Any]:
+        domains: List[Dict[str, Any]] = []
+        for domain in set(self._totals) | set(self._flushing) | set(self._delta):
+            row = self.get(domain)
+            fetches = row["fetches"] or 1.0
+            domains.append({
+                "domain": domain,
+                "checks": round(row["checks"], 1),
+                "yield": round(self.expected_yield(domain), 3),
+                "fetches": round(row["fetches"], 1),
+                "error_rate": round(row["errors"] / fetches, 3),
+                "timeout_rate": round(row["timeouts"] / fetches, 3),
+                "image_rate": round(row["images"] / fetches, 3),
+                "median_latency": statistics.median(row["latency"]) if row["latency"] else None,
+                "skipping": row["checks"] >= self.min_checks and self.expected_yield(domain) < self.skip_yield,
+            })
+        domains.sort(key=lambda d: d["fetches"], reverse=True)
+        s: Dict[str, Any] = dict(self.stats)
+        s["domains"] = len(domains)
+        s["top"] = domains[:limit]
+        return s
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    On-disk cache of product-image embeddings, shared by every uvicorn worker.
+
+    Vectors live in a memory-mapped float16 matrix (`vectors.f16`, one row per
+    slot); a small SQLite index (WAL mode) maps content hash -> slot and image
+    URL -> content hash. Rows expire after `ttl_seconds`; when the matrix is
+    full the least recently used slot is reused.
+    """
+
+    TOUCH_INTERVAL = 60.0  # don't rewrite last_used more often than this
+
+    def __init__(self, directory: str, dim: int = 512, capacity: int = 20000, ttl_seconds: int = 30 * 24 * 3600):
+        self.directory = directory
+        self.dim = dim
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite3"), timeout=10.0,
+                                   isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                hash TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL,
+                created REAL NOT NULL, last_used REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS vectors_last_used ON vectors(last_used);
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY, hash TEXT NOT NULL, created REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS urls_hash ON urls(hash);
+        """)
+        path = os.path.join(directory, "vectors.f16")
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if not os.path.exists(path):
+                    np.memmap(path, dtype=np.float16, mode="w+", shape=(capacity, dim)).flush()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self._mat = np.memmap(path, dtype=np.float16, mode="r+", shape=(capacity, dim))
+        self.hits = 0
+        self.misses = 0
+
+    # -------------------------
+    # Lookups
+    # -------------------------
+    def get_by_hash(self, h: str) -> Optional[np.ndarray]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT slot, created, last_used FROM vectors WHERE hash=?", (h,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            slot, _, last_used = row
+            vec = np.array(self._mat[slot], dtype=np.float32)
+            if now - last_used > self.TOUCH_INTERVAL:
+                self._db.execute("UPDATE vectors SET last_used=? WHERE hash=?", (now, h))
+        self.hits += 1
+        return vec
+
+    def get_by_url(self, url: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._db.execute("SELECT hash, created FROM urls WHERE url=?", (url,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        return self.get_by_hash(row[0])
+
+    # -------------------------
+    # Inserts
+    # -------------------------
+    def put(self, url: Optional[str], h: str, emb) -> None:
+        vec = np.asarray(emb.detach().cpu().numpy() if hasattr(emb, "detach") else emb, dtype=np.float16).reshape(-1)
+        if vec.shape[0] != self.dim:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT slot FROM vectors WHERE hash=?", (h,)).fetchone()
+                if row is not None:
+                    slot = row[0]
+                    self._db.execute("UPDATE vectors SET created=?, last_used=? WHERE hash=?", (now, now, h))
+                else:
+                    slot = self._free_slot(now)
+                    self._db.execute("INSERT INTO vectors(hash, slot, created, last_used) VALUES (?,?,?,?)",
+                                     (h, slot, now, now))
+                self._mat[slot] = vec
+                self._mat.flush()
+                if url:
+                    self._db.execute("INSERT OR REPLACE INTO urls(url, hash, created) VALUES (?,?,?)", (url, h, now))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _free_slot(self, now: float) -> int:
+        # Expired rows first, then a never-used slot, then the LRU row.
+        row = self._db.execute("SELECT hash, slot FROM vectors WHERE created < ? ORDER BY last_used LIMIT 1",
+                               (now - self.ttl,)).fetchone()
+        if row is None:
+            count = self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            if count < self.capacity:
+                used = self._db.execute("SELECT COALESCE(MAX(slot), -1) FROM vectors").fetchone()[0]
+                if used + 1 < self.capacity:
+                    return used + 1
+                # Slots were freed in the middle of the range: find a hole.
+                taken = {r[0] for r in self._db.execute("SELECT slot FROM vectors")}
+                return next(i for i in range(self.capacity) if i not in taken)
+            row = self._db.execute("SELECT hash, slot FROM vectors ORDER BY last_used LIMIT 1").fetchone()
+        self._db.execute("DELETE FROM vectors WHERE hash=?", (row[0],))
+        self._db.execute("DELETE FROM urls WHERE hash=?", (row[0],))
+        return row[1]
+
+    def close(self) -> None:
+        with self._lock:
+            self._mat.flush()
+            self._db.close()
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from groq import APIConnectionError, APIStatusError, APITimeoutError, AsyncGroq
+
+from rate_limit import CircuitOpen, ProviderLimiter, RateLimited, retry_after_seconds
+
+
+class VisionError(Exception):
+    pass
+
+
+class VisionOverloaded(VisionError):
+    """Too many identifications already waiting for a Groq slot."""
+
+
+class VisionTimeout(VisionError):
+    """The request deadline expired while queued or while the model was running."""
+
+
+class VisionUnavailable(VisionError):
+    """Groq is failing (circuit open) or rate limited beyond the request's deadline."""
+
+
+class VisionStage:
+    """
+    Async Groq vision stage shared by every request of the worker.
+    One AsyncGroq client (opened at startup), at most `max_concurrency`
+    completions in flight, at most `max_queue` requests waiting for a slot,
+    and a per-request deadline covering queue wait + model time.
+    With a `limiter`, calls also wait for the provider's rate limit, 429 / 5xx
+    answers are retried (up to `retries` times) within the deadline, and a
+    failing provider is skipped (circuit open) instead of queued for.
+    """
+
+    def __init__(self, model: str, timeout: float, max_concurrency: int = 16, max_queue: int = 64,
+                 limiter: Optional[ProviderLimiter] = None, retries: int = 1):
+        self.model = model
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.limiter = limiter
+        self.retries = retries
+        self._client: Optional[AsyncGroq] = None
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+        self._in_flight = 0
+        self._stats = {
+            "requests": 0,
+            "started": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "queue_wait_total": 0.0,
+            "queue_wait_max": 0.0,
+            "model_time_total": 0.0,
+            "model_time_max": 0.0,
+        }
+
+    def start(self, api_key: Optional[str]) -> None:
+        # Without a key the app still serves `/`; identifications report the missing key.
+        if self._client is None and api_key:
+            self._client = AsyncGroq(api_key=api_key, timeout=self.timeout, max_retries=0)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def complete(self, messages: List[Dict[str, Any]], timeout: Optional[float] = None,
+                       response_format: Optional[Dict[str, Any]] = None) -> str:
+        """Runs one chat completion and returns the message content."""
+        if self._client is None:
+            raise VisionError("GROQ_API_KEY_MISSING")
+        self._stats["requests"] += 1
+        if self._waiting >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise VisionOverloaded("vision_queue_full")
+
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        queued_at = time.monotonic()
+        probe = False
+        self._waiting += 1
+        try:
+            if self.limiter is not None:
+                probe = await self.limiter.acquire(max_wait=max(0.0, deadline - queued_at))
+            try:
+                await asyncio.wait_for(self._sem.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+            except BaseException:
+                if probe:
+                    self.limiter.release_probe()  # timed out or cancelled before calling the provider
+                raise
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise VisionTimeout("vision_queue_timeout")
+        except (CircuitOpen, RateLimited) as e:
+            self._stats["rejected"] += 1
+            raise VisionUnavailable(f"vision_{type(e).__name__.lower()}")
+        finally:
+            self._waiting -= 1
+
+        wait = time.monotonic() - queued_at
+        self._stats["started"] += 1
+        self._stats["queue_wait_total"] += wait
+        self._stats["queue_wait_max"] = max(self._stats["queue_wait_max"], wait)
+
+        self._in_flight += 1
+        started = time.monotonic()
+        try:
+            kwargs: Dict[str, Any] = {"model": self.model, "messages": messages}
+            if response_format:
+                kwargs["response_format"] = response_format
+            completion = await self._create(kwargs, deadline)
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise VisionTimeout("vision_model_timeout")
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            self._sem.release()
+            if probe:
+                self.limiter.release_probe()  # no-op once _create() recorded an outcome
+            elapsed = time.monotonic() - started
+            self._stats["model_time_total"] += elapsed
+            self._stats["model_time_max"] = max(self._stats["model_time_max"], elapsed)
+
+        self._stats["completed"] += 1
+        return completion.choices[0].message.content
+
+    async def _create(self, kwargs: Dict[str, Any], deadline: float):
+        """One completion; with a limiter, reads the quota headers and retries 429 / 5xx while time remains."""
+        if self.limiter is None:
+            return await asyncio.wait_for(self._client.chat.completions.create(**kwargs),
+                                          timeout=max(0.0, deadline - time.monotonic()))
+        attempt = 0
+        while True:
+            try:
+                raw = await asyncio.wait_for(self._client.chat.completions.with_raw_response.create(**kwargs),
+                                             timeout=max(0.0, deadline - time.monotonic()))
+            except APIStatusError as e:
+                self.limiter.record(e.status_code, e.response.headers)
+                retryable = e.status_code == 429 or e.status_code >= 500
+                delay = self.limiter.backoff(attempt, retry_after_seconds(e.response.headers))
+                if not retryable or attempt >= self.retries or time.monotonic() + delay >= deadline - 1.0:
+                    raise
+            except (asyncio.TimeoutError, APITimeoutError, APIConnectionError):
+                self.limiter.record(None)
+                raise
+            else:
+                self.limiter.record(raw.status_code, raw.headers)
+                return await raw.parse()
+            attempt += 1
+            self.limiter.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self._stats)
+        done = max(1, s["started"])
+        s["queue_wait_avg"] = s["queue_wait_total"] / done
+        s["model_time_avg"] = s["model_time_total"] / done
+        s["waiting"] = self._waiting
+        s["in_flight"] = self._in_flight
+        s["max_concurrency"] = self.max_concurrency
+        s["max_queue"] = self.max_queue
+        return s
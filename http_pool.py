@@ -0,0 +1,108 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (compatible; PartFinderBot/1.0)",
+    "Accept-Language": "fr-FR,fr;q=0.9,en;q=0.8",
+}
+
+
+class HttpPool:
+    """
+    Application-lifetime httpx connection pool shared by every network helper.
+    Connections are kept alive between requests (so DNS + TCP + TLS are paid
+    once per host, not once per call), HTTP/2 is used when `h2` is installed,
+    and each host gets at most `per_host` concurrent requests.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 40,
+                 keepalive_expiry: float = 30.0, per_host: int = 8,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.per_host = per_host
+        self.transport = transport  # e.g. the replay benchmark's stub routing
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_sems: Dict[str, asyncio.Semaphore] = {}
+
+    async def open(self) -> None:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=self.limits,
+                headers=DEFAULT_HEADERS,
+                transport=self.transport,
+            )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            # Used outside the lifespan (scripts, REPL): open lazily.
+            self._client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=self.limits, headers=DEFAULT_HEADERS,
+                                             transport=self.transport)
+        return self._client
+
+    def _host_sem(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).netloc.lower()
+        sem = self._host_sems.get(host)
+        if sem is None:
+            sem = self._host_sems[host] = asyncio.Semaphore(self.per_host)
+        return sem
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        async with self._host_sem(url):
+            return await self.client.get(url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        async with self._host_sem(url):
+            return await self.client.post(url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Response whose body has not been read yet: headers can be inspected
+        before anything else is transferred, and leaving the block early
+        drops the rest of the body (the connection/stream is reset).
+        """
+        async with self._host_sem(url):
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+
+
+def declared_length(response: httpx.Response) -> Optional[int]:
+    try:
+        return int(response.headers["content-length"])
+    except (KeyError, ValueError):
+        return None
+
+
+async def read_capped(response: httpx.Response, max_bytes: int) -> Optional[bytes]:
+    """Whole body of a streamed response, or None if it is (or turns out to be) larger than `max_bytes`."""
+    length = declared_length(response)
+    if length is not None and length > max_bytes:
+        return None
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > max_bytes:
+            return None
+    return bytes(body)
+
@@ -0,0 +1,126 @@
+import io
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+VISION_MAX_SIDE = 1280      # longest side of the JPEG sent to the vision model
+VISION_JPEG_QUALITY = 85
+ANALYSIS_MAX_SIDE = 1024    # grayscale array used for blur / brightness
+CLIP_SIDE = 224
+MIN_PIXELS = 224 * 224
+
+BLUR_MIN = 8                # Laplacian variance with the long side at ANALYSIS_MAX_SIDE
+BRIGHTNESS_MIN = 20
+
+
+@dataclass
+class PreparedImage:
+    """Artifacts derived from one decode of an uploaded photo."""
+    width: int = 0
+    height: int = 0
+    blur_score: float = 0.0
+    brightness: float = 0.0
+    phash: int = 0
+    vision_jpeg: bytes = b""
+    clip_image: Optional[Image.Image] = None
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def size_ok(self) -> bool:
+        return self.width * self.height >= MIN_PIXELS
+
+    @property
+    def ok(self) -> bool:
+        return not self.reasons
+
+    def quality(self) -> Dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "reasons": self.reasons,
+            "blur_score": self.blur_score,
+            "brightness": self.brightness,
+            "size_ok": self.size_ok,
+        }
+
+
+def variance_of_laplacian_numpy(gray: np.ndarray) -> float:
+    gy, gx = np.gradient(gray.astype(np.float32))
+    grad_mag = np.sqrt(gx * gx + gy * gy)
+    return float(np.var(grad_mag))
+
+
+def blur_score(gray: np.ndarray) -> float:
+    """Higher = sharper. Falls back to numpy gradients if OpenCV is not available."""
+    try:
+        import cv2  # type: ignore
+        return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    except Exception:
+        return variance_of_laplacian_numpy(gray)
+
+
+def dhash(gray: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: robust to rescaling, recompression and small shifts."""
+    small = np.asarray(gray.resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def _fit(img: Image.Image, max_side: int) -> Image.Image:
+    if max(img.size) <= max_side:
+        return img
+    out = img.copy()
+    out.thumbnail((max_side, max_side), Image.BILINEAR)
+    return out
+
+
+def _scale_to(img: Image.Image, side: int) -> Image.Image:
+    # Upscales small images too, so the blur score is always measured at the same size
+    ratio = side / max(img.size)
+    return img.resize((max(1, round(img.width * ratio)), max(1, round(img.height * ratio))), Image.BILINEAR)
+
+
+def prepare_upload(img_bytes: bytes) -> PreparedImage:
+    """
+    Decodes the upload once and derives everything the pipeline needs:
+    quality metrics, a resized JPEG for the vision model and a CLIP-sized image.
+    Large JPEGs are decoded at reduced scale (draft mode) since nothing
+    downstream needs more than VISION_MAX_SIDE pixels.
+    """
+    prepared = PreparedImage()
+    try:
+        img = Image.open(io.BytesIO(img_bytes))
+        prepared.width, prepared.height = img.size
+        if img.format == "JPEG":
+            img.draft("RGB", (VISION_MAX_SIDE, VISION_MAX_SIDE))
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    except Exception:
+        prepared.reasons = ["image_blurry", "image_too_small", "image_too_dark"]
+        return prepared
+
+    # EXIF rotation may have swapped the axes
+    if (img.width > img.height) != (prepared.width > prepared.height):
+        prepared.width, prepared.height = prepared.height, prepared.width
+
+    gray_img = _fit(img, ANALYSIS_MAX_SIDE).convert("L")
+    gray = np.asarray(gray_img)
+    prepared.phash = dhash(gray_img)
+    prepared.blur_score = blur_score(gray if max(gray_img.size) == ANALYSIS_MAX_SIDE
+                                     else np.asarray(_scale_to(gray_img, ANALYSIS_MAX_SIDE)))
+    prepared.brightness = float(gray.mean())
+
+    buf = io.BytesIO()
+    _fit(img, VISION_MAX_SIDE).save(buf, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+    prepared.vision_jpeg = buf.getvalue()
+    prepared.clip_image = ImageOps.fit(img, (CLIP_SIDE, CLIP_SIDE), Image.BICUBIC)
+
+    if prepared.blur_score < BLUR_MIN:
+        prepared.reasons.append("image_blurry")
+    if not prepared.size_ok:
+        prepared.reasons.append("image_too_small")
+    if prepared.brightness < BRIGHTNESS_MIN:
+        prepared.reasons.append("image_too_dark")
+    return prepared
@@ -0,0 +1,261 @@
+"""
+CLIP inference sidecar: one process owns the model and serves every uvicorn
+worker over a Unix socket, so N workers share one copy of the weights and
+their requests are micro-batched together.
+
+    python -m inference_server --socket /tmp/partfinder-clip.sock
+    CLIP_SIDECAR=/tmp/partfinder-clip.sock uvicorn app:app --workers 4
+
+Wire format: frames of 4-byte big-endian length + 4-byte request id + body.
+Requests:  b"E" + encoded image | b"R" + uint16 w, h + raw RGB | b"T" + JSON list of texts | b"S" (status)
+Responses: b"V" + float32 vector (texts: rows concatenated) | b"N" (no embedding) | b"S" + JSON status
+"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from clip_engine import ClipEngine
+
+_HEADER = struct.Struct(">II")  # body length, request id
+_SIZE = struct.Struct(">HH")
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    length, req_id = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    return req_id, await reader.readexactly(length)
+
+
+def _frame(req_id: int, body: bytes) -> bytes:
+    return _HEADER.pack(len(body), req_id) + body
+
+
+def _encode_request(img) -> bytes:
+    if isinstance(img, Image.Image):
+        img = img.convert("RGB")
+        return b"R" + _SIZE.pack(*img.size) + img.tobytes()
+    return b"E" + bytes(img)
+
+
+def _decode_request(body: bytes):
+    if body[:1] == b"R":
+        w, h = _SIZE.unpack(body[1:5])
+        return Image.frombytes("RGB", (w, h), body[5:])
+    return body[1:]
+
+
+# -------------------------
+# Server
+# -------------------------
+class InferenceServer:
+
+    def __init__(self, engine: ClipEngine, socket_path: str):
+        self.engine = engine
+        self.socket_path = socket_path
+        self.clients = 0
+
+    async def _answer(self, req_id: int, body: bytes, writer: asyncio.StreamWriter, lock: asyncio.Lock) -> None:
+        if body[:1] == b"S":
+            status = {"state": self.engine.state, "backend": self.engine.stats["backend"], "clients": self.clients,
+                      "images": self.engine.stats["images"], "batches": self.engine.stats["batches"]}
+            out = b"S" + json.dumps(status).encode()
+        elif body[:1] == b"T":
+            try:
+                embs = await self.engine.embed_texts(json.loads(body[1:]))
+            except Exception:
+                embs = None
+            out = b"N" if embs is None else b"V" + np.asarray(embs, dtype=np.float32).tobytes()
+        else:
+            emb = await self.engine.embed(_decode_request(body))
+            if emb is None:
+                out = b"N"
+            else:
+                vec = emb.detach().cpu().numpy() if hasattr(emb, "detach") else emb
+                out = b"V" + np.asarray(vec, dtype=np.float32).reshape(-1).tobytes()
+        async with lock:
+            writer.write(_frame(req_id, out))
+            await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients += 1
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                req_id, body = await _read_frame(reader)
+                # requests of one connection are answered out of order, as batches complete
+                task = asyncio.create_task(self._answer(req_id, body, writer, lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            self.clients -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        await self.engine.start()
+        await self.engine.warm_up()
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        print(f"inference sidecar on {self.socket_path}: clip={self.engine.state} backend={self.engine.stats['backend']}")
+        async with server:
+            await server.serve_forever()
+
+
+# -------------------------
+# Client (same interface as ClipEngine)
+# -------------------------
+class RemoteClipEngine:
+    """
+    Drop-in replacement for ClipEngine that forwards `embed()` to the sidecar.
+    One multiplexed connection per worker; reconnects lazily when the sidecar
+    restarts. Returns None (no visual check) while the sidecar is unreachable.
+    """
+
+    RECONNECT_INTERVAL = 2.0
+
+    def __init__(self, socket_path: str, timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.state = "cold"
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._last_attempt = 0.0
+        self.stats: Dict[str, Any] = {"images": 0, "batches": 0, "encode_time_total": 0.0, "max_batch_seen": 1,
+                                      "backend": "sidecar", "load_seconds": 0.0, "errors": 0, "texts": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    async def start(self) -> None:
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+
+    async def warm_up(self) -> None:
+        t0 = time.perf_counter()
+        status = await self.status()
+        self.stats["load_seconds"] = time.perf_counter() - t0
+        if status is not None:
+            self.state = "ready" if status.get("state") == "ready" else "unavailable"
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending()
+
+    async def _connect(self) -> bool:
+        await self.start()
+        async with self._connect_lock:
+            if self._writer is not None:
+                return True
+            if time.monotonic() - self._last_attempt < self.RECONNECT_INTERVAL:
+                return False
+            self._last_attempt = time.monotonic()
+            try:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError:
+                self.state = "unavailable"
+                return False
+            self._reader_task = asyncio.create_task(self._read_loop(self._reader))
+            return True
+
+    async def _read_loop(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                req_id, body = await _read_frame(reader)
+                fut = self._pending.pop(req_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(body)
+        except (asyncio.IncompleteReadError, ConnectionResetError, OSError):
+            pass
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = None
+            self._fail_pending()
+
+    def _fail_pending(self) -> None:
+        for fut in self._pending.values():
+            if not fut.done():
+                fut.set_result(None)
+        self._pending.clear()
+
+    async def _call(self, body: bytes) -> Optional[bytes]:
+        if self._writer is None and not await self._connect():
+            return None
+        writer = self._writer
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        req_id = self._next_id
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        try:
+            writer.write(_frame(req_id, body))
+            await writer.drain()
+            return await asyncio.wait_for(fut, timeout=self.timeout)
+        except (asyncio.TimeoutError, OSError):
+            self.stats["errors"] += 1
+            return None
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def status(self) -> Optional[Dict[str, Any]]:
+        out = await self._call(b"S")
+        return json.loads(out[1:]) if out and out[:1] == b"S" else None
+
+    async def embed(self, img):
+        if img is None or (isinstance(img, bytes) and not img):
+            return None
+        t0 = time.perf_counter()
+        out = await self._call(_encode_request(img))
+        self.stats["encode_time_total"] += time.perf_counter() - t0
+        if not out or out[:1] != b"V":
+            return None
+        self.state = "ready"
+        self.stats["images"] += 1
+        self.stats["batches"] += 1
+        return np.frombuffer(out[1:], dtype=np.float32)
+
+    async def embed_texts(self, texts: List[str]):
+        if not texts:
+            return None
+        t0 = time.perf_counter()
+        out = await self._call(b"T" + json.dumps(list(texts), ensure_ascii=False).encode("utf-8"))
+        self.stats["encode_time_total"] += time.perf_counter() - t0
+        if not out or out[:1] != b"V":
+            return None
+        self.stats["texts"] += len(texts)
+        return np.frombuffer(out[1:], dtype=np.float32).reshape(len(texts), -1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CLIP inference sidecar")
+    parser.add_argument("--socket", default=os.environ.get("CLIP_SIDECAR") or "/tmp/partfinder-clip.sock")
+    parser.add_argument("--model", default=os.environ.get("CLIP_MODEL_NAME", "clip-ViT-B-32"))
+    parser.add_argument("--backend", default=os.environ.get("CLIP_BACKEND", "torch"))
+    parser.add_argument("--onnx-path", default=os.environ.get("CLIP_ONNX_PATH", ".cache/clip-image.onnx"))
+    parser.add_argument("--max-batch", type=int, default=int(os.environ.get("CLIP_MAX_BATCH", "32")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.environ.get("CLIP_MAX_WAIT_MS", "8")))
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("CLIP_TORCH_THREADS", "0")) or None)
+    args = parser.parse_args()
+    engine = ClipEngine(args.model, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                        torch_threads=args.threads, backend=args.backend, onnx_path=args.onnx_path)
+    asyncio.run(InferenceServer(engine, args.socket).serve())
@@ -0,0 +1,203 @@
+"""
+In-process metrics in the Prometheus text format (no client library needed)
+and optional per-request traces.
+
+    with metrics.timed("page_fetch"):
+        ...
+    metrics.inc("candidates_total", domain="amazon.fr", valid="true")
+
+`/metrics` renders every histogram / counter plus the gauges registered with
+`metrics.collector(fn)` (fn returns {name: value} or {name: {labels: value}}).
+Traces are logged as one JSON line per request on the `partfinder.trace`
+logger when TRACE_LOG=1.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_trace: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("trace", default=None)
+trace_logger = logging.getLogger("partfinder.trace")
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: Labels, le: Optional[str] = None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class _Timer:
+    __slots__ = ("registry", "stage", "labels", "t0")
+
+    def __init__(self, registry: "Metrics", stage: str, labels: Dict[str, str]):
+        self.registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and "outcome" not in self.labels:
+            self.labels["outcome"] = "cancelled" if issubclass(exc_type, asyncio.CancelledError) else "error"
+        self.registry.observe(self.stage, time.perf_counter() - self.t0, t0=self.t0, **self.labels)
+
+
+class Metrics:
+
+    def __init__(self, prefix: str = "partfinder"):
+        self.prefix = prefix
+        self._histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._collectors: List[Callable[[], Dict[str, Any]]] = []
+        self._lag_task: Optional[asyncio.Task] = None
+
+    # -------------------------
+    # Recording
+    # -------------------------
+    def timed(self, stage: str, **labels: str) -> _Timer:
+        """Context manager timing one stage into the `stage_seconds` histogram (and the current trace)."""
+        return _Timer(self, stage, labels)
+
+    def observe(self, stage: str, seconds: float, t0: Optional[float] = None, **labels: str) -> None:
+        key = ("stage_seconds", (("stage", stage),) + tuple(sorted(labels.items())))
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = Histogram(STAGE_BUCKETS)
+        hist.observe(seconds)
+        trace = _trace.get()
+        if trace is not None:
+            start = (t0 if t0 is not None else time.perf_counter() - seconds) - trace["t0"]
+            trace["spans"].append({"stage": stage, "start": round(start, 4), "seconds": round(seconds, 4), **labels})
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def collector(self, fn: Callable[[], Dict[str, Any]]) -> Callable[[], Dict[str, Any]]:
+        self._collectors.append(fn)
+        return fn
+
+    # -------------------------
+    # Traces
+    # -------------------------
+    def start_trace(self, name: str, **fields: Any) -> None:
+        """Starts collecting spans for the current request (tasks it creates inherit the trace)."""
+        if trace_logger.isEnabledFor(logging.INFO):
+            _trace.set({"name": name, "t0": time.perf_counter(), "spans": [], **fields})
+
+    def end_trace(self, **fields: Any) -> None:
+        trace = _trace.get()
+        if trace is None:
+            return
+        _trace.set(None)
+        trace.update(fields)
+        trace["seconds"] = round(time.perf_counter() - trace.pop("t0"), 4)
+        trace_logger.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+    # -------------------------
+    # Event-loop lag
+    # -------------------------
+    def start_loop_monitor(self, interval: float = 0.5) -> None:
+        if self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._monitor_loop(interval))
+
+    async def stop_loop_monitor(self) -> None:
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+            self._lag_task = None
+
+    async def _monitor_loop(self, interval: float) -> None:
+        key = ("event_loop_lag_seconds", ())
+        hist = self._histograms.setdefault(key, Histogram(LAG_BUCKETS))
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(interval)
+            # how late the loop woke us up: time some callback spent blocking it
+            hist.observe(max(0.0, loop.time() - t0 - interval))
+
+    # -------------------------
+    # Exposition
+    # -------------------------
+    def render(self) -> str:
+        lines: List[str] = []
+        p = self.prefix
+        typed = set()
+        for (name, labels), hist in sorted(self._histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f"{p}_{name}_bucket{_fmt_labels(labels, '%g' % bound)} {cumulative}")
+            lines.append(f"{p}_{name}_bucket{_fmt_labels(labels, '+Inf')} {hist.count}")
+            lines.append(f"{p}_{name}_sum{_fmt_labels(labels)} {hist.total:.6f}")
+            lines.append(f"{p}_{name}_count{_fmt_labels(labels)} {hist.count}")
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {p}_{name} counter")
+                typed.add(name)
+            lines.append(f"{p}_{name}{_fmt_labels(labels)} {value:g}")
+        for fn in self._collectors:
+            try:
+                values = fn()
+            except Exception:
+                continue
+            for name, value in values.items():
+                if name not in typed:
+                    lines.append(f"# TYPE {p}_{name} gauge")
+                    typed.add(name)
+                series = value if isinstance(value, dict) else {(): value}
+                for labels, v in series.items():
+                    if isinstance(v, (int, float)):
+                        lines.append(f"{p}_{name}{_fmt_labels(labels)} {float(v):g}")
+        return "\n".join(lines) + "\n"
+
+
+def enable_trace_log(stream=None) -> None:
+    if not trace_logger.handlers:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+
+
+metrics = Metrics()
@@ -0,0 +1,101 @@
+"""
+Async DAG runner for the identification agents.
+
+    graph = AgentGraph()
+    graph.add("vision", vision_node)
+    graph.add("matiere", matiere_node, deps=("vision",), timeout=8, required=False)
+    graph.add("standard", standard_node, deps=("vision",))
+    graph.add("sourcing", sourcing_node, deps=("standard",))
+    async for name, result in graph.run(deadline):   # in completion order
+        ...
+
+Every node starts as soon as all its dependencies are done and receives the
+results so far. A node's own timeout is capped by the request deadline.
+A failing `required` node stops the graph (run() raises its error); an
+optional node that fails or times out yields None and its dependents run
+anyway. With `wait_optional=False`, run() stops (cancelling the optional
+nodes still running) as soon as every required node is done.
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+from deadline import Deadline, stage_budget
+from metrics import metrics
+
+NodeFn = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+
+@dataclass
+class Node:
+    name: str
+    fn: NodeFn
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+    required: bool = True
+
+
+class AgentGraph:
+
+    def __init__(self):
+        self.nodes: Dict[str, Node] = {}
+        self.errors: Dict[str, BaseException] = {}
+
+    def add(self, name: str, fn: NodeFn, deps: Tuple[str, ...] = (), timeout: Optional[float] = None,
+            required: bool = True) -> "AgentGraph":
+        missing = [d for d in deps if d not in self.nodes]
+        if missing:
+            raise ValueError(f"{name}: unknown dependencies {missing} (add them first)")
+        self.nodes[name] = Node(name, fn, tuple(deps), timeout, required)
+        return self
+
+    async def run(self, deadline: Optional[Deadline] = None,
+                  wait_optional: bool = True) -> AsyncIterator[Tuple[str, Any]]:
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Any] = {}
+        done_futs = {name: loop.create_future() for name in self.nodes}
+
+        async def _run(node: Node) -> Any:
+            fut = done_futs[node.name]
+            try:
+                for dep in node.deps:
+                    await asyncio.shield(done_futs[dep])
+                if node.timeout is not None or deadline is not None:
+                    timeout = stage_budget(deadline, node.timeout if node.timeout is not None else float("inf"))
+                    with metrics.timed("agent", agent=node.name):
+                        value = await asyncio.wait_for(node.fn(results), timeout)
+                else:
+                    with metrics.timed("agent", agent=node.name):
+                        value = await node.fn(results)
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            except Exception as e:
+                self.errors[node.name] = e
+                if node.required:
+                    fut.set_exception(e)
+                    fut.exception()  # dependents re-raise it; no "never retrieved" warning
+                    raise
+                value = None
+            results[node.name] = value
+            fut.set_result(value)
+            return value
+
+        tasks = {asyncio.create_task(_run(node)): node for node in self.nodes.values()}
+        pending = set(tasks)
+        try:
+            while pending:
+                if not wait_optional and not any(tasks[t].required for t in pending):
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node = tasks[task]
+                    if task.exception() is not None:
+                        raise task.exception()
+                    yield node.name, task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # failures after the first are reported through self.errors
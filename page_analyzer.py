@@ -0,0 +1,257 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+# The document is walked forward once, chunk by chunk, and never rescanned.
+# Tags (<meta>, <img>, JSON-LD <script>, </head>) come from one scanner
+# anchored on "<"; each text signal has its own small scanner that retires as
+# soon as the signal is seen. Separate literal-prefixed patterns are much
+# cheaper in CPython's `re` than one big case-insensitive alternation.
+_TAG_RE = re.compile(
+    r"<(?:"
+    r"(?i:script)\b(?P<ld_attrs>[^>]*(?i:application/ld\+json)[^>]*)>(?P<ld>.*?)</(?i:script)\s*>"
+    r"|(?i:meta)\b(?P<meta>[^>]*)>"
+    r"|(?i:img)\b(?P<img>[^>]*)>"
+    r"|(?P<head_end>/(?i:head)\s*>)"
+    r")",
+    re.DOTALL,
+)
+_SIGNAL_RES = {
+    "itemprop": re.compile(r"[iI][tT][eE][mM][pP][rR][oO][pP]\s*=\s*[\"'](?:[pP][rR][iI][cC][eE]|[sS][kK][uU])[\"']"),
+    "price_json": re.compile(r"\"[pP][rR][iI][cC][eE]\"\s*:\s*\"?\d"),
+    "price_text": re.compile(r"\d[\d\s,.]{1,6}\s?(?:€|[eE][uU][rR])"),
+    "reference": re.compile(r"(?:[rR][éÉ][fF](?:[éÉ][rR][eE][nN][cC][eE])?|[sS][kK][uU]|[pP][aA][rR][tT](?: ?[nN][oO]|[nN][uU][mM][bB][eE][rR]))\b"),
+    "mm": re.compile(r"\d{1,4}\s?[mM][mM]\b"),
+}
+# These two must not start inside a word (the original patterns were \b-anchored).
+_WORD_START = {"reference", "mm"}
+_ATTR_RE = re.compile(r"([\w:-]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+_LD_OPEN_RE = re.compile(r"<script\b[^>]*application/ld\+json", re.IGNORECASE)
+_PRODUCT_CLASS_RE = re.compile(r"product|produit", re.IGNORECASE)
+
+_IMAGE_PRIORITY = {"og": 0, "itemprop": 1, "jsonld": 2, "img_product": 3, "img": 4}
+
+
+def _attrs(raw: str) -> Dict[str, str]:
+    return {m.group(1).lower(): (m.group(2) if m.group(2) is not None else m.group(3)) for m in _ATTR_RE.finditer(raw)}
+
+
+@dataclass
+class PageInfo:
+    image: str = ""
+    image_source: str = ""
+    price: str = ""
+    currency: str = ""
+    sku: str = ""
+    availability: str = ""
+    product_markup: bool = False   # og:price, itemprop price/sku, JSON-LD Product, "price": ...
+    price_text: bool = False       # "12,90 €" somewhere in the page
+    reference_text: bool = False   # réf / sku / part no
+    dimension_text: bool = False   # "35 mm"
+    head_done: bool = False
+
+    @property
+    def looks_like_product(self) -> bool:
+        return self.product_markup or self.reference_text or self.dimension_text
+
+    @property
+    def image_final(self) -> bool:
+        return self.image_source == "og" or (self.head_done and self.image_source in ("itemprop", "jsonld"))
+
+    @property
+    def has_price(self) -> bool:
+        return self.price_text or bool(self.price)
+
+    @property
+    def has_reference(self) -> bool:
+        return self.reference_text or bool(self.sku)
+
+    @property
+    def complete(self) -> bool:
+        """
+        Every score-relevant signal is known: the rest of the page cannot change the verdict.
+        With structured data (og:price / JSON-LD offer and SKU) and og:image this is usually the end of <head>.
+        """
+        return self.looks_like_product and self.has_price and self.has_reference and self.image_final
+
+    def html_score(self, base: int) -> int:
+        # a structured price / SKU counts as the price / reference text: the page need not be read further
+        score = base
+        if self.looks_like_product:
+            score += 50
+        if self.has_price:
+            score += 10
+        if self.has_reference:
+            score += 10
+        return score
+
+
+class PageAnalyzer:
+    """
+    Incremental single-pass analyzer: `feed()` chunks as they arrive and stop
+    reading as soon as `info.complete` is True. Only the part of the buffer
+    that cannot contain a truncated tag or JSON-LD block is scanned.
+    """
+
+    def __init__(self, max_ld_blocks: int = 3):
+        self.info = PageInfo()
+        self.max_ld_blocks = max_ld_blocks
+        self._ld_seen = 0
+        self._buf = ""
+        self._pos = 0
+
+    def feed(self, chunk: str, final: bool = False) -> PageInfo:
+        self._buf += chunk
+        end = len(self._buf)
+        if not final:
+            end = self._buf.rfind(">", self._pos) + 1
+            ld_open = None
+            for m in _LD_OPEN_RE.finditer(self._buf, self._pos):
+                ld_open = m
+            if ld_open is not None and self._buf.find("</script", ld_open.end()) < 0:
+                end = min(end, ld_open.start())
+            if end <= self._pos:
+                return self.info
+        for m in _TAG_RE.finditer(self._buf, self._pos, end):
+            self._handle(m)
+            if self.info.complete:
+                break
+        for kind in self._pending_signals():
+            if self._find_signal(kind, end):
+                self._set_signal(kind)
+        self._pos = end
+        # keep memory flat on long pages: drop what has been scanned
+        if self._pos > 65536:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        return self.info
+
+    def _pending_signals(self) -> Tuple[str, ...]:
+        info = self.info
+        kinds = []
+        if not info.product_markup:
+            kinds += ["itemprop", "price_json"]
+        if not info.price_text:
+            kinds.append("price_text")
+        if not info.reference_text:
+            kinds.append("reference")
+        if not info.looks_like_product:
+            kinds.append("mm")
+        return tuple(kinds)
+
+    def _find_signal(self, kind: str, end: int) -> bool:
+        rx = _SIGNAL_RES[kind]
+        pos = self._pos
+        while True:
+            m = rx.search(self._buf, pos, end)
+            if m is None:
+                return False
+            start = m.start()
+            if kind in _WORD_START and start > 0:
+                prev = self._buf[start - 1]
+                if prev.isalnum() or prev == "_" or (kind == "mm" and prev.isdigit()):
+                    pos = start + 1
+                    continue
+            return True
+
+    def _set_signal(self, kind: str) -> None:
+        if kind in ("itemprop", "price_json"):
+            self.info.product_markup = True
+        elif kind == "price_text":
+            self.info.price_text = True
+        elif kind == "reference":
+            self.info.reference_text = True
+        elif kind == "mm":
+            self.info.dimension_text = True
+
+    def close(self) -> PageInfo:
+        return self.feed("", final=True)
+
+    def _set_image(self, url: str, source: str) -> None:
+        if url and (not self.info.image or _IMAGE_PRIORITY[source] < _IMAGE_PRIORITY[self.info.image_source]):
+            self.info.image, self.info.image_source = url, source
+
+    def _handle(self, m: "re.Match") -> None:
+        info = self.info
+        kind = m.lastgroup
+        if kind == "ld":
+            if self._ld_seen < self.max_ld_blocks:
+                self._ld_seen += 1
+                self._handle_jsonld(m.group("ld"))
+        elif kind == "meta":
+            a = _attrs(m.group("meta"))
+            key = (a.get("property") or a.get("name") or a.get("itemprop") or "").lower()
+            content = a.get("content", "")
+            if key in ("og:image", "og:image:url", "og:image:secure_url"):
+                if info.image_source != "og":
+                    self._set_image(content, "og")
+            elif key == "image" and "itemprop" in a:
+                self._set_image(content, "itemprop")
+            elif key in ("og:price:amount", "product:price:amount", "price"):
+                info.product_markup = True
+                info.price = info.price or content
+            elif key in ("og:price:currency", "product:price:currency", "pricecurrency"):
+                info.currency = info.currency or content
+            elif key == "sku" or key == "product:retailer_item_id":
+                info.product_markup = True
+                info.sku = info.sku or content
+            elif key in ("og:availability", "product:availability", "availability"):
+                info.availability = info.availability or content
+        elif kind == "img":
+            if self.info.image_source in ("og", "itemprop", "jsonld"):
+                return
+            a = _attrs(m.group("img"))
+            src = a.get("src", "")
+            if _PRODUCT_CLASS_RE.search(a.get("class", "")):
+                self._set_image(src, "img_product")
+            else:
+                self._set_image(src, "img")
+        elif kind == "head_end":
+            info.head_done = True
+
+    def _handle_jsonld(self, raw: str) -> None:
+        try:
+            doc = json.loads(raw.strip())
+        except Exception:
+            return
+        for node in _iter_nodes(doc):
+            types = node.get("@type")
+            types = types if isinstance(types, list) else [types]
+            if "Product" not in types:
+                continue
+            info = self.info
+            info.product_markup = True
+            info.sku = info.sku or str(node.get("sku") or node.get("mpn") or node.get("gtin13") or "")
+            image = node.get("image")
+            if isinstance(image, list):
+                image = image[0] if image else ""
+            if isinstance(image, dict):
+                image = image.get("url", "")
+            if isinstance(image, str):
+                self._set_image(image, "jsonld")
+            offers = node.get("offers")
+            if isinstance(offers, list):
+                offers = offers[0] if offers else None
+            if isinstance(offers, dict):
+                price = offers.get("price") or offers.get("lowPrice")
+                if price is not None:
+                    info.price = info.price or str(price)
+                info.currency = info.currency or str(offers.get("priceCurrency") or "")
+                availability = str(offers.get("availability") or "")
+                info.availability = info.availability or availability.rsplit("/", 1)[-1]
+            return
+
+
+def _iter_nodes(doc: Any) -> List[Dict[str, Any]]:
+    if isinstance(doc, list):
+        return [n for d in doc for n in _iter_nodes(d)]
+    if isinstance(doc, dict):
+        return [doc] + (_iter_nodes(doc["@graph"]) if isinstance(doc.get("@graph"), list) else [])
+    return []
+
+
+def analyze_html(html_text: str) -> PageInfo:
+    analyzer = PageAnalyzer()
+    analyzer.feed(html_text or "", final=True)
+    return analyzer.info
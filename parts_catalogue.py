@@ -0,0 +1,256 @@
+"""
+Local catalogue of already-sourced parts, searchable by image embedding.
+
+Layout of the catalogue directory:
+  vectors.npy   float16 (N, dim) product-image embeddings (memory-mapped)
+  items.json    metadata of the N rows (name, url, price, mat, std, ...)
+  ivf.npz       coarse k-means centroids + row assignments (inverted lists)
+  journal.jsonl rows inserted since the last rebuild
+
+Offline compaction / re-clustering:
+  python -m parts_catalogue rebuild [--dir .cache/catalogue] [--lists N]
+"""
+import argparse
+import base64
+import glob
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from database_standards import find_standard
+
+BRUTE_FORCE_LIMIT = 4096  # below this many rows an exact scan is faster than the IVF probe
+
+
+def _to_vector(emb) -> np.ndarray:
+    if hasattr(emb, "detach"):
+        emb = emb.detach().cpu().numpy()
+    vec = np.asarray(emb, dtype=np.float32).reshape(-1)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+class PartsCatalogue:
+
+    def __init__(self, directory: str, dim: int = 512, n_probe: int = 4):
+        self.directory = directory
+        self.dim = dim
+        self.n_probe = n_probe
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    # -------------------------
+    # Persistence
+    # -------------------------
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self) -> None:
+        self._base = np.zeros((0, self.dim), dtype=np.float16)
+        self._items: List[Dict[str, Any]] = []
+        self._centroids: Optional[np.ndarray] = None
+        self._lists: List[np.ndarray] = []
+        if os.path.exists(self._path("vectors.npy")) and os.path.exists(self._path("items.json")):
+            self._base = np.load(self._path("vectors.npy"), mmap_mode="r")
+            with open(self._path("items.json"), encoding="utf-8") as f:
+                self._items = json.load(f)
+            if os.path.exists(self._path("ivf.npz")):
+                ivf = np.load(self._path("ivf.npz"))
+                self._centroids = ivf["centroids"]
+                assign = ivf["assign"]
+                self._lists = [np.flatnonzero(assign == i) for i in range(len(self._centroids))]
+        self._extra_vecs: List[np.ndarray] = []
+        self._extra_items: List[Dict[str, Any]] = []
+        self._urls = {it["url"] for it in self._items}
+        self._base_mtime = self._mtime("items.json")
+        self._journal_offset = 0
+        self._tail_journal()
+
+    def _mtime(self, name: str) -> float:
+        try:
+            return os.stat(self._path(name)).st_mtime
+        except OSError:
+            return 0.0
+
+    def _tail_journal(self) -> None:
+        """Appends the journal rows written since the last read (by this or another worker)."""
+        self._journal_offset += self._read_journal(self._path("journal.jsonl"), self._journal_offset)
+
+    def _read_journal(self, path: str, offset: int) -> int:
+        """Appends the rows of `path` from byte `offset` on; returns the number of bytes consumed."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a trailing partial line is read on the next call
+        for line in data[:end].splitlines():
+            try:
+                row = json.loads(line)
+                vec = np.frombuffer(base64.b64decode(row.pop("vec")), dtype=np.float16).astype(np.float32)
+            except Exception:
+                continue  # torn write
+            if vec.shape[0] == self.dim and row.get("url") not in self._urls:
+                self._extra_items.append(row)
+                self._extra_vecs.append(vec)
+                self._urls.add(row["url"])
+        return end
+
+    def refresh(self) -> None:
+        """
+        Picks up what other processes did to the directory: journal appends are
+        tailed, a rebuild (new items.json, rotated journal) triggers a reload.
+        """
+        try:
+            size = os.path.getsize(self._path("journal.jsonl"))
+        except OSError:
+            size = 0
+        with self._lock:
+            if self._mtime("items.json") != self._base_mtime or size < self._journal_offset:
+                self._load()
+            elif size > self._journal_offset:
+                self._tail_journal()
+
+    # -------------------------
+    # Inserts
+    # -------------------------
+    def add(self, emb, name: str, url: str, price: str = "", mat: str = "", std: str = "",
+            domain: str = "", product_image: str = "", score: int = 0) -> bool:
+        """Appends a validated product. Returns False if the URL is already catalogued."""
+        if emb is None or not url:
+            return False
+        vec = _to_vector(emb)
+        if vec.shape[0] != self.dim:
+            return False
+        item = {
+            "name": name, "url": url, "price": price, "mat": mat, "std": std,
+            "standard": find_standard(std) or "", "domain": domain,
+            "product_image": product_image, "score": score, "added": time.time(),
+        }
+        self.refresh()
+        with self._lock:
+            if url in self._urls:
+                return False
+            row = dict(item, vec=base64.b64encode(vec.astype(np.float16).tobytes()).decode("ascii"))
+            with open(self._path("journal.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self._tail_journal()  # reads our row back, with any row other workers appended before it
+        return True
+
+    # -------------------------
+    # Search
+    # -------------------------
+    def search(self, emb, k: int = 5, min_similarity: float = 0.0) -> List[Tuple[float, Dict[str, Any]]]:
+        q = _to_vector(emb)
+        self.refresh()
+        with self._lock:
+            # one consistent view: another thread may reload the directory while we score
+            base, items, centroids, lists = self._base, self._items, self._centroids, self._lists
+            extra_vecs = list(self._extra_vecs)
+            extra_items = list(self._extra_items)
+        scored: List[Tuple[float, Dict[str, Any]]] = []
+
+        n = len(items)
+        if n:
+            if centroids is not None and n > BRUTE_FORCE_LIMIT:
+                probe = np.argsort(-(centroids @ q))[: self.n_probe]
+                rows = np.concatenate([lists[i] for i in probe])
+            else:
+                rows = np.arange(n)
+            if rows.size:
+                sims = np.asarray(base[rows], dtype=np.float32) @ q
+                top = np.argsort(-sims)[:k]
+                scored.extend((float(sims[i]), items[int(rows[i])]) for i in top)
+
+        if extra_vecs:
+            sims = np.stack(extra_vecs) @ q
+            top = np.argsort(-sims)[:k]
+            scored.extend((float(sims[i]), extra_items[int(i)]) for i in top)
+
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return [s for s in scored[:k] if s[0] >= min_similarity]
+
+    def __len__(self) -> int:
+        return len(self._items) + len(self._extra_items)
+
+    # -------------------------
+    # Offline rebuild
+    # -------------------------
+    def rebuild(self, n_lists: Optional[int] = None, iterations: int = 12) -> Dict[str, int]:
+        """Merges the journal into the base matrix (dedup by URL) and re-clusters the IVF lists."""
+        journal = self._path("journal.jsonl")
+        with self._lock:
+            # Catch up with the journal, then set it aside by renaming it: rows other
+            # workers append from now on go to a new journal that survives the rebuild.
+            # A journal set aside by a rebuild that did not finish is merged too.
+            self._tail_journal()
+            rotated = f"{journal}.{time.time_ns()}"
+            if os.path.exists(journal):
+                os.replace(journal, rotated)
+                self._read_journal(rotated, self._journal_offset)  # appended between the tail and the rename
+            merged_journals = glob.glob(f"{journal}.*")
+            for path in merged_journals:
+                if path != rotated:
+                    self._read_journal(path, 0)
+            rows: Dict[str, Tuple[Dict[str, Any], np.ndarray]] = {}
+            for i, item in enumerate(self._items):
+                rows[item["url"]] = (item, np.asarray(self._base[i], dtype=np.float32))
+            for item, vec in zip(self._extra_items, self._extra_vecs):
+                rows[item["url"]] = (item, vec)
+            items = [r[0] for r in rows.values()]
+            mat = np.stack([r[1] for r in rows.values()]) if rows else np.zeros((0, self.dim), dtype=np.float32)
+
+            tmp = self._path("vectors.npy.tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, mat.astype(np.float16))
+            os.replace(tmp, self._path("vectors.npy"))
+            with open(self._path("items.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+            os.replace(self._path("items.json.tmp"), self._path("items.json"))
+
+            n_lists = n_lists or max(1, int(np.sqrt(len(items))))
+            if len(items) >= 2 * n_lists:
+                centroids, assign = _spherical_kmeans(mat, n_lists, iterations)
+                with open(self._path("ivf.npz.tmp"), "wb") as f:
+                    np.savez(f, centroids=centroids, assign=assign)
+                os.replace(self._path("ivf.npz.tmp"), self._path("ivf.npz"))
+            elif os.path.exists(self._path("ivf.npz")):
+                os.remove(self._path("ivf.npz"))
+            for path in merged_journals:
+                os.remove(path)
+            self._load()
+        return {"rows": len(items), "lists": len(self._lists)}
+
+
+def _spherical_kmeans(mat: np.ndarray, k: int, iterations: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    centroids = mat[rng.choice(len(mat), size=k, replace=False)].copy()
+    assign = np.zeros(len(mat), dtype=np.int32)
+    for _ in range(iterations):
+        assign = np.argmax(mat @ centroids.T, axis=1).astype(np.int32)
+        for c in range(k):
+            members = mat[assign == c]
+            if len(members):
+                centre = members.sum(axis=0)
+                centroids[c] = centre / (np.linalg.norm(centre) or 1.0)
+    return centroids.astype(np.float32), assign
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parts catalogue maintenance")
+    parser.add_argument("command", choices=["rebuild", "stats"])
+    parser.add_argument("--dir", default=os.environ.get("CATALOGUE_DIR", ".cache/catalogue"))
+    parser.add_argument("--dim", type=int, default=int(os.environ.get("EMBED_STORE_DIM", "512")))
+    parser.add_argument("--lists", type=int, default=None)
+    args = parser.parse_args()
+    catalogue = PartsCatalogue(args.dir, dim=args.dim)
+    if args.command == "rebuild":
+        print(catalogue.rebuild(n_lists=args.lists))
+    else:
+        print({"rows": len(catalogue), "base": len(catalogue._items), "journal": len(catalogue._extra_items),
+               "lists": len(catalogue._lists)})
@@ -0,0 +1,254 @@
+"""
+Client-side rate limiting of the remote APIs (Groq vision, Perplexity).
+
+One ProviderLimiter per provider, shared by every request of the worker:
+- token bucket (`rpm`, `burst`) spacing the calls; rpm=0 = no static limit
+- quota headers (x-ratelimit-remaining-* / x-ratelimit-reset-*) and 429
+  Retry-After block the provider for every caller until the quota resets,
+  instead of each request discovering the 429 on its own
+- jittered exponential backoff, Retry-After when the provider sent one
+- circuit breaker: after `failure_threshold` consecutive failures (5xx,
+  timeouts, connection errors) calls fail fast for `cooldown` seconds, then
+  a single probe decides whether the provider is back; a probe that ends
+  without an outcome (cancelled) must call release_probe()
+
+SingleFlight coalesces identical in-flight calls (same query).
+"""
+import asyncio
+import email.utils
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+class RateLimited(Exception):
+    """No call slot available for the provider within the caller's budget."""
+
+
+class CircuitOpen(Exception):
+    """The provider is failing: calls are refused until the cool-down ends."""
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of a reset header: plain seconds or Groq style "1m30.5s", "7.66s", "250ms"."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    return sum(float(n) * _UNITS[unit] for n, unit in parts) if parts else None
+
+
+def retry_after_seconds(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Virtual-scheduling bucket: `reserve()` takes a token now (the balance may
+    go negative) and returns how long the caller must wait for it, so waiters
+    are served in arrival order without a lock.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self.tokens -= 1.0
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def cancel(self) -> None:
+        self.tokens += 1.0
+
+
+class ProviderLimiter:
+
+    def __init__(self, name: str, rpm: float = 0.0, burst: Optional[float] = None, failure_threshold: int = 5,
+                 cooldown: float = 30.0, backoff_base: float = 1.0, backoff_cap: float = 20.0):
+        self.name = name
+        self.bucket = TokenBucket(rpm / 60.0, burst or max(1.0, rpm / 6.0)) if rpm > 0 else None
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._blocked_until = 0.0
+        self._failures = 0
+        self._rate_limited_streak = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.stats = {"requests": 0, "throttled": 0, "wait_seconds": 0.0, "rate_limited": 0, "rejected": 0,
+                      "failures": 0, "circuit_opens": 0, "retries": 0, "coalesced": 0}
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    @property
+    def blocked_for(self) -> float:
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    @property
+    def throttling(self) -> bool:
+        """Quota exhausted or last answer was a 429: extra (hedged) calls would only make it worse."""
+        return self.blocked_for > 0 or self._rate_limited_streak > 0
+
+    # -------------------------
+    # Before a call
+    # -------------------------
+    async def acquire(self, max_wait: float) -> bool:
+        """
+        Waits for a call slot. Raises CircuitOpen, or RateLimited if the wait would exceed `max_wait`.
+        Returns True when the call is the half-open probe: it must end with record() or release_probe().
+        """
+        probe = False
+        if self._opened_at is not None:
+            if self.state == "open":
+                self.stats["rejected"] += 1
+                raise CircuitOpen(self.name)
+            self._probing = probe = True  # half-open: this call decides
+        wait = self.blocked_for
+        if self.bucket is not None:
+            wait = max(wait, self.bucket.reserve())
+        if wait > max_wait:
+            if self.bucket is not None:
+                self.bucket.cancel()
+            if probe:
+                self._probing = False
+            self.stats["rejected"] += 1
+            raise RateLimited(self.name)
+        if wait > 0:
+            self.stats["throttled"] += 1
+            self.stats["wait_seconds"] += wait
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                if probe:
+                    self._probing = False
+                raise
+        self.stats["requests"] += 1
+        return probe
+
+    def try_acquire(self) -> bool:
+        """Takes a call slot only if one is free right now and the circuit is closed (optional extra calls)."""
+        if self._opened_at is not None or self.blocked_for > 0:
+            return False
+        if self.bucket is not None and self.bucket.reserve() > 0:
+            self.bucket.cancel()
+            return False
+        self.stats["requests"] += 1
+        return True
+
+    def release_probe(self) -> None:
+        """The probe call ended without an outcome (cancelled, timed out in a queue): the next call probes."""
+        self._probing = False
+
+    # -------------------------
+    # After a call
+    # -------------------------
+    def record(self, status: Optional[int], headers: Optional[Mapping[str, str]] = None) -> None:
+        """Outcome of one call: HTTP status (None for a timeout / connection error) and response headers."""
+        if headers is not None:
+            for kind in ("requests", "tokens"):
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                try:
+                    exhausted = remaining is not None and float(remaining) <= 0
+                except ValueError:
+                    exhausted = False
+                if exhausted and reset:
+                    self._block(reset)
+        if status == 429:
+            self.stats["rate_limited"] += 1
+            self._rate_limited_streak += 1
+            self._probing = False
+            self._block(retry_after_seconds(headers) or self.backoff(self._rate_limited_streak - 1))
+        elif status is None or status >= 500:
+            self._failure()
+        else:
+            self._rate_limited_streak = 0
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def _block(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def _failure(self) -> None:
+        self._failures += 1
+        self.stats["failures"] += 1
+        if self._probing or self._failures >= self.failure_threshold:
+            if self._opened_at is None or self._probing:
+                self.stats["circuit_opens"] += 1
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `attempt + 1`: Retry-After plus jitter, else jittered exponential."""
+        if retry_after is not None:
+            return retry_after + random.uniform(0.0, min(1.0, 0.1 * retry_after + 0.05))
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return delay / 2 + random.uniform(0.0, delay / 2)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        s["state"] = self.state
+        s["blocked_for"] = round(self.blocked_for, 3)
+        s["consecutive_failures"] = self._failures
+        return s
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution (the first
+    caller's). The call is cancelled once every caller has gone away.
+    """
+
+    def __init__(self, limiter: Optional[ProviderLimiter] = None):
+        self.limiter = limiter
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        elif self.limiter is not None:
+            self.limiter.stats["coalesced"] += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield: one caller going away must not cancel the call the others wait for
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()  # the last caller was cancelled: nobody needs the answer
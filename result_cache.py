@@ -0,0 +1,64 @@
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase, accent-fold and collapse whitespace."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.lower().split())
+
+
+class ResultCache:
+    """
+    Identification results keyed by (perceptual hash of the photo, normalized context).
+    A lookup hits when a stored photo with the same context is within
+    `max_distance` bits (Hamming distance between 64-bit dHashes), so
+    near-duplicate shots of the same part reuse the previous answer.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 6 * 3600, max_distance: int = 6):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def lookup(self, phash: int, context: str) -> Optional[Dict[str, Any]]:
+        ctx = normalize_text(context)
+        now = time.monotonic()
+        best_key, best_dist = None, self.max_distance + 1
+        for key, (expires, _) in list(self._entries.items()):
+            if expires < now:
+                del self._entries[key]
+                continue
+            if key[1] != ctx:
+                continue
+            dist = (key[0] ^ phash).bit_count()
+            if dist < best_dist:
+                best_key, best_dist = key, dist
+                if dist == 0:
+                    break
+        if best_key is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key][1]
+
+    def store(self, phash: int, context: str, result: Dict[str, Any]) -> None:
+        key = (phash, normalize_text(context))
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        s["size"] = len(self._entries)
+        lookups = s["hits"] + s["misses"]
+        s["hit_ratio"] = s["hits"] / lookups if lookups else 0.0
+        return s
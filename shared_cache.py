@@ -0,0 +1,73 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, List, Optional
+
+
+class SharedCache:
+    """
+    Small JSON key/value cache in one SQLite file (WAL mode), shared by every
+    uvicorn worker of the host: second-level tier behind the in-memory caches,
+    so a page analysed or a photo identified by one worker is reused by the
+    others. Values must be JSON-serializable (no tensors). Rows carry their
+    own expiry; `max_rows` per namespace bounds the file.
+    """
+
+    PURGE_EVERY = 256  # writes between two purges of expired / surplus rows
+
+    def __init__(self, path: str, max_rows: int = 20000):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._writes = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                ns TEXT NOT NULL, key TEXT NOT NULL, expires REAL NOT NULL, value TEXT NOT NULL,
+                PRIMARY KEY (ns, key));
+            CREATE INDEX IF NOT EXISTS entries_expires ON entries(ns, expires);
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ns: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._db.execute("SELECT expires, value FROM entries WHERE ns=? AND key=?", (ns, key)).fetchone()
+        if row is None or row[0] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[1])
+
+    def keys(self, ns: str, prefix: str = "") -> List[str]:
+        """Live keys of `ns` starting with `prefix` (values are not decoded)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key FROM entries WHERE ns=? AND key >= ? AND key < ? AND expires >= ?",
+                (ns, prefix, prefix + "\uffff", time.time()),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def set(self, ns: str, key: str, value: Any, ttl: float) -> None:
+        payload = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO entries(ns, key, expires, value) VALUES (?,?,?,?)",
+                             (ns, key, time.time() + ttl, payload))
+            self._writes += 1
+            if self._writes % self.PURGE_EVERY == 0:
+                self._purge(ns)
+
+    def _purge(self, ns: str) -> None:
+        self._db.execute("DELETE FROM entries WHERE ns=? AND expires < ?", (ns, time.time()))
+        self._db.execute(
+            "DELETE FROM entries WHERE ns=? AND key IN (SELECT key FROM entries WHERE ns=? ORDER BY expires DESC "
+            "LIMIT -1 OFFSET ?)", (ns, ns, self.max_rows))
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,142 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from database_standards import canonical_query
+from result_cache import normalize_text
+from shared_cache import SharedCache
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[/.,x][a-z0-9]+)*")
+_STOPWORDS = {"a", "au", "aux", "d", "de", "des", "du", "en", "et", "l", "la", "le", "les", "pour", "un", "une"}
+
+
+def query_key(query: str) -> str:
+    """
+    Cache key of a search query: standards canonicalized ("1/2 pouce" -> 15/21),
+    lowercased, accent-folded, "35 mm" -> "35mm", stopwords dropped, tokens
+    sorted, so rewordings of the same part share one entry.
+    """
+    text = normalize_text(canonical_query(query))
+    text = re.sub(r"(\d)\s+mm\b", r"\1mm", text)
+    return " ".join(sorted({t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS}))
+
+
+class SourcingCache:
+    """
+    Perplexity candidate lists by normalized query.
+    - fresh for `ttl` seconds, then served stale for up to `stale_ttl` more
+      while a single background call refreshes the entry
+    - in-memory LRU in front of a SharedCache file, so entries survive
+      restarts and are shared by the workers of the host
+    - errors and empty answers are not cached
+    """
+
+    NS = "sourcing"
+
+    def __init__(self, store: Optional[SharedCache], maxsize: int = 2048, ttl: float = 6 * 3600,
+                 stale_ttl: float = 24 * 3600):
+        self.store = store
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    async def _lookup(self, key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        entry = self._data.get(key)
+        if entry is None and self.store is not None:
+            try:
+                row = await asyncio.to_thread(self.store.get, self.NS, key)
+            except Exception:
+                row = None
+            if row is not None:
+                entry = (row["fetched"], row["result"])
+                self._remember(key, entry)
+        if entry is not None:
+            self._data.move_to_end(key)
+        return entry
+
+    def _remember(self, key: str, entry: Tuple[float, Dict[str, Any]]) -> None:
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def _store(self, key: str, result: Dict[str, Any]) -> None:
+        if "error" in result or not result.get("candidates"):
+            return
+        fetched = time.time()
+        self._remember(key, (fetched, result))
+        if self.store is not None:
+            try:
+                await asyncio.to_thread(self.store.set, self.NS, key, {"fetched": fetched, "result": result},
+                                        self.ttl + self.stale_ttl)
+            except Exception:
+                pass
+
+    async def get_or_fetch(self, query: str, max_candidates: int, fetch: Callable[[], Awaitable[Dict[str, Any]]],
+                           refresh: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None) -> Dict[str, Any]:
+        """
+        Cached answer for `query`, else `fetch()`. A stale answer is returned
+        right away and `refresh()` (default `fetch`, which should not carry
+        the caller's deadline) runs in the background.
+        """
+        if not self.enabled:
+            return await fetch()
+        key = f"{max_candidates}:{query_key(query)}"
+        entry = await self._lookup(key)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age < self.ttl:
+                self.stats["hits"] += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                self._schedule_refresh(key, refresh or fetch)
+                return entry[1]
+        self.stats["misses"] += 1
+        result = await fetch()
+        await self._store(key, result)
+        return result
+
+    def _schedule_refresh(self, key: str, refresh: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, refresh))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: str, refresh: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        self.stats["refreshes"] += 1
+        try:
+            result = await refresh()
+            if "error" in result:
+                self.stats["refresh_errors"] += 1  # the stale entry keeps being served
+            await self._store(key, result)
+        except Exception:
+            self.stats["refresh_errors"] += 1
+        finally:
+            self._refreshing.discard(key)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        lookups = s["hits"] + s["stale_hits"] + s["misses"]
+        s["size"] = len(self._data)
+        s["refreshing"] = len(self._refreshing)
+        s["hit_ratio"] = (s["hits"] + s["stale_hits"]) / lookups if lookups else 0.0
+        return s
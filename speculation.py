@@ -0,0 +1,152 @@
+"""
+Speculative sourcing: Perplexity queries started while Groq vision is still running.
+
+The search query of a photo is guessed from
+- the queries vision produced for near-identical photos (dHash within
+  `max_distance` bits, same context first)
+- the technician's context, when it names a known standard
+When vision answers, the prefetch whose query matches the real one (same
+normalized tokens, or a token overlap of at least `min_overlap`) is used and
+the others are cancelled; a miss falls back to the normal sourcing call.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from database_standards import relevant_standards
+from result_cache import normalize_text
+from sourcing_cache import query_key
+
+Fetch = Callable[[str], Awaitable[Dict[str, Any]]]
+
+
+def query_overlap(a: str, b: str) -> float:
+    """Jaccard overlap of the normalized tokens of two search queries (1.0 = same cache key)."""
+    ta, tb = set(query_key(a).split()), set(query_key(b).split())
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+
+def _consume(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()  # an unused prefetch that failed must not log "exception never retrieved"
+
+
+class Speculation:
+    """The prefetches of one identification: `launch()` with vision, then `claim()` or `cancel()` once."""
+
+    def __init__(self, owner: "SpeculativeSourcing", guesses: List[Tuple[str, str]], fetch: Fetch):
+        self.owner = owner
+        self.guesses = guesses  # (source, query)
+        self._fetch = fetch
+        self.tasks: List[Tuple[str, str, asyncio.Task]] = []
+        self.resolved = False
+
+    def launch(self) -> None:
+        for source, query in self.guesses:
+            task = asyncio.create_task(self._fetch(query))
+            task.add_done_callback(_consume)
+            self.tasks.append((source, query, task))
+        self.owner.stats["launched"] += len(self.tasks)
+
+    def claim(self, query: str) -> Optional[asyncio.Task]:
+        """The prefetch answering the real `query`, or None; every other prefetch is dropped."""
+        if self.resolved:
+            return None
+        self.resolved = True
+        best, best_score = None, self.owner.min_overlap
+        for entry in self.tasks:
+            task = entry[2]
+            if task.done() and (task.cancelled() or task.exception() is not None or "error" in task.result()):
+                continue
+            score = query_overlap(entry[1], query)
+            if score >= best_score:
+                best, best_score = entry, score
+        if self.tasks:
+            if best is None:
+                self.owner.stats["misses"] += 1
+            else:
+                self.owner.stats["hits"] += 1
+                self.owner.hits_by_source[best[0]] = self.owner.hits_by_source.get(best[0], 0) + 1
+        self._drop(keep=best[2] if best is not None else None)
+        return best[2] if best is not None else None
+
+    def cancel(self) -> None:
+        """Vision failed: nothing will be sourced."""
+        if not self.resolved:
+            self.resolved = True
+            self._drop()
+
+    def _drop(self, keep: Optional[asyncio.Task] = None) -> None:
+        for _, _, task in self.tasks:
+            if task is keep:
+                continue
+            self.owner.stats["unused"] += 1
+            if task.done():
+                self.owner.stats["unused_answered"] += 1  # paid for, but kept by the sourcing cache
+            else:
+                self.owner.stats["cancelled"] += 1
+                task.cancel()
+
+
+class SpeculativeSourcing:
+    """Query predictor (recent vision queries by photo hash) and the speculation stats, shared by the worker."""
+
+    def __init__(self, max_queries: int = 2, min_overlap: float = 0.75, max_distance: int = 10, history: int = 2048):
+        self.max_queries = max_queries
+        self.min_overlap = min_overlap
+        self.max_distance = max_distance
+        self.history = history
+        self._queries: "OrderedDict[Tuple[int, str], str]" = OrderedDict()
+        self.stats = {"requests": 0, "skipped": 0, "launched": 0, "hits": 0, "misses": 0, "unused": 0,
+                      "unused_answered": 0, "cancelled": 0}
+        self.hits_by_source: Dict[str, int] = {}
+
+    def observe(self, phash: int, context: str, query: str) -> None:
+        """Records the query vision produced for a photo."""
+        key = (phash, normalize_text(context))
+        self._queries[key] = query
+        self._queries.move_to_end(key)
+        while len(self._queries) > self.history:
+            self._queries.popitem(last=False)
+
+    def predict(self, phash: int, context: str) -> List[Tuple[str, str]]:
+        """Up to `max_queries` (source, query) guesses, most likely first."""
+        ctx = normalize_text(context)
+        near = []
+        for (other, other_ctx), query in self._queries.items():
+            dist = (other ^ phash).bit_count()
+            if dist <= self.max_distance:
+                near.append((dist + (0 if other_ctx == ctx else 1), query))
+        guesses: List[Tuple[str, str]] = []
+        seen = set()
+
+        def _add(source: str, query: str) -> None:
+            key = query_key(query)
+            if key and key not in seen and len(guesses) < self.max_queries:
+                seen.add(key)
+                guesses.append((source, query))
+
+        for _, query in sorted(near, key=lambda n: n[0]):
+            _add("history", query)
+        if relevant_standards(context):
+            _add("context", context)
+        return guesses
+
+    def start(self, phash: int, context: str, fetch: Fetch, allowed: bool = True) -> Speculation:
+        """The speculation of one identification (no prefetch unless `allowed` and something can be guessed)."""
+        guesses: List[Tuple[str, str]] = []
+        if allowed and self.max_queries > 0:
+            self.stats["requests"] += 1
+            guesses = self.predict(phash, context)
+            if not guesses:
+                self.stats["skipped"] += 1
+        return Speculation(self, guesses, fetch)
+
+    def snapshot(self) -> Dict[str, Any]:
+        s = dict(self.stats)
+        resolved = s["hits"] + s["misses"]
+        s["hit_rate"] = s["hits"] / resolved if resolved else 0.0
+        s["wasted_ratio"] = s["unused"] / s["launched"] if s["launched"] else 0.0
+        s["hits_by_source"] = dict(self.hits_by_source)
+        s["history"] = len(self._queries)
+        return s
@@ -0,0 +1,135 @@
+"""
+Canonical merchant URLs, so one product is fetched, scored and cached once.
+
+Perplexity returns the same product under several URLs: tracking parameters
+(utm_*, gclid, Amazon ref / pd_rd_*), mobile hosts (m.ebay.fr), country or
+www variants, Amazon's many URL shapes (/dp/, /gp/product/, /Title/dp/...).
+
+- canonical_url(url)  the product page URL to fetch and show: tracking
+                      parameters and the fragment dropped (the other
+                      parameters are kept as written, in their order), host
+                      lowercased, a known merchant's mobile host -> www;
+                      Amazon / eBay / AliExpress rewritten to their short
+                      product URL
+- product_key(url)    cache and de-duplication key: "merchant:product id"
+                      for the merchants of WHITELIST_DOMAINS whose URLs carry
+                      one (ASIN, item number, SKU), else the canonical URL
+                      without scheme and www, parameters sorted
+- canonical_domain()  host without www / mobile prefixes
+
+Only product page URLs go through here; image URLs are fetched as found.
+"""
+import re
+from typing import Optional, Tuple
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+_TRACKING = {"gclid", "gbraid", "wbraid", "dclid", "fbclid", "msclkid", "yclid", "igshid", "srsltid", "mc_cid",
+             "mc_eid", "_ga", "_gl", "spm", "scm", "aff_platform", "aff_trace_key"}
+_TRACKING_PREFIXES = ("utm_", "pd_rd_", "pf_rd_", "algo_", "_trk")
+_AMAZON_PARAMS = {"ref", "ref_", "tag", "th", "psc", "qid", "sr", "keywords", "crid", "sprefix", "dib", "dib_tag",
+                  "content-id", "linkcode", "linkid", "camp", "creative", "creativeasin", "ascsubtag", "smid"}
+_MOBILE_PREFIXES = ("www.", "m.", "mobile.", "amp.", "smile.")
+_DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+# (host pattern, path pattern giving the product id, short product URL or None to keep the path)
+_PRODUCT_IDS = [
+    (re.compile(r"(^|\.)amazon\.[a-z.]+$"),
+     re.compile(r"/(?:dp|gp/product|gp/aw/d|o|exec/obidos/asin|product)/([a-z0-9]{10})(?:[/?]|$)", re.I),
+     "https://www.{host}/dp/{id}"),
+    (re.compile(r"(^|\.)ebay\.[a-z.]+$"), re.compile(r"/itm/(?:[^/]+/)?(\d{9,15})(?:[/?]|$)"),
+     "https://www.{host}/itm/{id}"),
+    (re.compile(r"(^|\.)aliexpress\.[a-z.]+$"), re.compile(r"/item/(?:[^/]+/)?(\d+)\.html"),
+     "https://www.aliexpress.com/item/{id}.html"),
+    (re.compile(r"(^|\.)manomano\.[a-z.]+$"), re.compile(r"/p/[^/]*?-?(\d{5,})/?$"), None),
+    (re.compile(r"(^|\.)leroymerlin\.[a-z.]+$"), re.compile(r"-(\d{6,})\.html$"), None),
+    (re.compile(r"(^|\.)rs-(?:online|components)\.[a-z.]+$"), re.compile(r"/web/p/(?:[^/]+/)?(\d{6,8})/?$"), None),
+    (re.compile(r"(^|\.)digikey\.[a-z.]+$"), re.compile(r"/products/detail/[^/]+/[^/]+/(\d+)"), None),
+    (re.compile(r"(^|\.)farnell\.[a-z.]+$"), re.compile(r"/dp/(\d{5,})"), None),
+    (re.compile(r"(^|\.)conrad\.[a-z.]+$"), re.compile(r"/p/[^/]*?-(\d{5,})(?:\.html)?/?$"), None),
+    (re.compile(r"(^|\.)mouser\.[a-z.]+$"), re.compile(r"/productdetail/([^?#]+?)/?$", re.I), None),
+]
+
+
+def canonical_domain(host_or_url: str) -> str:
+    """Lowercased host without port and www / m. / mobile. prefixes ("m.ebay.fr" -> "ebay.fr")."""
+    host = host_or_url
+    if "//" in host_or_url:
+        try:
+            host = urlsplit(host_or_url).hostname or ""
+        except ValueError:
+            return ""
+    host = (host or "").lower().rstrip(".")
+    changed = True
+    while changed:
+        changed = False
+        for prefix in _MOBILE_PREFIXES:
+            if host.startswith(prefix) and host.count(".") > 1:
+                host, changed = host[len(prefix):], True
+    if re.search(r"(^|\.)aliexpress\.[a-z.]+$", host):
+        return "aliexpress.com"  # fr. / es. / de. ... storefronts of the same catalogue
+    return host
+
+
+def _product_id(domain: str, path: str) -> Tuple[Optional[str], Optional[str]]:
+    for host_re, path_re, template in _PRODUCT_IDS:
+        if host_re.search(domain):
+            m = path_re.search(path)
+            if m:
+                pid = m.group(1)
+                return (pid.upper() if "amazon." in domain else pid.lower()), template  # ASINs are upper case
+            return None, None
+    return None, None
+
+
+def _clean_query(query: str, domain: str) -> str:
+    """`query` without its tracking parameters; the others are kept byte for byte, in order."""
+    amazon = "amazon." in domain
+    kept = []
+    for param in query.split("&"):
+        if not param:
+            continue
+        k = unquote_plus(param.split("=", 1)[0]).lower()
+        if k in _TRACKING or k.startswith(_TRACKING_PREFIXES) or (amazon and k in _AMAZON_PARAMS):
+            continue
+        kept.append(param)
+    return "&".join(kept)
+
+
+def canonical_url(url: str) -> str:
+    """The URL to fetch for `url` (returned unchanged when it cannot be parsed)."""
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or "").lower()
+        if scheme not in ("http", "https") or not host:
+            return url
+        port = parts.port
+    except (ValueError, AttributeError):
+        return url
+    domain = canonical_domain(host)
+    pid, template = _product_id(domain, parts.path)
+    if pid and template:
+        return template.format(host=domain, id=pid)
+    if (host.split(".", 1)[0] in ("m", "mobile", "amp") and domain != host
+            and any(host_re.search(domain) for host_re, _, _ in _PRODUCT_IDS)):
+        host = "www." + domain  # merchant's mobile storefront -> desktop page (better structured data)
+    netloc = host if port is None or str(port) == _DEFAULT_PORTS[scheme] else f"{host}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", _clean_query(parts.query, domain), ""))
+
+
+def product_key(url: str) -> str:
+    """Key identifying the product behind `url`: the same for every variant of its URL."""
+    canonical = canonical_url(url)
+    try:
+        parts = urlsplit(canonical)
+    except ValueError:
+        return canonical
+    domain = canonical_domain(parts.hostname or "")
+    if not domain:
+        return canonical
+    query = "&".join(sorted(parts.query.split("&"))) if parts.query else ""  # same product in any parameter order
+    pid, _ = _product_id(domain, parts.path)
+    if pid:
+        return f"{domain}:{pid}" + (f"?{query}" if query else "")
+    path = parts.path.rstrip("/") or "/"
+    return f"{domain}{path}" + (f"?{query}" if query else "")